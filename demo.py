@@ -42,6 +42,19 @@ def check_again(task: ScanType):
         )
 
 
+def check_again_all(tasks):
+    # same as `check_again` for each task, but walking and opening each file only once.
+    for dir_path in input_dirs:
+        # parse the iTunes lib name from the full path.
+        name_this = dir_path.split('/')[5]
+        print(name_this)
+        scan_one_dir(
+            input_dir=dir_path, output_dir=f'output_20210806_with_mutagen_again/{name_this}',
+            task=tasks,
+            previous_output_dir=f'output_20210806_with_mutagen/{name_this}',
+        )
+
+
 if __name__ == '__main__':
     # tested with Mutagen 1.45.1
     # check(ScanType.CORE_METADATA)
@@ -52,3 +65,6 @@ if __name__ == '__main__':
     check_again(ScanType.CHECKSUM)
     # check(ScanType.EXTRA_METADATA)
     check_again(ScanType.EXTRA_METADATA)
+
+    # or, all three above in a single pass.
+    # check_again_all({ScanType.CORE_METADATA, ScanType.CHECKSUM, ScanType.EXTRA_METADATA})
@@ -14,13 +14,24 @@ import json
 from os import path, walk
 # tested with openpyxl 3.0.7
 from openpyxl import Workbook
-from roost.manager import AlbumManager, TrackManager, Track
+from roost.manager import AlbumManager, TrackManager, Track, load_columnar, nfc_cache
+from roost.metadata.core import Tag
+from roost.metadata.extra import Extra
+from roost.query import QueryEngine, Eq, In, between, at_least
 
 PARENT_FOLDERS_TO_CHECK = [
     '/Users/yimengzh/Dropbox/music/output_20210806_with_mutagen/',
     '/Users/yimengzh/Dropbox/music/output_20210816_dsd/',
 ]
 
+# smart playlists, one sheet each.
+PLAYLISTS = {
+    'loved': Eq(Extra.LOVE, True),
+    'top rated': at_least(Extra.RATING, 80) & ~Eq(Extra.HATE, True),
+    '90s jazz': Eq(Tag.GENRE, 'Jazz') & between(Tag.YEAR, 1990, 1999),
+    'long classical': In(Tag.GENRE, {'Classical', 'Classique'}) & at_least(Tag.DURATION, 600.0),
+}
+
 
 def get_all_libs():
     ret = []
@@ -51,6 +62,13 @@ def parse_one_lib(
         track_manager: TrackManager,
         album_manager: AlbumManager,
 ):
+    # `columns.bin` of scans with `columnar=True` load much faster.
+    core_columns = path.join(lib_dir, 'core_metadata', 'columns.bin')
+    extra_columns = path.join(lib_dir, 'extra_metadata', 'columns.bin')
+    if path.exists(core_columns) and path.exists(extra_columns):
+        load_columnar(core_columns, extra_columns, track_manager, album_manager)
+        return
+
     # get main.json from core and aux metadata
     # generate two dicts
     core_json = path.join(lib_dir, 'core_metadata', 'main.json')
@@ -73,7 +91,8 @@ def parse_one_lib(
                 extra_metadata=output_extra,
             )
 
-            track_manager.add_track(track)
+            # albums keep the track as stored in `track_manager`.
+            track = track_manager.add_track(track)
             album_manager.add_track(track)
         else:
             assert type(output_core) is list
@@ -87,7 +106,7 @@ def parse_one_lib(
                     core_metadata=output_core_this,
                     extra_metadata=output_extra_this,
                 )
-                track_manager.add_track(track)
+                track = track_manager.add_track(track)
                 album_manager.add_track(track)
 
 
@@ -101,6 +120,9 @@ def main():
 
     print(len(track_manager.track_dict), 'tracks')
     print(len(album_manager.album_dict), 'albums')
+    nfc_cache.report()
+    # all strings are in `track_manager` now.
+    nfc_cache.clear()
 
     # save
     wb = Workbook(write_only=True)
@@ -108,6 +130,12 @@ def main():
     album_manager.export_to_sheet(wb.create_sheet('albums'))
     # dump track
     track_manager.export_to_sheet(wb.create_sheet('tracks'))
+    # dump playlists
+    query_engine = QueryEngine(track_manager)
+    for name, predicate in PLAYLISTS.items():
+        ids = query_engine.query(predicate)
+        print(name, len(ids), 'tracks')
+        track_manager.export_to_sheet(wb.create_sheet(name), ids=ids)
 
     # save
     wb.save(output)
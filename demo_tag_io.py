@@ -0,0 +1,88 @@
+from os import path
+from time import perf_counter
+
+from mutagen.dsf import DSF
+from mutagen.flac import FLAC
+from mutagen.mp4 import MP4
+
+from roost.metadata.core.bounded import load_tags_bounded, CountingReader
+from roost.walker import walk_directory
+
+input_dirs = [
+    "/Volumes/Multimedia/iTunes_Lib/iTunes Media/Music",
+    "/Volumes/Multimedia/DSD_Lib/Archived",
+]
+
+mutagen_class_map = {
+    '.flac': FLAC,
+    '.m4a': MP4,
+    '.dsf': DSF,
+}
+
+
+def benchmark(input_dir, max_files=None):
+    # bytes read and time per track, with mutagen on the whole file vs. bounded reads.
+    # run it against the network share; the second pass over a file may be served from cache,
+    # so the order of the two readers is alternated.
+    stats = dict()
+    file_ct = 0
+    for dirpath, dirnames, file_entries in walk_directory(input_dir):
+        for file_entry in file_entries:
+            ext_this = path.splitext(file_entry.name)[1]
+            if file_entry.name.startswith('.') or ext_this not in mutagen_class_map:
+                continue
+            full_path = path.join(dirpath, file_entry.name)
+            stats_this = stats.setdefault(
+                ext_this, {
+                    'files': 0, 'fallback': 0,
+                    'mutagen_bytes': 0, 'mutagen_seconds': 0.0,
+                    'bounded_bytes': 0, 'bounded_seconds': 0.0,
+                }
+            )
+
+            def run_mutagen():
+                t_start = perf_counter()
+                with open(full_path, 'rb') as f:
+                    f_counting = CountingReader(f)
+                    mutagen_class_map[ext_this](f_counting)
+                stats_this['mutagen_bytes'] += f_counting.bytes_read
+                stats_this['mutagen_seconds'] += perf_counter() - t_start
+
+            def run_bounded():
+                t_start = perf_counter()
+                _, bytes_read, bounded, _ = load_tags_bounded(full_path)
+                stats_this['bounded_bytes'] += bytes_read
+                stats_this['bounded_seconds'] += perf_counter() - t_start
+                if not bounded:
+                    stats_this['fallback'] += 1
+
+            if file_ct % 2 == 0:
+                run_mutagen()
+                run_bounded()
+            else:
+                run_bounded()
+                run_mutagen()
+            stats_this['files'] += 1
+
+            file_ct += 1
+            if max_files is not None and file_ct >= max_files:
+                return stats
+    return stats
+
+
+def report(stats):
+    for ext_this, stats_this in sorted(stats.items()):
+        n = stats_this['files']
+        print(
+            f"{ext_this}: {n} files, {stats_this['fallback']} fell back to mutagen\n"
+            f"  mutagen: {stats_this['mutagen_bytes'] / n / 1024:.1f} KiB/track, "
+            f"{stats_this['mutagen_seconds'] / n * 1000:.1f} ms/track\n"
+            f"  bounded: {stats_this['bounded_bytes'] / n / 1024:.1f} KiB/track, "
+            f"{stats_this['bounded_seconds'] / n * 1000:.1f} ms/track"
+        )
+
+
+if __name__ == '__main__':
+    for dir_path in input_dirs:
+        print(dir_path)
+        report(benchmark(dir_path, max_files=2000))
@@ -0,0 +1,460 @@
+"""a column-oriented file of scan results, `columns.bin`, that can be memory-mapped and read without parsing.
+
+one row per track, i.e., each row of `main.json`, with SACD ISOs split into one row per track (`subindex` >= 0).
+the file is a header followed by 8-byte aligned sections:
+
+    b'ROOSTCOL', header length (uint64), header (JSON), sections...
+
+the header gives the number of rows, and for each column its kind and the [offset, length] of its sections.
+
+    int64, float64, bool: `values`, one per row (int64 and int8). nulls are `INT64_NULL`, NaN and -1.
+    dict: `codes` (int32, -1 for null), indexing a dictionary of distinct strings,
+        stored as `dict_offsets` (uint64, one more than the strings) and `dict_blob` (UTF-8).
+    str, json: `offsets` (uint64, one more than the rows), `valid` (uint8) and `blob` (UTF-8).
+        json values are stored as their JSON text.
+
+strings repeating a lot (album, artist, genre, etc.) are dictionary-encoded; the others are stored as they are.
+"""
+import json
+import mmap
+import os
+import shutil
+import sys
+from array import array
+from itertools import islice
+from tempfile import TemporaryFile
+
+MAGIC = b'ROOSTCOL'
+FORMAT_VERSION = 1
+INT64_NULL = -2 ** 63
+ALIGNMENT = 8
+# a string column is dictionary-encoded if it has at most this many distinct values per row.
+DICT_MAX_DISTINCT_RATIO = 0.5
+# rows encoded at a time by `write_columnar`. the kind of each string column is chosen from its first chunk.
+CHUNK_ROWS = 10000
+
+# `file_id` values that are strings, as in `scanner_wrapper.FILE_ID_STR_KEYS`.
+FILE_ID_STR_KEYS = {'partial_sha256', 'payload_sha256'}
+
+
+def flatten_rows(rows):
+    """(row, path_and_stat, file_id) of each file -> per track dicts of column values, with `subindex`."""
+    for row_this, path_and_stat_this, file_id_this in rows:
+        file_columns = {
+            'path': path_and_stat_this['path'],
+            'mtime': int(path_and_stat_this['mtime']),
+            'size': int(path_and_stat_this['size']),
+        }
+        for k, v in (file_id_this or dict()).items():
+            file_columns[f'file_id.{k}'] = v if k in FILE_ID_STR_KEYS else int(v)
+        if type(row_this) is list:
+            tracks = enumerate(row_this)
+        else:
+            tracks = [(-1, row_this)]
+        for subindex, track_this in tracks:
+            columns_this = dict(file_columns)
+            columns_this['subindex'] = subindex
+            for k, v in track_this.items():
+                columns_this[k.name] = v
+            yield columns_this
+
+
+def encode_strings(values):
+    blob = bytearray()
+    offsets = array('Q', [0])
+    for v in values:
+        if v is not None:
+            blob += v.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, blob
+
+
+def encode_column(kind, values):
+    # sections of one column, as a dict of name -> bytes-like.
+    if kind == 'int64':
+        return {'values': array('q', [INT64_NULL if v is None else v for v in values])}
+    if kind == 'float64':
+        return {'values': array('d', [float('nan') if v is None else v for v in values])}
+    if kind == 'bool':
+        return {'values': array('b', [-1 if v is None else int(v) for v in values])}
+    if kind == 'dict':
+        dictionary = dict()
+        codes = array('i', [-1 if v is None else dictionary.setdefault(v, len(dictionary)) for v in values])
+        dict_offsets, dict_blob = encode_strings(dictionary.keys())
+        return {'codes': codes, 'dict_offsets': dict_offsets, 'dict_blob': dict_blob}
+    if kind == 'json':
+        values = [None if v is None else json.dumps(v, allow_nan=False) for v in values]
+    offsets, blob = encode_strings(values)
+    return {'offsets': offsets, 'valid': array('B', [v is not None for v in values]), 'blob': blob}
+
+
+def column_kind(python_type, values):
+    if python_type is bool:
+        return 'bool'
+    if python_type is int:
+        return 'int64'
+    if python_type is float:
+        return 'float64'
+    if python_type is str:
+        non_null = [v for v in values if v is not None]
+        if len(set(non_null)) <= DICT_MAX_DISTINCT_RATIO * max(len(values), 1):
+            return 'dict'
+        return 'str'
+    return 'json'
+
+
+class ColumnWriter:
+    """encode one column a chunk at a time, into one temporary file per section."""
+
+    def __init__(self, kind, tmp_dir):
+        self.kind = kind
+        self.tmp_dir = tmp_dir
+        self.files = dict()
+        if kind == 'dict':
+            self.dictionary = dict()
+        elif kind in {'str', 'json'}:
+            self.blob_size = 0
+            self.section('offsets').write(array('Q', [0]).tobytes())
+
+    def section(self, name):
+        f = self.files.get(name, None)
+        if f is None:
+            f = self.files[name] = TemporaryFile(dir=self.tmp_dir)
+        return f
+
+    def write(self, values):
+        kind = self.kind
+        if kind == 'dict':
+            dictionary = self.dictionary
+            codes = array('i', [-1 if v is None else dictionary.setdefault(v, len(dictionary)) for v in values])
+            self.section('codes').write(codes.tobytes())
+        elif kind in {'str', 'json'}:
+            sections = encode_column(kind, values)
+            # offsets continue from the previous chunks.
+            offsets = array('Q', [self.blob_size + x for x in sections['offsets'][1:]])
+            self.blob_size += len(sections['blob'])
+            self.section('offsets').write(offsets.tobytes())
+            self.section('valid').write(sections['valid'].tobytes())
+            self.section('blob').write(bytes(sections['blob']))
+        else:
+            self.section('values').write(encode_column(kind, values)['values'].tobytes())
+
+    def sections(self):
+        """(name, file, length) of each section, in order, with each file at its start.
+        call once, after all the values are written."""
+        if self.kind == 'dict':
+            dict_offsets, dict_blob = encode_strings(self.dictionary.keys())
+            self.section('dict_offsets').write(dict_offsets.tobytes())
+            self.section('dict_blob').write(bytes(dict_blob))
+        ret = []
+        for name, f in self.files.items():
+            length = f.tell()
+            f.seek(0)
+            ret.append((name, f, length))
+        return ret
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def write_columnar(file_path, rows, *, task_name, enum_to_use, type_map, sparse=False, chunk_rows=CHUNK_ROWS):
+    """write `columns.bin`.
+
+    rows are encoded `chunk_rows` at a time into temporary files next to `file_path`, which are then
+    put together, so that `rows` can be streamed, e.g., from `main.json`, in about constant memory
+    (besides the dictionaries of the dictionary-encoded columns).
+
+    :param rows: an iterable of (row, path_and_stat, file_id), as in `main.json`, with rows keyed by `enum_to_use`.
+    :param type_map: the Python type of each member of `enum_to_use`, e.g., `metadata.core.TagTypeMap`.
+    :param sparse: whether a null value means the key is missing in the row, as in checksum rows,
+        rather than being None.
+    """
+    file_columns = {
+        'path': str,
+        'mtime': int,
+        'size': int,
+        'subindex': int,
+    }
+    # in the order they are first seen.
+    file_id_columns = dict()
+    output_columns = {member.name: type_map[member] for member in enum_to_use}
+
+    tmp_dir = os.path.dirname(os.path.abspath(file_path))
+    writers = dict()
+    row_ct = 0
+    tracks = flatten_rows(rows)
+    try:
+        while True:
+            chunk = list(islice(tracks, chunk_rows))
+            # with no rows at all, still go through once for the columns.
+            if len(chunk) == 0 and len(writers) > 0:
+                break
+            for track_this in chunk:
+                for k in track_this:
+                    if k.startswith('file_id.') and k not in file_id_columns:
+                        file_id_columns[k] = str if k[len('file_id.'):] in FILE_ID_STR_KEYS else int
+            for name, python_type in (*file_columns.items(), *file_id_columns.items(), *output_columns.items()):
+                values = [track_this.get(name, None) for track_this in chunk]
+                writer = writers.get(name, None)
+                if writer is None:
+                    writer = writers[name] = ColumnWriter(column_kind(python_type, values), tmp_dir)
+                    # a column first seen in a later chunk, e.g., a `file_id` key only some files have.
+                    writer.write([None] * row_ct)
+                writer.write(values)
+            row_ct += len(chunk)
+
+        header_columns = dict()
+        sections = []
+        offset = 0
+        for name in (*file_columns, *file_id_columns, *output_columns):
+            writer = writers[name]
+            header_columns[name] = {'kind': writer.kind, 'sections': dict()}
+            for section_name, f, length in writer.sections():
+                header_columns[name]['sections'][section_name] = [offset, length]
+                padding = -length % ALIGNMENT
+                sections.append((f, padding))
+                offset += length + padding
+
+        header = json.dumps(
+            {
+                'format': FORMAT_VERSION,
+                'byteorder': sys.byteorder,
+                'task': task_name,
+                'rows': row_ct,
+                'sparse': sparse,
+                'columns': header_columns,
+            },
+            allow_nan=False,
+        ).encode('utf-8')
+        header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGNMENT)
+
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for f_section, padding in sections:
+                shutil.copyfileobj(f_section, f)
+                if padding:
+                    f.write(b'\x00' * padding)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    # only replace a previous file once complete.
+    os.replace(tmp_path, file_path)
+
+
+class NumericColumn:
+    def __init__(self, values, null):
+        # `null`: the value standing for None, or None for NaN.
+        self.values = values
+        self.null = null
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, idx):
+        v = self.values[idx]
+        if self.null is None:
+            return None if v != v else v
+        return None if v == self.null else v
+
+    def to_list(self):
+        values = self.values.tolist()
+        if self.null is None:
+            return [None if v != v else v for v in values]
+        null = self.null
+        if null not in values:
+            return values
+        return [None if v == null else v for v in values]
+
+
+class BoolColumn(NumericColumn):
+    def __getitem__(self, idx):
+        v = self.values[idx]
+        return None if v < 0 else bool(v)
+
+    def to_list(self):
+        return [(None, False, True)[v + 1] for v in self.values.tolist()]
+
+
+def decode_strings(offsets, blob):
+    blob = bytes(blob)
+    offsets = offsets.tolist()
+    text = blob.decode('utf-8')
+    if len(text) == len(blob):
+        # all ASCII, so byte offsets are also character offsets.
+        return [text[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    return [blob[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class DictColumn:
+    """dictionary-encoded strings. `codes` and `dictionary` can be used directly, e.g., to group rows."""
+
+    def __init__(self, codes, dict_offsets, dict_blob):
+        self.codes = codes
+        self._dict_offsets = dict_offsets
+        self._dict_blob = dict_blob
+        self._dictionary = None
+
+    @property
+    def dictionary(self):
+        # decoded once, on first use.
+        if self._dictionary is None:
+            self._dictionary = decode_strings(self._dict_offsets, self._dict_blob)
+        return self._dictionary
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        code = self.codes[idx]
+        return None if code < 0 else self.dictionary[code]
+
+    def to_list(self):
+        dictionary = self.dictionary + [None]
+        # -1 picks the None appended above.
+        return [dictionary[code] for code in self.codes.tolist()]
+
+
+class StrColumn:
+    def __init__(self, offsets, valid, blob, *, is_json=False):
+        self.offsets = offsets
+        self.valid = valid
+        self.blob = blob
+        self.is_json = is_json
+
+    def __len__(self):
+        return len(self.valid)
+
+    def _decode(self, text):
+        return json.loads(text) if self.is_json else text
+
+    def __getitem__(self, idx):
+        if not self.valid[idx]:
+            return None
+        return self._decode(bytes(self.blob[self.offsets[idx]:self.offsets[idx + 1]]).decode('utf-8'))
+
+    def to_list(self):
+        values = decode_strings(self.offsets, self.blob)
+        if self.is_json:
+            values = [json.loads(v) if v else None for v in values]
+        valid = self.valid.tolist()
+        if 0 in valid:
+            # nulls are stored as empty strings.
+            return [v if valid_this else None for v, valid_this in zip(values, valid)]
+        return values
+
+
+class ColumnarTable:
+    """a memory-mapped `columns.bin`. columns are only read (and decoded) when used.
+
+    numeric columns and dictionary codes are memoryviews straight into the mapped file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._f = open(file_path, 'rb')
+        self._mmap = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        if self._view[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'not a columnar file: {repr(file_path)}')
+        header_length = int.from_bytes(self._view[len(MAGIC):len(MAGIC) + 8], 'little')
+        data_start = len(MAGIC) + 8 + header_length
+        self.header = json.loads(bytes(self._view[len(MAGIC) + 8:data_start]))
+        assert self.header['format'] == FORMAT_VERSION
+        self._data_start = data_start
+        self._columns = dict()
+        # views into the mapped file, released by `close`.
+        self._exports = []
+
+    def __len__(self):
+        return self.header['rows']
+
+    @property
+    def names(self):
+        return list(self.header['columns'].keys())
+
+    @property
+    def sparse(self):
+        return self.header['sparse']
+
+    def _section(self, name, section_name, fmt):
+        offset, length = self.header['columns'][name]['sections'][section_name]
+        view = self._view[self._data_start + offset:self._data_start + offset + length]
+        self._exports.append(view)
+        if fmt == 'B' and self.header['byteorder'] == sys.byteorder:
+            return view
+        if self.header['byteorder'] == sys.byteorder:
+            view = view.cast(fmt)
+            self._exports.append(view)
+            return view
+        # written on a machine of the other byte order; copy and swap.
+        ret = array(fmt, view)
+        ret.byteswap()
+        return memoryview(ret)
+
+    def column(self, name):
+        column = self._columns.get(name, None)
+        if column is not None:
+            return column
+        kind = self.header['columns'][name]['kind']
+        if kind == 'int64':
+            column = NumericColumn(self._section(name, 'values', 'q'), INT64_NULL)
+        elif kind == 'float64':
+            column = NumericColumn(self._section(name, 'values', 'd'), None)
+        elif kind == 'bool':
+            column = BoolColumn(self._section(name, 'values', 'b'), None)
+        elif kind == 'dict':
+            column = DictColumn(
+                self._section(name, 'codes', 'i'),
+                self._section(name, 'dict_offsets', 'Q'),
+                self._section(name, 'dict_blob', 'B'),
+            )
+        else:
+            column = StrColumn(
+                self._section(name, 'offsets', 'Q'),
+                self._section(name, 'valid', 'B'),
+                self._section(name, 'blob', 'B'),
+                is_json=kind == 'json',
+            )
+        self._columns[name] = column
+        return column
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def output_names(self):
+        # names of the columns from the scan output, i.e., the `Enum` members of the task.
+        return [
+            x for x in self.names
+            if x not in {'path', 'mtime', 'size', 'subindex'} and not x.startswith('file_id.')
+        ]
+
+    def output_rows(self):
+        """the output of each track as a dict keyed by `Enum` member names, as in `main.json`,
+        leaving out null values if the table is sparse."""
+        names = self.output_names()
+        columns = [self.column(x).to_list() for x in names]
+        if self.sparse:
+            return [
+                {k: v for k, v in zip(names, values) if v is not None} for values in zip(*columns)
+            ]
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+    def close(self):
+        self._columns.clear()
+        for view in reversed(self._exports):
+            view.release()
+        self._exports.clear()
+        self._view.release()
+        self._mmap.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,152 @@
+"""wall time, call counts and bytes of the stages of a scan, for finding out where the time goes.
+
+code deep inside the extractors (ffmpeg and sacd_extract runs, cover art writes, etc.) calls the module-level `stage`,
+which times into the `StageTimer` activated for the file being extracted in this thread, and does nothing otherwise.
+"""
+import heapq
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+# extension recorded for stages not about a single file, such as listing and stat'ing directories.
+DIRECTORY_EXT = '<dir>'
+
+
+class StageTimer:
+    """totals of (calls, seconds, bytes) for each (stage, file extension).
+
+    stages can be nested. the time of a stage excludes that of the stages timed inside it,
+    so that the seconds of all stages add up to the time measured.
+    """
+
+    def __init__(self):
+        # (stage, ext) -> [calls, seconds, bytes]
+        self.totals = dict()
+        # seconds spent in nested stages, for each stage being timed.
+        self._nested = []
+
+    def add(self, stage_name, ext, seconds, nbytes=0, calls=1):
+        total = self.totals.get((stage_name, ext), None)
+        if total is None:
+            total = self.totals[stage_name, ext] = [0, 0.0, 0]
+        total[0] += calls
+        total[1] += seconds
+        total[2] += nbytes
+
+    @contextmanager
+    def stage(self, stage_name, ext, nbytes=0):
+        """time the body as `stage_name`. it yields a dict whose `bytes` can be set when only known at the end."""
+        record = {'bytes': nbytes}
+        self._nested.append(0.0)
+        t_start = perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = perf_counter() - t_start
+            nested = self._nested.pop()
+            if len(self._nested) > 0:
+                self._nested[-1] += seconds
+            self.add(stage_name, ext, seconds - nested, record['bytes'])
+
+    def iter(self, iterable, stage_name, ext):
+        # time producing each item of `iterable`, e.g., listing the next directory of a walk.
+        iterator = iter(iterable)
+        while True:
+            with self.stage(stage_name, ext):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def merge(self, totals):
+        """add the `totals` of another `StageTimer`, e.g., one returned from a worker process."""
+        for (stage_name, ext), (calls, seconds, nbytes) in totals.items():
+            self.add(stage_name, ext, seconds, nbytes, calls)
+
+    def seconds(self):
+        return sum(x[1] for x in self.totals.values())
+
+    def to_json(self):
+        # stage -> ext -> {calls, seconds, bytes}
+        ret = dict()
+        for (stage_name, ext), (calls, seconds, nbytes) in sorted(self.totals.items()):
+            ret.setdefault(stage_name, dict())[ext] = {
+                'calls': calls,
+                'seconds': seconds,
+                'bytes': nbytes,
+            }
+        return ret
+
+    def report(self):
+        print('time per stage:')
+        by_stage = dict()
+        for (stage_name, _), (calls, seconds, nbytes) in self.totals.items():
+            total = by_stage.setdefault(stage_name, [0, 0.0, 0])
+            total[0] += calls
+            total[1] += seconds
+            total[2] += nbytes
+        for stage_name, (calls, seconds, nbytes) in sorted(by_stage.items(), key=lambda x: -x[1][1]):
+            print(
+                f'  {stage_name}: {seconds:.2f}s in {calls} calls' + (
+                    f', {nbytes / 2 ** 20:.0f} MiB' if nbytes > 0 else ''
+                )
+            )
+
+
+class SlowestFiles:
+    """the `n` files taking the most time, each with the time of its stages."""
+
+    def __init__(self, n):
+        self.n = n
+        # a min-heap of (seconds, sequence number, entry).
+        self._heap = []
+        self._seq = 0
+
+    def add(self, full_path, timer: StageTimer):
+        seconds = timer.seconds()
+        if len(self._heap) == self.n and seconds <= self._heap[0][0]:
+            return
+        stages = dict()
+        for (stage_name, _), total in timer.totals.items():
+            stages[stage_name] = stages.get(stage_name, 0.0) + total[1]
+        entry = {
+            'path': full_path,
+            'seconds': seconds,
+            'stages': stages,
+        }
+        self._seq += 1
+        if len(self._heap) < self.n:
+            heapq.heappush(self._heap, (seconds, self._seq, entry))
+        else:
+            heapq.heapreplace(self._heap, (seconds, self._seq, entry))
+
+    def to_json(self):
+        # slowest first.
+        return [x[2] for x in sorted(self._heap, key=lambda x: (-x[0], x[1]))]
+
+
+_local = threading.local()
+
+
+@contextmanager
+def activate(timer: StageTimer, ext):
+    """make `timer` the one `stage` times into in this thread, recording stages under `ext`."""
+    previous = getattr(_local, 'active', None)
+    _local.active = (timer, ext)
+    try:
+        yield timer
+    finally:
+        _local.active = previous
+
+
+@contextmanager
+def stage(stage_name, nbytes=0):
+    """time the body with the active `StageTimer`, if any. see `StageTimer.stage`."""
+    active = getattr(_local, 'active', None)
+    if active is None:
+        yield {'bytes': nbytes}
+        return
+    timer, ext = active
+    with timer.stage(stage_name, ext, nbytes) as record:
+        yield record
@@ -1,25 +1,93 @@
+import gc
 from unicodedata import normalize
 # tested with openpyxl 3.0.7
 from openpyxl.worksheet.worksheet import Worksheet
 from typing import List
 from itertools import groupby
+from collections.abc import Mapping
+
+from .columnar import BoolColumn, ColumnarTable, DictColumn, NumericColumn, StrColumn
+from .trackstore import CORE, Encoded, TrackStore, TrackView
+
+
+class NormalizationCache(dict):
+    """NFC normalization of strings, computed once per distinct string.
+
+    it also interns the results: equal strings normalize to the same object,
+    so that an album, artist or genre repeated over thousands of tracks is allocated once.
+    `cache[value]` is the NFC form of `value`; a hit is a plain dict lookup.
+    """
+
+    def __init__(self):
+        # string -> its NFC form. NFC forms also map to themselves.
+        super().__init__()
+        self.lookups = 0
+        self.misses = 0
+
+    def __missing__(self, value):
+        self.misses += 1
+        ret = normalize('NFC', value)
+        # the NFC form may be cached already, from another form of the same string.
+        ret = self.setdefault(ret, ret)
+        self[value] = ret
+        return ret
+
+    def __call__(self, value: str):
+        self.lookups += 1
+        return self[value]
+
+    def normalize_values(self, metadata: dict):
+        """replace the strings in `metadata` by their NFC forms, in place."""
+        lookups = 0
+        for k, v in metadata.items():
+            if type(v) is str:
+                metadata[k] = self[v]
+                lookups += 1
+        self.lookups += lookups
+
+    def normalize_list(self, values):
+        # the NFC forms of `values`, which are strings or None.
+        self.lookups += len(values)
+        return [None if x is None else self[x] for x in values]
+
+    @property
+    def hits(self):
+        return self.lookups - self.misses
+
+    def clear(self):
+        # once the strings are all loaded, to free the cache.
+        super().clear()
+
+    def report(self):
+        print(
+            f'normalization cache: {self.hits}/{self.lookups} hits '
+            f'({self.hits / self.lookups if self.lookups > 0 else 0.0:.1%}), {len(self)} strings'
+        )
+
+
+# shared by all tracks, so that their strings are interned together.
+nfc_cache = NormalizationCache()
 
 
 class Track:
-    def __init__(self, *, file_path: str, subindex=-1, core_metadata: dict, extra_metadata: dict):
+    # a track on its own. tracks added to `TrackManager` are kept in its `TrackStore`, and read as `TrackView`s.
+    __slots__ = ('file_path', 'subindex', 'core_metadata', 'extra_metadata')
+
+    def __init__(
+            self, *, file_path: str, subindex=-1, core_metadata: dict, extra_metadata: dict, normalized=False
+    ):
+        # `normalized`: strings in the metadata are already NFC, e.g., from `load_columnar`.
         self.file_path = file_path
         self.subindex = subindex
         self.core_metadata = core_metadata
 
-        for k in self.core_metadata:
-            if type(self.core_metadata[k]) is str:
-                self.core_metadata[k] = normalize('NFC', self.core_metadata[k])
+        if not normalized:
+            nfc_cache.normalize_values(self.core_metadata)
 
         self.extra_metadata = extra_metadata
 
-        for k in self.extra_metadata:
-            if type(self.extra_metadata[k]) is str:
-                self.extra_metadata[k] = normalize('NFC', self.extra_metadata[k])
+        if not normalized:
+            nfc_cache.normalize_values(self.extra_metadata)
 
     @property
     def album_key(self):
@@ -30,36 +98,114 @@ class Track:
         return (self.file_path, self.subindex)
 
 
+class TrackDict(Mapping):
+    """`TrackManager.track_dict`: track key -> {'id', 'track'}, made on access from the store."""
+
+    def __init__(self, track_manager):
+        self.track_manager = track_manager
+
+    def __getitem__(self, key):
+        track_id = self.track_manager.key_to_id[key]
+        return {
+            'id': track_id,
+            'track': TrackView(self.track_manager.store, track_id),
+        }
+
+    def __contains__(self, key):
+        return key in self.track_manager.key_to_id
+
+    def __iter__(self):
+        return iter(self.track_manager.key_to_id)
+
+    def __len__(self):
+        return len(self.track_manager.key_to_id)
+
+
+class IdToKey(Mapping):
+    """`TrackManager.id_to_key`: track id -> track key."""
+
+    def __init__(self, track_manager):
+        self.track_manager = track_manager
+
+    def __getitem__(self, track_id):
+        store = self.track_manager.store
+        if type(track_id) is not int or not 0 <= track_id < len(store):
+            raise KeyError(track_id)
+        return store.file_path[track_id], store.subindex[track_id]
+
+    def __iter__(self):
+        return iter(range(len(self.track_manager.store)))
+
+    def __len__(self):
+        return len(self.track_manager.store)
+
+
 class TrackManager:
     def __init__(self):
-        self.track_dict = dict()
-        self.id_to_key = dict()
+        self.store = TrackStore()
+        self.key_to_id = dict()
+        self.track_dict = TrackDict(self)
+        self.id_to_key = IdToKey(self)
+        # functions called with the ids of tracks added, e.g., `query.QueryEngine.add` to update its indexes.
+        self.on_add = []
+
+    def track(self, track_id) -> TrackView:
+        return TrackView(self.store, track_id)
 
     def add_track(self, track):
-        assert track.track_key not in self.track_dict
-        new_id = len(self.track_dict)
-        self.track_dict[track.track_key] = {
-            'id': new_id,
-            'track': track,
+        """add a `Track` (or a `TrackView` of another manager), and return it as a `TrackView` of this one."""
+        key = track.track_key
+        assert key not in self.key_to_id
+        new_id = self.store.append(key[0], key[1], track.core_metadata, track.extra_metadata)
+        self.key_to_id[key] = new_id
+        for fn in self.on_add:
+            fn(range(new_id, new_id + 1))
+        return TrackView(self.store, new_id)
+
+    def add_tracks(self, file_paths, subindices, core_columns: dict, extra_columns: dict):
+        """add many tracks at once, given as columns. see `TrackStore.extend`.
+
+        :return: the tracks added, as `TrackView`s.
+        """
+        keys = list(zip(file_paths, subindices))
+        assert len(set(keys)) == len(keys) and self.key_to_id.keys().isdisjoint(keys)
+        ids = self.store.extend(file_paths, subindices, core_columns, extra_columns)
+        self.key_to_id.update(zip(keys, ids))
+        for fn in self.on_add:
+            fn(ids)
+        return [TrackView(self.store, x) for x in ids]
+
+    def __getstate__(self):
+        # only the store is pickled, and the rest rebuilt from it. `on_add` is not kept.
+        return {'store': self.store}
+
+    def __setstate__(self, state):
+        self.store = state['store']
+        self.key_to_id = {
+            key: track_id for track_id, key in enumerate(zip(self.store.file_path, self.store.subindex))
         }
-        assert new_id not in self.id_to_key
-        self.id_to_key[new_id] = track.track_key
+        self.track_dict = TrackDict(self)
+        self.id_to_key = IdToKey(self)
+        self.on_add = []
 
-    def export_to_sheet(self, sheet: Worksheet):
+    def export_to_sheet(self, sheet: Worksheet, ids=None):
+        # `ids`: only export these tracks, e.g., those of a playlist from `query.QueryEngine`.
         demo_track: Track = next(iter(self.track_dict.values()))['track']
         keys_core = sorted(demo_track.core_metadata.keys())
         keys_meta = sorted(demo_track.extra_metadata.keys())
         header = ['id'] + keys_core + keys_meta
         sheet.append(header)
-        for key, v in self.track_dict.items():
-            track = v['track']
+        if ids is None:
+            ids = range(len(self.store))
+        for track_id in ids:
+            track = self.track(track_id)
             row_core = [
                 track.core_metadata[x] for x in keys_core
             ]
             row_extra = [
                 track.extra_metadata[x] for x in keys_meta
             ]
-            row_this = [v['id']] + row_core + row_extra
+            row_this = [track_id] + row_core + row_extra
             sheet.append(row_this)
 
 
@@ -82,6 +228,21 @@ class AlbumManager:
 
         self.album_dict[key]['tracks'].append(track)
 
+    def add_tracks(self, tracks, keys):
+        """add many tracks at once, with their `album_key`s, e.g., read from the columns of the store."""
+        album_dict = self.album_dict
+        for track, key in zip(tracks, keys):
+            album = album_dict.get(key, None)
+            if album is None:
+                new_id = len(album_dict)
+                album = album_dict[key] = {
+                    'id': new_id,
+                    'tracks': [],
+                }
+                assert new_id not in self.id_to_key
+                self.id_to_key[new_id] = key
+            album['tracks'].append(track)
+
     def check_album_consistency(self, tracks: List[Track]):
         try:
             disc_total_this = tracks[0].core_metadata['DISC_TOTAL']
@@ -124,3 +285,81 @@ class AlbumManager:
             )
 
             sheet.append(row_this)
+
+
+def normalized_values(column):
+    # values of a column of `ColumnarTable`, with strings in NFC, through `nfc_cache`.
+    # dictionary-encoded strings only go through it once per distinct value.
+    if type(column) is DictColumn:
+        dictionary = nfc_cache.normalize_list(column.dictionary) + [None]
+        return [dictionary[code] for code in column.codes.tolist()]
+    values = column.to_list()
+    if type(column) is StrColumn and not column.is_json:
+        return nfc_cache.normalize_list(values)
+    return values
+
+
+def encoded_values(column):
+    # like `normalized_values`, but as `trackstore.Encoded` where the column is stored the same way
+    # as in `TrackStore`, so that it is copied as is instead of value by value.
+    if type(column) is DictColumn:
+        return Encoded('str', column.codes, nfc_cache.normalize_list(column.dictionary))
+    if type(column) is BoolColumn:
+        return Encoded('bool', column.values)
+    if type(column) is NumericColumn:
+        return Encoded('float' if column.null is None else 'int', column.values)
+    return normalized_values(column)
+
+
+def load_columnar(
+        core_columns_path, extra_columns_path,
+        track_manager: TrackManager,
+        album_manager: AlbumManager,
+):
+    """add the tracks of a library from the `columns.bin` of its core metadata and extra metadata scans.
+
+    the counterpart of loading both `main.json` files, without parsing any JSON.
+    """
+    # creating this many objects would otherwise trigger many useless garbage collections.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        load_columnar_inner(core_columns_path, extra_columns_path, track_manager, album_manager)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def load_columnar_inner(core_columns_path, extra_columns_path, track_manager, album_manager):
+    with ColumnarTable(core_columns_path) as core_table, ColumnarTable(extra_columns_path) as extra_table:
+        file_paths = core_table['path'].to_list()
+        subindices = core_table['subindex'].to_list()
+        keys_core = list(zip(file_paths, subindices))
+        keys_extra = list(zip(extra_table['path'].to_list(), extra_table['subindex'].to_list()))
+        if keys_extra != keys_core:
+            # same files, in a different order.
+            assert set(keys_core) == set(keys_extra) and len(keys_core) == len(keys_extra)
+            extra_idx = {k: idx for idx, k in enumerate(keys_extra)}
+            extra_order = [extra_idx[k] for k in keys_core]
+        else:
+            extra_order = None
+
+        names_core = core_table.output_names()
+        names_extra = extra_table.output_names()
+        if extra_order is None:
+            values_extra = [encoded_values(extra_table[x]) for x in names_extra]
+        else:
+            values_extra = [normalized_values(extra_table[x]) for x in names_extra]
+            values_extra = [[values[idx] for idx in extra_order] for values in values_extra]
+
+        tracks = track_manager.add_tracks(
+            file_paths,
+            subindices,
+            {x: encoded_values(core_table[x]) for x in names_core},
+            dict(zip(names_extra, values_extra)),
+        )
+        # album keys straight from the columns, rather than through each track.
+        columns = track_manager.store.columns[CORE]
+        start = tracks[0].track_id if len(tracks) > 0 else 0
+        album_keys = zip(columns['ALBUM_ARTIST'].to_list()[start:], columns['ALBUM'].to_list()[start:])
+        album_manager.add_tracks(tracks, album_keys)
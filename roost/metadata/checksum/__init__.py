@@ -1,77 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from os import stat
 from subprocess import check_output
+from time import perf_counter
 
 from enum import Enum, auto
 
 from ... import BIN_FFMPEG
+from ...instrument import stage
+from .. import ExtractionError
+from .dsf import UnsupportedDSFLayout, get_raw_stream_sha256
+
+
+# large reads keep the number of syscalls (and SMB round trips) low when hashing multi-GB files.
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
 
 
 class ChecksumType(Enum):
     PCM_S24LE = auto()
     RAW_STREAM = auto()
     RAW_FILE = auto()
+    # FLAC decoded and checked against the MD5 in its STREAMINFO.
+    FLAC_MD5 = auto()
+
+
+ChecksumTypeMap = {
+    ChecksumType.PCM_S24LE: str,
+    ChecksumType.RAW_STREAM: str,
+    ChecksumType.RAW_FILE: str,
+    # md5, whether it matches, and seconds taken.
+    ChecksumType.FLAC_MD5: dict,
+}
+
+
+def ffmpeg_hash_command(file_name_full, audio_codec, hash_name='sha256'):
+    return [
+        BIN_FFMPEG,
+        "-i", file_name_full,
+        "-vn",
+        "-c:a", audio_codec,
+        "-f", "hash",
+        "-hash", hash_name,
+        "-"
+    ]
+
+
+def parse_ffmpeg_hash_output(ffmpeg_output, hash_name='sha256'):
+    dummy, result = ffmpeg_output.strip().split('=')
+    assert dummy == hash_name.upper()
+    return result
+
+
+# audio codec passed to ffmpeg for each checksum computed by ffmpeg.
+FFMPEG_AUDIO_CODEC = {
+    # converted to 24bit `pcm_s24le`. this is sufficient for practically all non-DSD files.
+    ChecksumType.PCM_S24LE: 'pcm_s24le',
+    # for DSD (non-ISO), use the original stream
+    ChecksumType.RAW_STREAM: 'copy',
+}
 
 
 def get_checksum_in_24bit(file_name_full):
     # use ffmpeg to check raw audio stream's sha, converted to 24bit `pcm_s24le`
     # this is sufficient for practically all non-DSD files.
-    ffmpeg_output = check_output(
-        [
-            BIN_FFMPEG,
-            "-i", file_name_full,
-            "-vn",
-            "-c:a", "pcm_s24le",
-            "-f", "hash",
-            "-hash", "sha256",
-            "-"
-        ]
-    ).decode()
+    with stage('ffmpeg'):
+        ffmpeg_output = check_output(
+            ffmpeg_hash_command(file_name_full, FFMPEG_AUDIO_CODEC[ChecksumType.PCM_S24LE])
+        ).decode()
 
-    dummy, result = ffmpeg_output.strip().split('=')
-    assert dummy == 'SHA256'
     return {
-        ChecksumType.PCM_S24LE: result,
+        ChecksumType.PCM_S24LE: parse_ffmpeg_hash_output(ffmpeg_output),
     }
 
 
-def get_checksum_in_raw_stream(file_name_full):
+def get_checksum_in_raw_stream(file_name_full, *, native=False, trim_padding=True):
     # for DSD (non-ISO), use the original stream
-    ffmpeg_output = check_output(
-        [
-            BIN_FFMPEG,
-            "-i", file_name_full,
-            "-vn",
-            "-c:a", "copy",
-            "-f", "hash",
-            "-hash", "sha256",
-            "-"
-        ]
-    ).decode()
+    if native:
+        # hash the `data` chunk directly, without spawning ffmpeg.
+        # `trim_padding` must match the behavior of the ffmpeg the previous results were computed with;
+        # see `check_native_raw_stream_checksum`.
+        try:
+            with stage('native_hash'):
+                return {
+                    ChecksumType.RAW_STREAM: get_raw_stream_sha256(file_name_full, trim_padding=trim_padding),
+                }
+        except UnsupportedDSFLayout:
+            # unusual layout, leave it to ffmpeg.
+            pass
+
+    with stage('ffmpeg'):
+        ffmpeg_output = check_output(
+            ffmpeg_hash_command(file_name_full, FFMPEG_AUDIO_CODEC[ChecksumType.RAW_STREAM])
+        ).decode()
 
-    dummy, result = ffmpeg_output.strip().split('=')
-    assert dummy == 'SHA256'
     return {
-        ChecksumType.RAW_STREAM: result,
+        ChecksumType.RAW_STREAM: parse_ffmpeg_hash_output(ffmpeg_output),
+    }
+
+
+def check_native_raw_stream_checksum(file_name_full):
+    """compare the native DSF checksum against ffmpeg's on one file.
+
+    ffmpeg versions differ in whether the padding of the last block is hashed,
+    so both variants are tried.
+
+    :return: the `trim_padding` value that reproduces ffmpeg's checksum, or None if neither does.
+    """
+    expected = get_checksum_in_raw_stream(file_name_full)[ChecksumType.RAW_STREAM]
+    for trim_padding in (True, False):
+        if get_raw_stream_sha256(file_name_full, trim_padding=trim_padding) == expected:
+            return trim_padding
+    return None
+
+
+# the MD5 in FLAC's STREAMINFO is computed over little-endian, interleaved samples,
+# each taking the fewest whole bytes. bit depths not listed here cannot be reproduced by ffmpeg's PCM encoders,
+# as ffmpeg decodes them into the high bits of a wider sample.
+FLAC_MD5_AUDIO_CODEC = {
+    8: 'pcm_s8',
+    16: 'pcm_s16le',
+    24: 'pcm_s24le',
+}
+
+
+def verify_flac_md5(file_name_full, *, bits_per_sample, md5_signature):
+    # decode the whole stream with ffmpeg, and compare it against the MD5 in STREAMINFO.
+    if bits_per_sample not in FLAC_MD5_AUDIO_CODEC:
+        raise ExtractionError(f"cannot verify {repr(file_name_full)} with {bits_per_sample} bits per sample")
+    t_start = perf_counter()
+    with stage('ffmpeg'):
+        ffmpeg_output = check_output(
+            ffmpeg_hash_command(file_name_full, FLAC_MD5_AUDIO_CODEC[bits_per_sample], hash_name='md5')
+        ).decode()
+    result = parse_ffmpeg_hash_output(ffmpeg_output, hash_name='md5')
+    return {
+        ChecksumType.FLAC_MD5: {
+            'md5': result,
+            'ok': result == f'{md5_signature:032x}',
+            'seconds': perf_counter() - t_start,
+        },
+    }
+
+
+def hash_file_sha256(file_name_full, buffer_size=HASH_BUFFER_SIZE):
+    # read into one reused buffer, and hash it through a memoryview without copying.
+    # hashlib releases the GIL while hashing large buffers, so several files can be hashed in threads.
+    hash_obj = sha256()
+    buffer = bytearray(buffer_size)
+    buffer_view = memoryview(buffer)
+    bytes_hashed = 0
+    t_start = perf_counter()
+    with open(file_name_full, 'rb', buffering=0) as f:
+        while True:
+            n_read = f.readinto(buffer)
+            if not n_read:
+                break
+            hash_obj.update(buffer_view[:n_read])
+            bytes_hashed += n_read
+    return {
+        'sha256': hash_obj.hexdigest(),
+        'bytes': bytes_hashed,
+        'seconds': perf_counter() - t_start,
     }
 
 
 def get_checksum_in_raw_file(file_name_full):
     # for SACD ISO, use the original file as a whole
-    ffmpeg_output = check_output(
-        [
-            'shasum',
-            "-a"
-            "256",
-            file_name_full
-        ]
-    ).decode()
-
-    result = ffmpeg_output[:64]
+    with stage('iso_hash') as stage_record:
+        hash_result = hash_file_sha256(file_name_full)
+        stage_record['bytes'] = hash_result['bytes']
     return {
-        ChecksumType.RAW_FILE: result,
+        ChecksumType.RAW_FILE: hash_result['sha256'],
     }
 
 
+def hash_files_concurrently(file_names, max_workers):
+    """hash whole files with `hash_file_sha256` in a pool of threads.
+
+    :return: a list of the results of `hash_file_sha256`, in the order of `file_names`,
+        and the overall throughput in bytes/sec.
+    """
+    t_start = perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        ret = list(executor.map(hash_file_sha256, file_names))
+    seconds = perf_counter() - t_start
+    bytes_all = sum(x['bytes'] for x in ret)
+    return ret, (bytes_all / seconds if seconds > 0 else 0.0)
+
+
+def get_partial_checksum(file_name_full, chunk_size=65536):
+    # sha256 of the size and the first and last `chunk_size` bytes.
+    # cheap enough to compute for every file, but only good for recognizing a file, not for verifying it.
+    size = stat(file_name_full).st_size
+    hash_obj = sha256(str(size).encode())
+    with open(file_name_full, 'rb') as f:
+        hash_obj.update(f.read(chunk_size))
+        if size > chunk_size:
+            f.seek(max(chunk_size, size - chunk_size))
+            hash_obj.update(f.read(chunk_size))
+    return hash_obj.hexdigest()
+
+
+def check_valid_hex(result, length):
+    assert len(result) == length
+    for c in result:
+        assert c in '0123456789abcdef'
+
+
 def check_valid_checksum_output(output, ext):
+    if ext in {'.flac'}:
+        assert output.keys() == {ChecksumType.FLAC_MD5}
+        result = output[ChecksumType.FLAC_MD5]
+        assert result.keys() == {'md5', 'ok', 'seconds'}
+        check_valid_hex(result['md5'], 32)
+        assert type(result['ok']) is bool
+        return
+
     if ext in {'.m4a'}:
         assert output.keys() == {ChecksumType.PCM_S24LE}
     elif ext in {'.dsf'}:
@@ -81,7 +225,4 @@ def check_valid_checksum_output(output, ext):
     else:
         raise ValueError
 
-    result = list(output.values())[0]
-    assert len(result) == 64
-    for c in result:
-        assert c in '0123456789abcdef'
+    check_valid_hex(list(output.values())[0], 64)
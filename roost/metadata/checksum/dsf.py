@@ -0,0 +1,111 @@
+"""hash the audio stream of a DSF file directly from its `data` chunk, without ffmpeg"""
+import mmap
+from hashlib import sha256
+from struct import unpack_from
+
+from .. import ExtractionError
+
+# 'DSD ' chunk + 'fmt ' chunk + header of 'data' chunk.
+DSF_HEADER_SIZE = 28 + 52 + 12
+
+# hash this much of the mapped file per `update`, so that each call releases the GIL for a while,
+# without touching too many pages at once.
+HASH_SLICE_SIZE = 8 * 1024 * 1024
+
+
+class UnsupportedDSFLayout(ExtractionError):
+    # the file is valid enough for ffmpeg, but not laid out as expected here.
+    pass
+
+
+def read_dsf_header(file_name_full):
+    """parse the fixed-size header of a DSF file.
+
+    :return: a dict with the layout of the file; `data_offset` and `data_size` locate the
+        payload of the `data` chunk, and `metadata_offset` the ID3 chunk (0 if none).
+    """
+    with open(file_name_full, 'rb') as f:
+        header = f.read(DSF_HEADER_SIZE)
+    if len(header) != DSF_HEADER_SIZE:
+        raise UnsupportedDSFLayout(f"{repr(file_name_full)} is too short")
+
+    dsd_id, dsd_chunk_size, file_size, metadata_offset = unpack_from('<4sQQQ', header, 0)
+    if dsd_id != b'DSD ' or dsd_chunk_size != 28:
+        raise UnsupportedDSFLayout(f"{repr(file_name_full)} has no valid 'DSD ' chunk")
+
+    (
+        fmt_id, fmt_chunk_size, _format_version, format_id, _channel_type, channels,
+        sample_rate, bits_per_sample, sample_count, block_size_per_channel, _reserved,
+    ) = unpack_from('<4sQIIIIIIQII', header, 28)
+    if fmt_id != b'fmt ' or fmt_chunk_size != 52:
+        raise UnsupportedDSFLayout(f"{repr(file_name_full)} has no valid 'fmt ' chunk")
+    # 0 is DSD raw.
+    if format_id != 0 or channels == 0 or block_size_per_channel == 0:
+        raise UnsupportedDSFLayout(f"{repr(file_name_full)} has an unsupported 'fmt ' chunk")
+
+    data_id, data_chunk_size = unpack_from('<4sQ', header, 80)
+    if data_id != b'data' or data_chunk_size < 12:
+        raise UnsupportedDSFLayout(f"{repr(file_name_full)} has no valid 'data' chunk")
+
+    return {
+        'file_size': file_size,
+        'metadata_offset': metadata_offset,
+        'channels': channels,
+        'sample_rate': sample_rate,
+        'bits_per_sample': bits_per_sample,
+        'sample_count': sample_count,
+        'block_size_per_channel': block_size_per_channel,
+        'data_offset': DSF_HEADER_SIZE,
+        'data_size': data_chunk_size - 12,
+    }
+
+
+def iter_stream_ranges(layout, trim_padding=True):
+    """(offset, length) ranges of the file, in the order ffmpeg's DSF demuxer emits them as packets.
+
+    ffmpeg emits the `data` chunk one block (of all channels) at a time. with `trim_padding`,
+    the last block is cut down to the actual samples of each channel, as newer ffmpeg versions do.
+    """
+    channels = layout['channels']
+    block_align = layout['block_size_per_channel'] * channels
+    data_offset = layout['data_offset']
+    data_size = layout['data_size']
+    # bytes of actual samples, over all channels.
+    audio_size = layout['sample_count'] // 8 * channels
+
+    last_block_pos = data_size - block_align
+    if not trim_padding or data_size <= audio_size or last_block_pos < 0 or last_block_pos % block_align != 0:
+        # no packet starts exactly one block before the end, so nothing is trimmed.
+        yield data_offset, data_size
+        return
+
+    packet_size = audio_size - last_block_pos
+    skip_size = data_size - last_block_pos - packet_size
+    if packet_size <= 0 or skip_size <= 0:
+        # ffmpeg rejects this.
+        raise UnsupportedDSFLayout("invalid padding in the last block")
+
+    if last_block_pos > 0:
+        yield data_offset, last_block_pos
+    for ch in range(channels):
+        yield data_offset + last_block_pos + ch * (block_align // channels), packet_size // channels
+
+
+def get_raw_stream_sha256(file_name_full, trim_padding=True):
+    """sha256 of the DSD stream, the same as `ffmpeg -c:a copy -f hash -hash sha256`.
+
+    the file is memory-mapped and hashed through memoryview slices, without copying.
+    """
+    layout = read_dsf_header(file_name_full)
+    ranges = list(iter_stream_ranges(layout, trim_padding=trim_padding))
+
+    hash_obj = sha256()
+    with open(file_name_full, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if layout['data_offset'] + layout['data_size'] > len(mapped):
+            # ffmpeg would hash whatever is there; leave such files to it.
+            raise UnsupportedDSFLayout(f"{repr(file_name_full)} is shorter than its 'data' chunk")
+        with memoryview(mapped) as mapped_view:
+            for offset, length in ranges:
+                for start in range(offset, offset + length, HASH_SLICE_SIZE):
+                    hash_obj.update(mapped_view[start:min(start + HASH_SLICE_SIZE, offset + length)])
+    return hash_obj.hexdigest()
@@ -0,0 +1,155 @@
+"""run many ffmpeg checksums concurrently, on an asyncio event loop in a background thread"""
+import asyncio
+from threading import Thread
+from time import perf_counter
+
+from .. import ExtractionError
+from . import ChecksumType, FFMPEG_AUDIO_CODEC, ffmpeg_hash_command, parse_ffmpeg_hash_output
+
+# checksum computed by ffmpeg for each file extension, as in `scanner.extract_one_task`.
+FFMPEG_CHECKSUM_TYPE_BY_EXT = {
+    '.m4a': ChecksumType.PCM_S24LE,
+    '.dsf': ChecksumType.RAW_STREAM,
+}
+
+# how much of ffmpeg's stderr to keep for reporting failures.
+STDERR_TAIL_BYTES = 4096
+
+
+async def _read_stream(stream, keep_tail_only=False):
+    chunks = []
+    size = 0
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if keep_tail_only and size > 2 * STDERR_TAIL_BYTES:
+            data = b''.join(chunks)[-STDERR_TAIL_BYTES:]
+            chunks = [data]
+            size = len(data)
+    return b''.join(chunks)
+
+
+async def run_ffmpeg_checksum(file_name_full, checksum_type: ChecksumType, timeout=None):
+    """compute one checksum with ffmpeg, without blocking the event loop.
+
+    :param timeout: seconds; ffmpeg is killed if it takes longer.
+    :return: the same as `get_checksum_in_24bit` or `get_checksum_in_raw_stream`.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *ffmpeg_hash_command(file_name_full, FFMPEG_AUDIO_CODEC[checksum_type]),
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def communicate():
+        # read both pipes as they are written; ffmpeg can fill the stderr pipe and block otherwise.
+        stdout, stderr = await asyncio.gather(
+            _read_stream(proc.stdout),
+            _read_stream(proc.stderr, keep_tail_only=True),
+        )
+        await proc.wait()
+        return stdout, stderr
+
+    try:
+        stdout, stderr = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise ExtractionError(f"ffmpeg timed out after {timeout}s for {repr(file_name_full)}")
+    except BaseException:
+        # e.g., cancelled because the scan is shutting down.
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+
+    if proc.returncode != 0:
+        raise ExtractionError(
+            f"ffmpeg exited with {proc.returncode} for {repr(file_name_full)}",
+            stderr[-STDERR_TAIL_BYTES:].decode(errors='replace'),
+        )
+
+    try:
+        return {
+            checksum_type: parse_ffmpeg_hash_output(stdout.decode()),
+        }
+    except Exception as e:
+        raise ExtractionError(f"unexpected ffmpeg output for {repr(file_name_full)}", e)
+
+
+class ChecksumEngine:
+    """keep up to `max_concurrency` ffmpeg processes running.
+
+    the event loop runs in a background thread, so that `submit` can be called from ordinary code
+    and returns a `concurrent.futures.Future`.
+
+    :param timeout: seconds allowed for each file.
+    :param on_done: if not None, called as `on_done(file_name_full, seconds)` in the engine's thread
+        after each ffmpeg run (successful or not), with the seconds it took, not counting the wait for a free slot.
+    """
+
+    def __init__(self, max_concurrency, timeout=None, on_done=None):
+        assert max_concurrency > 0
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.on_done = on_done
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._thread = Thread(target=self._loop.run_forever, name='ChecksumEngine', daemon=True)
+        self._thread.start()
+
+    async def _run_one(self, file_name_full, checksum_type):
+        if self._semaphore is None:
+            # created here, so that it belongs to our loop.
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            t_start = perf_counter()
+            try:
+                return await run_ffmpeg_checksum(file_name_full, checksum_type, timeout=self.timeout)
+            finally:
+                if self.on_done is not None:
+                    self.on_done(file_name_full, perf_counter() - t_start)
+
+    def submit(self, file_name_full, checksum_type: ChecksumType):
+        return asyncio.run_coroutine_threadsafe(
+            self._run_one(file_name_full, checksum_type), self._loop
+        )
+
+    def map(self, file_names, checksum_type: ChecksumType):
+        """checksum all `file_names`, reporting failures per file instead of stopping at the first one.
+
+        :return: a list of (file name, checksum dict or the exception raised), in the order of `file_names`.
+        """
+        futures = [(x, self.submit(x, checksum_type)) for x in file_names]
+        ret = []
+        for file_name_full, future in futures:
+            try:
+                ret.append((file_name_full, future.result()))
+            except Exception as e:
+                ret.append((file_name_full, e))
+        return ret
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+
+        async def cancel_all():
+            tasks = [x for x in asyncio.all_tasks() if x is not asyncio.current_task()]
+            for x in tasks:
+                x.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(cancel_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,105 @@
+"""locate the audio payload of a file, i.e., the part not touched by editing tags"""
+from hashlib import sha256
+from struct import unpack
+
+from .dsf import UnsupportedDSFLayout, read_dsf_header
+
+# file types `find_payload_range` can locate the payload of.
+PAYLOAD_EXTS = {'.m4a', '.flac', '.dsf'}
+
+
+def find_mp4_payload(f, file_size):
+    # walk the top-level boxes for the single `mdat` box.
+    # tag edits rewrite `moov` (and maybe `free`), and may move `mdat`, but never change its content.
+    ret = None
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        box_size, box_type = unpack('>I4s', f.read(8))
+        header_size = 8
+        if box_size == 1:
+            box_size, = unpack('>Q', f.read(8))
+            header_size = 16
+        elif box_size == 0:
+            # the last box, extending to the end of the file.
+            box_size = file_size - offset
+        if box_size < header_size:
+            return
+        if box_type == b'mdat':
+            if ret is not None:
+                # more than one; do not guess.
+                return
+            ret = offset + header_size, box_size - header_size
+        offset += box_size
+    return ret
+
+
+def find_flac_payload(f, file_size):
+    # the frames follow the last metadata block, up to the end of the file.
+    header = f.read(10)
+    offset = 0
+    if header[:3] == b'ID3':
+        # an ID3v2 tag before `fLaC`, with a syncsafe size.
+        offset = 10 + ((header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9])
+        if header[5] & 0x10:
+            # footer.
+            offset += 10
+        f.seek(offset)
+        header = f.read(4)
+    if header[:4] != b'fLaC':
+        return
+    offset += 4
+
+    while True:
+        f.seek(offset)
+        block_header = f.read(4)
+        if len(block_header) != 4:
+            return
+        offset += 4 + int.from_bytes(block_header[1:], 'big')
+        if block_header[0] & 0x80:
+            # the last metadata block.
+            break
+    if offset > file_size:
+        return
+    return offset, file_size - offset
+
+
+def find_dsf_payload(file_name_full):
+    try:
+        layout = read_dsf_header(file_name_full)
+    except UnsupportedDSFLayout:
+        return
+    return layout['data_offset'], layout['data_size']
+
+
+def find_payload_range(file_name_full):
+    """(offset, length) of the audio payload: the `mdat` box of MP4, the frames of FLAC,
+    or the `data` chunk of DSF. None if the format is not supported or the layout is unexpected."""
+    if file_name_full.endswith('.dsf'):
+        return find_dsf_payload(file_name_full)
+
+    with open(file_name_full, 'rb') as f:
+        f.seek(0, 2)
+        file_size = f.tell()
+        f.seek(0)
+        if file_name_full.endswith('.m4a'):
+            return find_mp4_payload(f, file_size)
+        elif file_name_full.endswith('.flac'):
+            return find_flac_payload(f, file_size)
+
+
+def get_payload_fingerprint(file_name_full, chunk_size=65536):
+    # sha256 of the payload length and its first, middle and last `chunk_size` bytes.
+    # like `get_partial_checksum`, only good for recognizing a payload, not for verifying it;
+    # but it stays the same when only tags are edited.
+    payload_range = find_payload_range(file_name_full)
+    if payload_range is None:
+        return
+    offset, length = payload_range
+
+    hash_obj = sha256(str(length).encode())
+    with open(file_name_full, 'rb') as f:
+        for start in sorted({0, max(0, length // 2 - chunk_size // 2), max(0, length - chunk_size)}):
+            f.seek(offset + start)
+            hash_obj.update(f.read(min(chunk_size, length - start)))
+    return hash_obj.hexdigest()
@@ -1,5 +1,8 @@
+import os
 from enum import Enum, auto
+from os.path import exists, join
 from unicodedata import is_normalized
+from uuid import uuid4
 
 from .. import ExtractionError
 
@@ -85,3 +88,25 @@ def check_valid_metadata_one(extracted):
         raise RuntimeError(
             "invalid metadata {}".format(extracted), e
         )
+
+
+def save_image(output_dir, filename, data):
+    # images are named by their sha256, so an existing file already has the right content.
+    # return whether the file is written.
+    fullpath = join(output_dir, filename)
+    if exists(fullpath):
+        return False
+
+    # write to a private temporary file and rename it into place,
+    # so that parallel workers extracting the same image never see (or leave behind) a partial file.
+    tmp_path = join(output_dir, f'.{filename}.{uuid4().hex}.tmp')
+    try:
+        with open(tmp_path, 'xb') as f:
+            f.write(data)
+        os.replace(tmp_path, fullpath)
+    except BaseException:
+        if exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
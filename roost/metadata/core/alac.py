@@ -1,10 +1,8 @@
-from hashlib import sha256
-from os.path import exists, join
-
 from mutagen.mp4 import MP4, MP4Tags, MP4Cover, MP4FreeForm
 
 from .. import ExtractionError
 from . import Tag
+from .artwork import get_artwork_store
 
 
 def fetch_one_field(
@@ -51,22 +49,20 @@ def tuple_converter(data, _):
     return data1, data2
 
 
-def cover_converter(data: MP4Cover, output_dir):
-    # compute the hash (sha256)
-    hexdigest = sha256(bytes(data)).hexdigest()
-    # save the file.
-    ext = {
-        data.FORMAT_PNG: '.png',
-        data.FORMAT_JPEG: '.jpg'
-    }[data.imageformat]
-    filename = hexdigest + ext
+COVER_EXT = {
+    MP4Cover.FORMAT_PNG: '.png',
+    MP4Cover.FORMAT_JPEG: '.jpg'
+}
+# MIME types of the image formats, as located by `bounded.load_tags_bounded`.
+COVER_MIME = {
+    'image/png': MP4Cover.FORMAT_PNG,
+    'image/jpeg': MP4Cover.FORMAT_JPEG,
+}
 
-    fullpath = join(output_dir, filename)
-    if not exists(fullpath):
-        with open(fullpath, 'wb') as f:
-            f.write(bytes(data))
 
-    return filename
+def cover_converter(data: MP4Cover, output_dir):
+    # save the file, named by its sha256.
+    return get_artwork_store(output_dir).save(bytes(data), COVER_EXT[data.imageformat])
 
 
 TAG_MAPPING_ALAC = {
@@ -96,8 +92,13 @@ def get_meta_data_alac(
         #
         # TODO: do the same for Composer if needed.
         update_multi_value_fields=False,
+        # an already parsed `MP4(file_name_full)`, to avoid parsing it again.
+        mp4_obj=None,
+        # where the picture left out of `mp4_obj` is in the file, to be saved with `save_deferred`.
+        cover=None,
 ):
-    mp4_obj = MP4(file_name_full)
+    if mp4_obj is None:
+        mp4_obj = MP4(file_name_full)
 
     try:
         mp4_info = mp4_obj.info
@@ -120,6 +121,10 @@ def get_meta_data_alac(
         ret = {
             k: fetch_one_field(mp4_tags, field, func, image_output_dir) for k, (field, func) in TAG_MAPPING_ALAC.items()
         }
+        if cover is not None:
+            ret[Tag.COVER_ART] = get_artwork_store(image_output_dir).save_deferred(
+                file_name_full, cover, COVER_EXT[COVER_MIME[cover['mime']]]
+            )
 
         ret[Tag.DURATION] = mp4_info.length
 
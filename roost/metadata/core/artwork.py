@@ -0,0 +1,204 @@
+"""cover art extracted from audio files, stored by sha256, optionally deferred until needed"""
+import json
+import mmap
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import sha256
+from itertools import groupby
+from os.path import exists, join, splitext
+
+from .. import ExtractionError
+from . import save_image
+from ...instrument import stage
+
+# in the image directory, a pointer `<image file name>.json` for each image not extracted yet.
+DEFERRED_DIR = '.deferred'
+
+
+class ArtworkStore:
+    """images extracted into `output_dir`, named by their sha256.
+
+    the names already in `output_dir` are listed once, and every image saved since is remembered,
+    so the same cover in every track of an album is written (and probed) only once.
+    a cheap pre-key (length, and sha256 of the first and last `PRE_KEY_SIZE` bytes) recognizes an image
+    just seen without hashing it again; a match is confirmed by comparing the bytes.
+
+    `save_deferred` does not write a new image; only where it sits in its audio file is recorded,
+    for `extract_deferred_images` to extract later.
+    """
+
+    PRE_KEY_SIZE = 4096
+    # images kept for confirming pre-key matches. covers of the current album are what matters.
+    RECENT_IMAGES = 16
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._known = {x for x in os.listdir(output_dir) if not x.startswith('.')}
+        if exists(join(output_dir, DEFERRED_DIR)):
+            self._known.update(
+                splitext(x)[0] for x in os.listdir(join(output_dir, DEFERRED_DIR)) if not x.startswith('.')
+            )
+        # pre-key -> (data, digest)
+        self._recent = OrderedDict()
+
+        self.references = 0
+        self._referenced = set()
+        self.hashes_skipped = 0
+        self.written = 0
+        self.deferred = 0
+
+    def digest(self, data):
+        pre_key = (
+            len(data),
+            sha256(data[:self.PRE_KEY_SIZE]).digest(),
+            sha256(data[-self.PRE_KEY_SIZE:]).digest(),
+        )
+        recent = self._recent.get(pre_key, None)
+        if recent is not None and recent[0] == data:
+            self.hashes_skipped += 1
+            self._recent.move_to_end(pre_key)
+            return recent[1]
+
+        hexdigest = sha256(data).hexdigest()
+        self._recent[pre_key] = (data, hexdigest)
+        self._recent.move_to_end(pre_key)
+        while len(self._recent) > self.RECENT_IMAGES:
+            self._recent.popitem(last=False)
+        return hexdigest
+
+    def save(self, data, ext):
+        """save `data` as `<sha256><ext>` unless it exists, and return the file name."""
+        with stage('cover_art', len(data)):
+            filename = self.digest(data) + ext
+            self.references += 1
+            self._referenced.add(filename)
+            if filename not in self._known:
+                if save_image(self.output_dir, filename, data):
+                    self.written += 1
+                self._known.add(filename)
+        return filename
+
+    def save_deferred(self, source_path, location, ext):
+        """like `save`, for the image at `location` (`offset`, `length` and `mime`) in `source_path`,
+        as found by `bounded.load_tags_bounded`.
+
+        the image is hashed straight from the mapped file, without copying it,
+        and a pointer to it is written instead of the image.
+        """
+        with stage('cover_art', location['length']):
+            with open(source_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as mapped_view:
+                    with mapped_view[location['offset']:location['offset'] + location['length']] as image_view:
+                        if len(image_view) != location['length']:
+                            raise ExtractionError('cover art past the end of the file', location)
+                        filename = sha256(image_view).hexdigest() + ext
+            self.references += 1
+            self._referenced.add(filename)
+            if filename not in self._known:
+                # the name is the digest of the bytes at `location`, so the pointer is valid until the file changes.
+                pointer_dir = join(self.output_dir, DEFERRED_DIR)
+                os.makedirs(pointer_dir, exist_ok=True)
+                save_image(
+                    pointer_dir, filename + '.json', json.dumps(
+                        {
+                            'path': source_path,
+                            'offset': location['offset'],
+                            'length': location['length'],
+                            'mime': location['mime'],
+                        }
+                    ).encode('utf-8')
+                )
+                self.deferred += 1
+                self._known.add(filename)
+        return filename
+
+    def stats(self):
+        return {
+            'references': self.references,
+            'unique': len(self._referenced),
+            'hashes_skipped': self.hashes_skipped,
+            'written': self.written,
+            'deferred': self.deferred,
+        }
+
+
+# one `ArtworkStore` per output directory in each process, shared by all files extracted in it.
+_artwork_stores = dict()
+
+
+def get_artwork_store(output_dir):
+    store = _artwork_stores.get(output_dir, None)
+    if store is None:
+        store = _artwork_stores[output_dir] = ArtworkStore(output_dir)
+    return store
+
+
+def release_artwork_store(output_dir):
+    # forget the store, so that the next scan lists `output_dir` again. return it, or None if never used.
+    return _artwork_stores.pop(output_dir, None)
+
+
+def load_deferred_pointers(output_dir):
+    pointer_dir = join(output_dir, DEFERRED_DIR)
+    ret = dict()
+    if not exists(pointer_dir):
+        return ret
+    for pointer_name in os.listdir(pointer_dir):
+        if pointer_name.startswith('.'):
+            continue
+        with open(join(pointer_dir, pointer_name), 'rt', encoding='utf-8') as f_pointer:
+            ret[splitext(pointer_name)[0]] = json.load(f_pointer)
+    return ret
+
+
+def extract_deferred_images(output_dir):
+    """extract every deferred image into `output_dir`, reading each source file once, in offset order.
+
+    an image whose bytes no longer match its name (the source file was edited or removed since the scan)
+    is not extracted, and its pointer is kept.
+
+    :return: a dict with the number of images `extracted`, and the file names of `stale` ones.
+    """
+    pointers = load_deferred_pointers(output_dir)
+    extracted = 0
+    stale = []
+    ordered = sorted(pointers.items(), key=lambda x: (x[1]['path'], x[1]['offset']))
+    for source_path, group in groupby(ordered, key=lambda x: x[1]['path']):
+        group = list(group)
+        try:
+            f = open(source_path, 'rb')
+        except OSError:
+            stale.extend(filename for filename, _ in group)
+            continue
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as mapped_view:
+            for filename, pointer in group:
+                with mapped_view[pointer['offset']:pointer['offset'] + pointer['length']] as image_view:
+                    if sha256(image_view).hexdigest() != splitext(filename)[0]:
+                        stale.append(filename)
+                        continue
+                    save_image(output_dir, filename, image_view)
+                os.remove(join(output_dir, DEFERRED_DIR, filename + '.json'))
+                extracted += 1
+    return {
+        'extracted': extracted,
+        'stale': stale,
+    }
+
+
+@contextmanager
+def open_image(output_dir, filename):
+    """the bytes of an image as a memoryview, from `output_dir` if extracted,
+    or else mapped straight from its source file."""
+    pointer_path = join(output_dir, DEFERRED_DIR, filename + '.json')
+    if exists(join(output_dir, filename)) or not exists(pointer_path):
+        with open(join(output_dir, filename), 'rb') as f:
+            yield memoryview(f.read())
+        return
+
+    with open(pointer_path, 'rt', encoding='utf-8') as f_pointer:
+        pointer = json.load(f_pointer)
+    with open(pointer['path'], 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as mapped_view:
+            with mapped_view[pointer['offset']:pointer['offset'] + pointer['length']] as image_view:
+                yield image_view
@@ -0,0 +1,326 @@
+"""read tags with bounded I/O: only the regions mutagen needs are read from the file,
+and mutagen parses a minimal copy of the file made of them.
+
+on a network share this avoids, e.g., mutagen walking past a large `mdat` to reach a trailing `moov`,
+or reading the padding of a FLAC file. anything unusual falls back to mutagen on the file itself.
+
+the embedded picture can be left out of the copy as well, recording only where it is in the file,
+so that it is neither read nor decoded while parsing tags.
+"""
+from io import BytesIO
+from os.path import splitext
+from struct import pack, pack_into, unpack, unpack_from
+
+from mutagen.dsf import DSF
+from mutagen.flac import FLAC
+from mutagen.mp4 import MP4
+
+
+class UnsupportedLayout(Exception):
+    pass
+
+
+class CountingReader:
+    """a read-only file wrapper counting the bytes read, so that mutagen's own I/O can be measured."""
+
+    def __init__(self, f):
+        self._f = f
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        n_read = self._f.readinto(buffer)
+        self.bytes_read += n_read or 0
+        return n_read
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def read_exact(f, offset, size):
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size:
+        raise UnsupportedLayout('truncated')
+    return data
+
+
+def synchsafe(data, offset):
+    return (data[offset] << 21) | (data[offset + 1] << 14) | (data[offset + 2] << 7) | data[offset + 3]
+
+
+def locate_flac_picture(f, offset, size):
+    # the PICTURE block at `offset`: picture type (4), MIME length (4), MIME, description length (4), description,
+    # width, height, color depth and number of colors (4 each), data length (4), then the data.
+    mime_length, = unpack('>I', read_exact(f, offset + 4, 4))
+    mime = read_exact(f, offset + 8, mime_length).decode('ascii')
+    description_length, = unpack('>I', read_exact(f, offset + 8 + mime_length, 4))
+    data_pos = 8 + mime_length + 4 + description_length + 16
+    data_length, = unpack('>I', read_exact(f, offset + data_pos, 4))
+    if data_pos + 4 + data_length > size:
+        raise UnsupportedLayout('invalid picture')
+    return {
+        'offset': offset + data_pos + 4,
+        'length': data_length,
+        'mime': mime,
+    }
+
+
+def minimal_flac(f, skip_cover=False):
+    # `fLaC` and every metadata block except PADDING, whose content mutagen does not need,
+    # and except PICTURE if `skip_cover`.
+    cover = None
+    if read_exact(f, 0, 4) != b'fLaC':
+        # including an ID3v2 tag in front, which mutagen handles.
+        raise UnsupportedLayout('no fLaC at the start')
+    offset = 4
+    blocks = []
+    while True:
+        block_header = read_exact(f, offset, 4)
+        block_type = block_header[0] & 0x7f
+        block_size = int.from_bytes(block_header[1:], 'big')
+        if block_type == 127:
+            raise UnsupportedLayout('invalid metadata block')
+        if block_type == 6 and skip_cover:
+            if cover is not None:
+                # left to mutagen, which reports it.
+                raise UnsupportedLayout('more than one picture')
+            cover = locate_flac_picture(f, offset + 4, block_size)
+        elif block_type != 1:
+            blocks.append((block_type, read_exact(f, offset + 4, block_size)))
+        offset += 4 + block_size
+        if block_header[0] & 0x80:
+            break
+    if len(blocks) == 0 or blocks[0][0] != 0:
+        raise UnsupportedLayout('STREAMINFO is not the first block')
+
+    ret = [b'fLaC']
+    for idx, (block_type, block) in enumerate(blocks):
+        is_last = idx == len(blocks) - 1
+        ret.append(bytes([block_type | (0x80 if is_last else 0)]) + len(block).to_bytes(3, 'big') + block)
+    return b''.join(ret), cover
+
+
+def find_box(f, start, end, box_type):
+    # (offset, size) of the first `box_type` box in [start, end), by box headers alone. None if there is none.
+    offset = start
+    while offset + 8 <= end:
+        box_size, box_type_this = unpack('>I4s', read_exact(f, offset, 8))
+        if box_size < 8 or offset + box_size > end:
+            # including 64-bit sizes, which are not expected inside `moov`.
+            raise UnsupportedLayout('invalid box')
+        if box_type_this == box_type:
+            return offset, box_size
+        offset += box_size
+    return None
+
+
+def minimal_moov_without_cover(f, moov_offset, moov_size):
+    # `moov` with its moov/udta/meta/ilst/covr box cut out, and where the image in it is.
+    # None if there is no `covr`.
+    parents = []
+    start, end = moov_offset + 8, moov_offset + moov_size
+    for box_type in [b'udta', b'meta', b'ilst']:
+        box = find_box(f, start, end, box_type)
+        if box is None:
+            return None
+        parents.append(box)
+        # `meta` has 4 bytes of version and flags before its children.
+        start, end = box[0] + (12 if box_type == b'meta' else 8), box[0] + box[1]
+    covr = find_box(f, start, end, b'covr')
+    if covr is None:
+        return None
+    covr_offset, covr_size = covr
+
+    data = find_box(f, covr_offset + 8, covr_offset + covr_size, b'data')
+    if data is None or data != (covr_offset + 8, covr_size - 8) or data[1] < 16:
+        # anything but a single image, left to mutagen.
+        raise UnsupportedLayout('not a single image in covr')
+    # `data`: type (4 bytes; 13 for JPEG, 14 for PNG) and locale (4 bytes), then the image.
+    data_type, = unpack('>I', read_exact(f, data[0] + 8, 4))
+    mime = {13: 'image/jpeg', 14: 'image/png'}.get(data_type & 0xffffff, None)
+    if mime is None:
+        raise UnsupportedLayout('unknown image type')
+
+    moov = bytearray(read_exact(f, moov_offset, covr_offset - moov_offset))
+    moov += read_exact(f, covr_offset + covr_size, moov_offset + moov_size - covr_offset - covr_size)
+    for box_offset, box_size in [(moov_offset, moov_size)] + parents:
+        pack_into('>I', moov, box_offset - moov_offset, box_size - covr_size)
+    return bytes(moov), {
+        'offset': data[0] + 16,
+        'length': data[1] - 16,
+        'mime': mime,
+    }
+
+
+def minimal_mp4(f, file_size, skip_cover=False):
+    # `ftyp` and `moov`, skipping over everything else (mainly `mdat`) by box headers alone.
+    # if `skip_cover`, the image in `moov` is not read.
+    ftyp = None
+    moov = None
+    offset = 0
+    while offset + 8 <= file_size:
+        box_size, box_type = unpack('>I4s', read_exact(f, offset, 8))
+        is_large = box_size == 1
+        if is_large:
+            box_size, = unpack('>Q', read_exact(f, offset + 8, 8))
+        elif box_size == 0:
+            box_size = file_size - offset
+        if box_size < 8 or offset + box_size > file_size:
+            raise UnsupportedLayout('invalid box')
+        if box_type == b'ftyp':
+            ftyp = read_exact(f, offset, box_size)
+        elif box_type == b'moov':
+            if moov is not None:
+                raise UnsupportedLayout('more than one moov')
+            if is_large:
+                raise UnsupportedLayout('64-bit moov')
+            moov = (offset, box_size)
+        offset += box_size
+    if ftyp is None or moov is None:
+        raise UnsupportedLayout('no ftyp or moov')
+
+    without_cover = minimal_moov_without_cover(f, *moov) if skip_cover else None
+    if without_cover is None:
+        return ftyp + read_exact(f, *moov), None
+    return ftyp + without_cover[0], without_cover[1]
+
+
+# bytes read from the start of an APIC frame to find where its image starts.
+APIC_HEAD_SIZE = 1024
+
+
+def id3_without_cover(f, tag_offset, id3_header):
+    # the frames of the ID3v2.3/2.4 tag at `tag_offset` with its APIC frame cut out, and where the image in it is.
+    # None if there is no APIC frame, or if it cannot be cut out verbatim.
+    if id3_header[3] not in {3, 4} or id3_header[5] & 0xd0:
+        # unsynchronisation, an extended header or a footer.
+        return None
+    tag_size = synchsafe(id3_header, 6)
+    apic = None
+    pos = 0
+    while pos + 10 <= tag_size:
+        frame_header = read_exact(f, tag_offset + 10 + pos, 10)
+        if frame_header[:4] == b'\x00\x00\x00\x00':
+            # padding.
+            break
+        if id3_header[3] == 4:
+            frame_size = synchsafe(frame_header, 4)
+            # grouping, compression, encryption, unsynchronisation or data length indicator.
+            frame_altered = frame_header[9] & 0x4f
+        else:
+            frame_size, = unpack_from('>I', frame_header, 4)
+            # compression, encryption or grouping.
+            frame_altered = frame_header[9] & 0xe0
+        if pos + 10 + frame_size > tag_size:
+            raise UnsupportedLayout('invalid frame')
+        if frame_header[:4] == b'APIC':
+            if apic is not None:
+                # left to mutagen, which reports it.
+                raise UnsupportedLayout('more than one picture')
+            if frame_altered:
+                return None
+            apic = (pos, frame_size)
+        pos += 10 + frame_size
+    if apic is None:
+        return None
+    apic_pos, frame_size = apic
+
+    # text encoding (1), MIME and its zero, picture type (1), description and its zero(s), then the image.
+    # the MIME and description are short.
+    frame = read_exact(f, tag_offset + 10 + apic_pos + 10, min(frame_size, APIC_HEAD_SIZE))
+    mime_end = frame.index(b'\x00', 1)
+    mime = frame[1:mime_end].decode('latin-1')
+    if frame[0] in {1, 2}:
+        # UTF-16, terminated by two zero bytes on a code unit boundary.
+        description_end = mime_end + 2
+        while frame[description_end:description_end + 2] != b'\x00\x00':
+            if description_end + 2 > len(frame):
+                raise UnsupportedLayout('description too long')
+            description_end += 2
+        data_pos = description_end + 2
+    else:
+        data_pos = frame.index(b'\x00', mime_end + 2) + 1
+
+    frames = read_exact(f, tag_offset + 10, apic_pos)
+    frames += read_exact(f, tag_offset + 10 + apic_pos + 10 + frame_size, tag_size - apic_pos - 10 - frame_size)
+    tag_size_new = len(frames)
+    id3_header = id3_header[:6] + bytes(
+        [(tag_size_new >> 21) & 0x7f, (tag_size_new >> 14) & 0x7f, (tag_size_new >> 7) & 0x7f, tag_size_new & 0x7f]
+    )
+    return id3_header + frames, {
+        'offset': tag_offset + 10 + apic_pos + 10 + data_pos,
+        'length': frame_size - data_pos,
+        'mime': mime,
+    }
+
+
+def minimal_dsf(f, skip_cover=False):
+    # `DSD ` and `fmt ` chunks, an empty `data` chunk, and the ID3 chunk right after it.
+    # if `skip_cover`, the APIC frame of the ID3 chunk is not read.
+    header = read_exact(f, 0, 92)
+    if header[:4] != b'DSD ' or header[28:32] != b'fmt ' or header[80:84] != b'data':
+        raise UnsupportedLayout('unexpected chunks')
+    metadata_offset, = unpack_from('<Q', header, 20)
+    dsd_chunk = header[:20] + pack('<Q', 92 if metadata_offset else 0)
+    data_chunk = b'data' + pack('<Q', 12)
+    if metadata_offset == 0:
+        return dsd_chunk + header[28:80] + data_chunk, None
+
+    id3_header = read_exact(f, metadata_offset, 10)
+    if id3_header[:3] != b'ID3':
+        raise UnsupportedLayout('no ID3 at the metadata offset')
+    without_cover = id3_without_cover(f, metadata_offset, id3_header) if skip_cover else None
+    if without_cover is not None:
+        return dsd_chunk + header[28:80] + data_chunk + without_cover[0], without_cover[1]
+    id3_size = 10 + synchsafe(id3_header, 6)
+    if id3_header[5] & 0x10:
+        # footer.
+        id3_size += 10
+    return (
+        dsd_chunk + header[28:80] + data_chunk + id3_header + read_exact(f, metadata_offset + 10, id3_size - 10),
+        None,
+    )
+
+
+MUTAGEN_CLASS = {
+    '.flac': FLAC,
+    '.m4a': MP4,
+    '.dsf': DSF,
+}
+
+
+def load_tags_bounded(file_name_full, *, skip_cover=False):
+    """parse `file_name_full` with mutagen, reading only the regions holding tags and stream info.
+
+    the returned object must not be saved, as it is backed by a copy of those regions.
+
+    :param skip_cover: leave the embedded picture out of the copy, and locate it instead.
+        the returned object then has no picture.
+    :return: the mutagen object, the number of bytes read from the file,
+        whether the bounded path was used (False if it fell back to mutagen on the whole file),
+        and the `offset`, `length` and `mime` of the picture left out (None if there was none, or on fallback).
+    """
+    ext = splitext(file_name_full)[1]
+    mutagen_class = MUTAGEN_CLASS[ext]
+    with open(file_name_full, 'rb') as f_raw:
+        f = CountingReader(f_raw)
+        try:
+            if ext == '.flac':
+                minimal, cover = minimal_flac(f, skip_cover)
+            elif ext == '.m4a':
+                f_raw.seek(0, 2)
+                minimal, cover = minimal_mp4(f, f_raw.tell(), skip_cover)
+            else:
+                minimal, cover = minimal_dsf(f, skip_cover)
+            return mutagen_class(BytesIO(minimal)), f.bytes_read, True, cover
+        except Exception:
+            # anything unusual, either in the layout or in what mutagen makes of the minimal copy.
+            pass
+        # fall back to mutagen on the whole file.
+        f_raw.seek(0)
+        return mutagen_class(f), f.bytes_read, False, None
@@ -1,11 +1,9 @@
-from hashlib import sha256
-from os.path import exists, join
-
 from mutagen.dsf import DSF
 from mutagen.id3 import ID3Tags, APIC
 
 from .. import ExtractionError
 from . import Tag
+from .artwork import get_artwork_store
 
 
 def fetch_one_field(
@@ -68,21 +66,14 @@ def tuple_converter(data, _):
     return data1, data2
 
 
-def cover_converter(data: APIC, output_dir):
-    # compute the hash (sha256)
-    hexdigest = sha256(bytes(data.data)).hexdigest()
-    # save the file.
-    ext = {
-        'image/jpeg': '.jpg',
-    }[data.mime]
-    filename = hexdigest + ext
+COVER_EXT = {
+    'image/jpeg': '.jpg',
+}
 
-    fullpath = join(output_dir, filename)
-    if not exists(fullpath):
-        with open(fullpath, 'wb') as f:
-            f.write(bytes(data.data))
 
-    return filename
+def cover_converter(data: APIC, output_dir):
+    # save the file, named by its sha256.
+    return get_artwork_store(output_dir).save(bytes(data.data), COVER_EXT[data.mime])
 
 
 TAG_MAPPING_DSF = {
@@ -105,8 +96,14 @@ TAG_MAPPING_DSF = {
 def get_meta_data_dsf(
         file_name_full,
         image_output_dir=None,
+        *,
+        # an already parsed `DSF(file_name_full)`, to avoid parsing it again.
+        dsf_obj=None,
+        # where the picture left out of `dsf_obj` is in the file, to be saved with `save_deferred`.
+        cover=None,
 ):
-    dsf_obj = DSF(file_name_full)
+    if dsf_obj is None:
+        dsf_obj = DSF(file_name_full)
 
     try:
         dsf_info = dsf_obj.info
@@ -127,6 +124,10 @@ def get_meta_data_dsf(
         ret = {
             k: fetch_one_field(dsf_tags, field, func, image_output_dir) for k, (field, func) in TAG_MAPPING_DSF.items()
         }
+        if cover is not None:
+            ret[Tag.COVER_ART] = get_artwork_store(image_output_dir).save_deferred(
+                file_name_full, cover, COVER_EXT[cover['mime']]
+            )
 
         ret[Tag.DURATION] = dsf_info.length
 
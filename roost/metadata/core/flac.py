@@ -1,10 +1,8 @@
-from hashlib import sha256
-from os.path import exists, join
-
 from mutagen.flac import FLAC, Picture
 
 from .. import ExtractionError
 from . import Tag
+from .artwork import get_artwork_store
 
 
 def fetch_one_field(
@@ -50,22 +48,15 @@ def int_in_str_converter(data, _):
     return data_int
 
 
-def cover_converter(data: Picture, output_dir):
-    # compute the hash (sha256)
-    hexdigest = sha256(data.data).hexdigest()
-    # save the file.
-    ext = {
-        "image/jpeg": '.jpg',
-        "image/png": '.png'
-    }[data.mime]
-    filename = hexdigest + ext
+COVER_EXT = {
+    "image/jpeg": '.jpg',
+    "image/png": '.png'
+}
 
-    fullpath = join(output_dir, filename)
-    if not exists(fullpath):
-        with open(fullpath, 'wb') as f:
-            f.write(data.data)
 
-    return filename
+def cover_converter(data: Picture, output_dir):
+    # save the file, named by its sha256.
+    return get_artwork_store(output_dir).save(data.data, COVER_EXT[data.mime])
 
 
 TAG_MAPPING_FLAC = {
@@ -88,8 +79,14 @@ TAG_MAPPING_FLAC = {
 def get_meta_data_flac(
         file_name_full,
         image_output_dir=None,
+        *,
+        # an already parsed `FLAC(file_name_full)`, to avoid parsing it again.
+        flac_obj=None,
+        # where the picture left out of `flac_obj` is in the file, to be saved with `save_deferred`.
+        cover=None,
 ):
-    flac_obj = FLAC(file_name_full)
+    if flac_obj is None:
+        flac_obj = FLAC(file_name_full)
 
     try:
         flac_info = flac_obj.info
@@ -109,6 +106,10 @@ def get_meta_data_flac(
         ret = {
             k: fetch_one_field(flac_obj, field, func, image_output_dir) for k, (field, func) in TAG_MAPPING_FLAC.items()
         }
+        if cover is not None:
+            ret[Tag.COVER_ART] = get_artwork_store(image_output_dir).save_deferred(
+                file_name_full, cover, COVER_EXT[cover['mime']]
+            )
 
         ret[Tag.DURATION] = flac_info.length
 
@@ -1,19 +1,34 @@
-from os.path import join, isabs, splitext, dirname
-from os import walk
+import json
+from collections import OrderedDict
+from os.path import join, isabs, splitext, dirname, exists
+from os import walk, replace
 from subprocess import check_call
 from tempfile import TemporaryDirectory
 from xml.etree import ElementTree
 
 from .. import ExtractionError
 from . import Tag
+from .sacdtoc import read_sacd_toc, sacd_toc_to_xml
 
 from ... import BIN_SACDEXTRACT
+from ...instrument import stage
 
 
 def fetch_sacd_xml(
         full_name_full,
+        *,
+        native=False,
 ):
-    with TemporaryDirectory() as tmp_dir:
+    if native:
+        # read the TOC sectors directly, without sacd_extract and its temporary files.
+        try:
+            with stage('sacd_toc'):
+                return sacd_toc_to_xml(read_sacd_toc(full_name_full))
+        except ExtractionError:
+            # unusual layout; leave it to sacd_extract.
+            pass
+
+    with stage('sacd_extract'), TemporaryDirectory() as tmp_dir:
         assert isabs(tmp_dir)
         check_call(
             [
@@ -36,6 +51,68 @@ def fetch_sacd_xml(
     raise ExtractionError('cannot extract')
 
 
+def sacd_xml_to_text(xml_obj):
+    return ElementTree.tostring(xml_obj.getroot(), encoding='unicode')
+
+
+def sacd_xml_from_text(xml_text):
+    return ElementTree.ElementTree(ElementTree.fromstring(xml_text))
+
+
+class SacdXmlCache:
+    """LRU cache of `fetch_sacd_xml` results, keyed by (path, size, mtime) of the ISO,
+    so that unchanged discs never go through sacd_extract again.
+
+    entries are kept as XML text, and persisted as JSON in least recently used first order.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        # (path, size, mtime) -> xml text
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, cache_path, max_entries=10000):
+        ret = cls(max_entries)
+        if exists(cache_path):
+            with open(cache_path, 'rt', encoding='utf-8') as f_cache:
+                for full_path, size, mtime, xml_text in json.load(f_cache)['entries']:
+                    ret.put(full_path, size, mtime, xml_text)
+        return ret
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, full_path, size, mtime):
+        xml_text = self._entries.get((full_path, size, mtime), None)
+        if xml_text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end((full_path, size, mtime))
+        return xml_text
+
+    def put(self, full_path, size, mtime, xml_text):
+        self._entries[full_path, size, mtime] = xml_text
+        self._entries.move_to_end((full_path, size, mtime))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def save(self, cache_path):
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wt', encoding='utf-8') as f_cache:
+            json.dump(
+                {
+                    'entries': [[*key, xml_text] for key, xml_text in self._entries.items()],
+                },
+                f_cache,
+                allow_nan=False,
+            )
+        replace(tmp_path, cache_path)
+
+
 def string_converter(x):
     return x.strip()
 
@@ -93,8 +170,10 @@ def fetch_album_and_area(xml_obj):
     return album, area
 
 
-def get_total_tracks(file_name_full):
-    xml_obj = fetch_sacd_xml(file_name_full)
+def get_total_tracks(file_name_full, *, xml_obj=None):
+    # `xml_obj` is an already fetched `fetch_sacd_xml(file_name_full)`, to avoid running sacd_extract again.
+    if xml_obj is None:
+        xml_obj = fetch_sacd_xml(file_name_full)
     album, area = fetch_album_and_area(xml_obj)
     total_tracks = int(area.attrib['totaltracks'])
     assert len(area) == total_tracks
@@ -104,9 +183,13 @@ def get_total_tracks(file_name_full):
 def get_meta_data_sacd_iso(
         file_name_full,
         overwrite_result_dict=None,
+        *,
+        # an already fetched `fetch_sacd_xml(file_name_full)`, to avoid running sacd_extract again.
+        xml_obj=None,
 ):
     try:
-        xml_obj = fetch_sacd_xml(file_name_full)
+        if xml_obj is None:
+            xml_obj = fetch_sacd_xml(file_name_full)
         album, area = fetch_album_and_area(xml_obj)
         total_tracks = int(area.attrib['totaltracks'])
         assert len(area) == total_tracks
@@ -0,0 +1,210 @@
+"""read the Master TOC and the 2-channel Area TOC of a SACD ISO directly, without sacd_extract.
+
+the layout follows the Scarletbook structures as used by sacd_extract (`scarletbook.h`).
+all integers are big-endian, and all sectors are 2048 bytes.
+"""
+from struct import error as struct_error, unpack_from
+from xml.etree import ElementTree
+
+from .. import ExtractionError
+
+SACD_SECTOR_SIZE = 2048
+MASTER_TOC_SECTOR = 510
+MASTER_TEXT_SECTOR = 511
+
+# `character_set` of a locale -> python codec.
+CHARACTER_SETS = {
+    0: 'latin-1',
+    1: 'ascii',
+    2: 'latin-1',
+    3: 'shift_jis',
+    4: 'euc_kr',
+    5: 'gb2312',
+    6: 'big5',
+    7: 'latin-1',
+}
+
+# index of the genre tables in the TOC; 0 and 1 mean no genre.
+GENRES = [
+    None, None, 'Adult Contemporary', 'Alternative Rock', "Children's Music", 'Classical',
+    'Contemporary Christian', 'Country', 'Dance', 'Easy Listening', 'Erotic', 'Folk', 'Gospel',
+    'Hip Hop', 'Jazz', 'Latin', 'Musical', 'New Age', 'Opera', 'Operetta', 'Pop Music', 'Rap',
+    'Reggae', 'Rock Music', 'Rhythm & Blues', 'Sound Effects', 'Sound Track', 'Spoken Word',
+    'World Music', 'Blues',
+]
+
+# `text_type` of items in the track text.
+TRACK_TEXT_TITLE = 0x01
+TRACK_TEXT_PERFORMER = 0x02
+TRACK_TEXT_COMPOSER = 0x04
+
+
+def read_sectors(f, sector, count):
+    f.seek(sector * SACD_SECTOR_SIZE)
+    data = f.read(count * SACD_SECTOR_SIZE)
+    if len(data) != count * SACD_SECTOR_SIZE:
+        raise ExtractionError('TOC is beyond the end of file')
+    return data
+
+
+def read_string(data, offset, encoding):
+    # a zero-terminated string; offset 0 means none.
+    if offset == 0 or offset >= len(data):
+        return None
+    end = data.find(b'\x00', offset)
+    if end < 0:
+        end = len(data)
+    ret = data[offset:end].decode(encoding, errors='replace').strip()
+    return ret if ret else None
+
+
+def genre_name(data, offset):
+    # genre_table_t: category (1), reserved (2), genre (1).
+    genre = data[offset + 3]
+    return GENRES[genre] if genre < len(GENRES) else None
+
+
+def read_master_toc(f):
+    master = read_sectors(f, MASTER_TOC_SECTOR, 1)
+    if master[:8] != b'SACDMTOC':
+        raise ExtractionError('no master TOC')
+    set_size, sequence_number = unpack_from('>HH', master, 16)
+    area_2ch_start, = unpack_from('>I', master, 64)
+    area_2ch_size, = unpack_from('>H', master, 84)
+    disc_year, = unpack_from('>H', master, 120)
+    # the first locale.
+    encoding = CHARACTER_SETS.get(master[136 + 2], 'latin-1')
+
+    album_title = album_artist = None
+    text = read_sectors(f, MASTER_TEXT_SECTOR, 1)
+    if text[:8] == b'SACDText':
+        album_title_position, album_artist_position = unpack_from('>HH', text, 16)
+        album_title = read_string(text, album_title_position, encoding)
+        album_artist = read_string(text, album_artist_position, encoding)
+
+    return {
+        'set_size': set_size,
+        'sequence_number': sequence_number,
+        'album_genre': genre_name(master, 40),
+        'area_2ch_start': area_2ch_start,
+        'area_2ch_size': area_2ch_size,
+        'year': disc_year if disc_year > 0 else None,
+        'album_title': album_title,
+        'album_artist': album_artist,
+    }
+
+
+def read_track_text(data, offset, encoding):
+    # item count (1), reserved (3), then for each item: text_type (1), padding (1) and a zero-terminated string,
+    # followed by zero padding.
+    ret = dict()
+    amount = data[offset]
+    ptr = offset + 4
+    for idx in range(amount):
+        text_type = data[ptr]
+        ptr += 2
+        ret.setdefault(text_type, read_string(data, ptr, encoding))
+        if idx < amount - 1:
+            while ptr < len(data) and data[ptr] != 0:
+                ptr += 1
+            while ptr < len(data) and data[ptr] == 0:
+                ptr += 1
+    return ret
+
+
+def read_area_toc(f, start, size):
+    area = read_sectors(f, start, size)
+    if area[:8] != b'TWOCHTOC':
+        raise ExtractionError('no 2-channel area TOC')
+    track_count = area[69]
+    if track_count == 0:
+        raise ExtractionError('no track in the 2-channel area')
+    encoding = CHARACTER_SETS.get(area[88 + 2], 'latin-1')
+
+    durations = None
+    track_texts = None
+    track_genres = None
+    # the other structures of the area follow in their own sectors, each starting with an id.
+    for sector_offset in range(SACD_SECTOR_SIZE, len(area), SACD_SECTOR_SIZE):
+        sector_id = area[sector_offset:sector_offset + 8]
+        if sector_id == b'SACDTRL2' and durations is None:
+            # start and duration of each track, as (minutes, seconds, frames, flags).
+            durations = [
+                area[sector_offset + 8 + 255 * 4 + idx * 4:sector_offset + 8 + 255 * 4 + idx * 4 + 3]
+                for idx in range(track_count)
+            ]
+        elif sector_id == b'SACD_IGL' and track_genres is None:
+            # ISRC of each track (12 bytes), then the genre of each track.
+            track_genres = [
+                genre_name(area, sector_offset + 8 + 255 * 12 + idx * 4) for idx in range(track_count)
+            ]
+        elif sector_id == b'SACDTTxt' and track_texts is None:
+            # only the first text channel is used. a position of 0, relative to the sector, means no text.
+            positions = unpack_from(f'>{track_count}H', area, sector_offset + 8)
+            track_texts = [
+                read_track_text(area, sector_offset + x, encoding) if x != 0 else dict() for x in positions
+            ]
+    if durations is None:
+        raise ExtractionError('no track list in the 2-channel area')
+
+    return {
+        'track_count': track_count,
+        'durations': ['{:02d}:{:02d}:{:02d}'.format(*x) for x in durations],
+        'track_texts': track_texts if track_texts is not None else [dict() for _ in range(track_count)],
+        'track_genres': track_genres if track_genres is not None else [None] * track_count,
+    }
+
+
+def read_sacd_toc(file_name_full):
+    """read what `get_meta_data_sacd_iso` needs from the TOC of a SACD ISO.
+
+    only the Master TOC, the master text and the 2-channel Area TOC sectors are read.
+    """
+    with open(file_name_full, 'rb') as f:
+        master = read_master_toc(f)
+        if master['area_2ch_start'] == 0 or master['area_2ch_size'] == 0:
+            raise ExtractionError('no 2-channel area')
+        try:
+            area = read_area_toc(f, master['area_2ch_start'], master['area_2ch_size'])
+        except (IndexError, struct_error) as e:
+            # offsets pointing outside the TOC.
+            raise ExtractionError('invalid 2-channel area TOC', e)
+    return {
+        'master': master,
+        'area': area,
+    }
+
+
+def sacd_toc_to_xml(toc):
+    """the TOC as an `ElementTree` shaped like the XML exported by sacd_extract,
+    i.e., one `Album` element and one `Area` element of tracks, each track with `name`/`value` children."""
+    master = toc['master']
+    area = toc['area']
+
+    root = ElementTree.Element('SACD')
+    ElementTree.SubElement(
+        root, 'Album',
+        set_size=str(master['set_size']), sequence_number=str(master['sequence_number']),
+    )
+    area_element = ElementTree.SubElement(
+        root, 'Area', speaker_configuration='2 Channel', totaltracks=str(area['track_count']),
+    )
+    for idx in range(area['track_count']):
+        track_text = area['track_texts'][idx]
+        metas = {
+            'TITLE': track_text.get(TRACK_TEXT_TITLE, None),
+            'PERFORMER': track_text.get(TRACK_TEXT_PERFORMER, None),
+            'ALBUM': master['album_title'],
+            'ALBUM ARTIST': master['album_artist'],
+            'DATE': None if master['year'] is None else str(master['year']),
+            'TRACKNUMBER': str(idx + 1),
+            'TOTALTRACKS': str(area['track_count']),
+            'GENRE': area['track_genres'][idx] or master['album_genre'],
+            'COMPOSER': track_text.get(TRACK_TEXT_COMPOSER, None),
+            'Duration': area['durations'][idx],
+        }
+        track_element = ElementTree.SubElement(area_element, 'Track')
+        for name, value in metas.items():
+            if value is not None:
+                ElementTree.SubElement(track_element, 'Meta', name=name, value=value)
+    return ElementTree.ElementTree(root)
@@ -0,0 +1,154 @@
+"""progress events of a scan, with throughput and ETA"""
+from os.path import join
+from time import perf_counter
+
+from .walker import walk_directory
+
+
+def count_files(input_dir, *, is_ignored=None, on_directory=None):
+    """count the files a scan of `input_dir` will go through, and their sizes, walking it as the scan does.
+
+    :param is_ignored: a function taking a directory path; the directory is pruned if it returns True.
+    :param on_directory: if not None, called with the number of files counted so far after each directory.
+    :return: a dict of file path -> size.
+    """
+    ret = dict()
+    if is_ignored is not None and is_ignored(input_dir):
+        return ret
+    for dirpath, dirnames, file_entries in walk_directory(input_dir):
+        if is_ignored is not None:
+            dirnames[:] = [dirname for dirname in dirnames if not is_ignored(join(dirpath, dirname))]
+        for file_entry in file_entries:
+            if file_entry.name.startswith('.'):
+                continue
+            try:
+                ret[join(dirpath, file_entry.name)] = file_entry.stat().st_size
+            except OSError:
+                # the scan will report it.
+                ret[join(dirpath, file_entry.name)] = 0
+        if on_directory is not None:
+            on_directory(len(ret))
+    return ret
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+def print_progress(event):
+    if event['stage'] == 'precount':
+        print(f'counting files: {event["files_total"]} files')
+        return
+    files_total = '?' if event['files_total'] is None else event['files_total']
+    eta = '?' if event['eta'] is None else format_seconds(event['eta'])
+    print(
+        f'{event["stage"]}: {event["folders"]} folders, {event["files_done"]}/{files_total} files, '
+        f'{event["files_per_sec"]:.1f} files/s, {event["bytes_per_sec"] / 2 ** 20:.1f} MiB/s, '
+        f'elapsed {format_seconds(event["elapsed"])}, ETA {eta}'
+    )
+
+
+class ProgressTracker:
+    """count the files done in a scan, and send progress events to `callback`,
+    at most once every `interval` seconds, and whenever the stage changes.
+
+    an event is a dict of
+        `stage`: 'precount', 'scan' (walking and extracting), 'drain' (waiting for the last extractions), or 'done',
+        `folders`, `files_walked`, `files_done`,
+        `files_total` and `bytes_total`: from the pre-count, or None without one,
+        `bytes_done`: sizes of the files done,
+        `elapsed`, `files_per_sec` and `bytes_per_sec`: since the scan started, after the pre-count,
+        `eta`: seconds left, by bytes if known, otherwise by files. None without a pre-count.
+        `current_path`: the file done last.
+
+    files reusing cached results are done quickly, so the rates (and the ETA) early in a scan
+    reusing a previous one are optimistic.
+    """
+
+    def __init__(self, callback, *, interval=10.0):
+        self.callback = callback
+        self.interval = interval
+        self.stage = 'scan'
+        self.sizes = None
+        self.files_total = None
+        self.bytes_total = None
+
+        self.folders = 0
+        self.files_walked = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.current_path = None
+        self._t_start = perf_counter()
+        self._t_last = None
+
+    def precount(self, input_dir, *, is_ignored=None):
+        self.stage = 'precount'
+        self.files_total = 0
+        self._t_last = None
+
+        def on_directory(files_total):
+            self.files_total = files_total
+            self.emit()
+
+        self.sizes = count_files(input_dir, is_ignored=is_ignored, on_directory=on_directory)
+        self.files_total = len(self.sizes)
+        self.bytes_total = sum(self.sizes.values())
+        self.emit(force=True)
+        self.set_stage('scan')
+        # rates are for the scan itself.
+        self._t_start = perf_counter()
+
+    def set_stage(self, stage):
+        if stage != self.stage:
+            self.stage = stage
+            self.emit(force=True)
+
+    def walked(self, *, folders=0, files=0):
+        self.folders += folders
+        self.files_walked += files
+
+    def done(self, full_path, size=None):
+        # `size` can be None if the file was never stat'ed, e.g., skipped or quarantined.
+        if size is None and self.sizes is not None:
+            size = self.sizes.get(full_path, 0)
+        self.files_done += 1
+        self.bytes_done += size or 0
+        self.current_path = full_path
+        self.emit()
+
+    def event(self):
+        elapsed = perf_counter() - self._t_start
+        files_per_sec = self.files_done / elapsed if elapsed > 0 else 0.0
+        bytes_per_sec = self.bytes_done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.stage == 'done':
+            eta = 0.0
+        elif self.stage != 'precount':
+            if self.bytes_total is not None and bytes_per_sec > 0:
+                eta = max(self.bytes_total - self.bytes_done, 0) / bytes_per_sec
+            elif self.files_total is not None and files_per_sec > 0:
+                eta = max(self.files_total - self.files_done, 0) / files_per_sec
+        return {
+            'stage': self.stage,
+            'folders': self.folders,
+            'files_walked': self.files_walked,
+            'files_done': self.files_done,
+            'files_total': self.files_total,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'elapsed': elapsed,
+            'files_per_sec': files_per_sec,
+            'bytes_per_sec': bytes_per_sec,
+            'eta': eta,
+            'current_path': self.current_path,
+        }
+
+    def emit(self, force=False):
+        if self.callback is None:
+            return
+        now = perf_counter()
+        if not force and self._t_last is not None and now - self._t_last < self.interval:
+            return
+        self._t_last = now
+        self.callback(self.event())
@@ -0,0 +1,365 @@
+"""queries over the tracks of a `TrackManager`, for smart playlists.
+
+a query is a predicate on `Tag` and `Extra` fields, such as
+
+    Eq(Tag.GENRE, 'Jazz') & between(Tag.YEAR, 1990, 1999) & ~Eq(Extra.HATE, True)
+
+and `QueryEngine.query` returns the ids of the matching tracks, in increasing order.
+
+each field queried gets a `FieldIndex`, built on first use and kept up to date as tracks are added,
+and as fields are set through `TrackView.core_metadata` and `TrackView.extra_metadata`.
+an `And` evaluates its most selective part first through the indexes, and then only checks
+the remaining (less selective) parts on the tracks left, instead of looking up all of their matches.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from .metadata.core import Tag
+from .metadata.extra import Extra
+from .trackstore import CORE, EXTRA
+
+# a part of an `And` matching more than this many times as many tracks as those left is checked on them
+# one by one, rather than through its index.
+FILTER_RATIO = 4
+
+
+def field_key(field):
+    # a `Tag` or `Extra` -> (group, name) in `TrackStore`.
+    if isinstance(field, Tag):
+        return CORE, field.name
+    if isinstance(field, Extra):
+        return EXTRA, field.name
+    raise TypeError(f'not a Tag or Extra field: {repr(field)}')
+
+
+class FieldIndex:
+    """index of one field.
+
+    `postings` (inverted index) maps each value, including None, to the ids of the tracks having it, in increasing order.
+    for range queries, the distinct values (other than None) are also kept sorted, with the cumulative number
+    of tracks, re-sorted on the first range query after new values are added.
+    """
+
+    def __init__(self):
+        self.postings = dict()
+        # (sorted values, cumulative counts), or None if out of date.
+        self._sorted = None
+
+    def add(self, ids, values):
+        postings = self.postings
+        for track_id, value in zip(ids, values):
+            posting = postings.get(value, None)
+            if posting is None:
+                posting = postings[value] = array('q')
+            posting.append(track_id)
+        self._sorted = None
+
+    def update(self, track_id, old_value, value):
+        # move a track from the posting of its old value to that of its new one, keeping both in order.
+        if old_value == value and type(old_value) is type(value):
+            return
+        posting = self.postings[old_value]
+        posting.remove(track_id)
+        if len(posting) == 0:
+            del self.postings[old_value]
+        posting = self.postings.get(value, None)
+        if posting is None:
+            posting = self.postings[value] = array('q')
+        posting.insert(bisect_left(posting, track_id), track_id)
+        self._sorted = None
+
+    def sorted_values(self):
+        if self._sorted is None:
+            values = sorted(x for x in self.postings if x is not None)
+            counts = list(accumulate((len(self.postings[x]) for x in values), initial=0))
+            self._sorted = values, counts
+        return self._sorted
+
+    def value_range(self, lo, hi, lo_inclusive, hi_inclusive):
+        # start and end of the values in the range, in `sorted_values`.
+        values, _ = self.sorted_values()
+        if lo is None:
+            start = 0
+        else:
+            start = (bisect_left if lo_inclusive else bisect_right)(values, lo)
+        if hi is None:
+            end = len(values)
+        else:
+            end = (bisect_right if hi_inclusive else bisect_left)(values, hi)
+        return start, max(start, end)
+
+    def count(self, value):
+        posting = self.postings.get(value, None)
+        return 0 if posting is None else len(posting)
+
+    def ids(self, value):
+        return self.postings.get(value, array('q'))
+
+    def count_range(self, lo, hi, lo_inclusive=True, hi_inclusive=True):
+        start, end = self.value_range(lo, hi, lo_inclusive, hi_inclusive)
+        counts = self.sorted_values()[1]
+        return counts[end] - counts[start]
+
+    def ids_range(self, lo, hi, lo_inclusive=True, hi_inclusive=True):
+        start, end = self.value_range(lo, hi, lo_inclusive, hi_inclusive)
+        values = self.sorted_values()[0]
+        if end - start == 1:
+            return self.postings[values[start]]
+        ret = array('q')
+        for value in values[start:end]:
+            ret.extend(self.postings[value])
+        return sorted(ret)
+
+
+class Predicate:
+    """a condition on a track. combine them with `&`, `|` and `~`.
+
+    `estimate` is the number of matching tracks (an upper bound for `And`, `Or` and `Not`), for planning,
+    `ids` the ids of the matching tracks in increasing order, and `match` checks one track.
+    """
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def estimate(self, engine):
+        raise NotImplementedError
+
+    def ids(self, engine):
+        raise NotImplementedError
+
+    def match(self, engine, track_id):
+        raise NotImplementedError
+
+
+class Eq(Predicate):
+    def __init__(self, field, value):
+        self.key = field_key(field)
+        self.value = value
+
+    def estimate(self, engine):
+        return engine.index(self.key).count(self.value)
+
+    def ids(self, engine):
+        return engine.index(self.key).ids(self.value)
+
+    def match(self, engine, track_id):
+        return engine.value(self.key, track_id) == self.value
+
+    def __repr__(self):
+        return f'Eq({self.key[1]}, {repr(self.value)})'
+
+
+class In(Predicate):
+    def __init__(self, field, values):
+        self.key = field_key(field)
+        self.values = set(values)
+
+    def estimate(self, engine):
+        index = engine.index(self.key)
+        return sum(index.count(x) for x in self.values)
+
+    def ids(self, engine):
+        index = engine.index(self.key)
+        ret = array('q')
+        for value in self.values:
+            ret.extend(index.ids(value))
+        return sorted(ret)
+
+    def match(self, engine, track_id):
+        return engine.value(self.key, track_id) in self.values
+
+    def __repr__(self):
+        return f'In({self.key[1]}, {repr(sorted(self.values, key=repr))})'
+
+
+class Range(Predicate):
+    """`lo` <= value <= `hi`, with either bound None for no bound, and tracks without a value never matching."""
+
+    def __init__(self, field, lo=None, hi=None, *, lo_inclusive=True, hi_inclusive=True):
+        self.key = field_key(field)
+        self.lo = lo
+        self.hi = hi
+        self.lo_inclusive = lo_inclusive
+        self.hi_inclusive = hi_inclusive
+
+    def estimate(self, engine):
+        return engine.index(self.key).count_range(self.lo, self.hi, self.lo_inclusive, self.hi_inclusive)
+
+    def ids(self, engine):
+        return engine.index(self.key).ids_range(self.lo, self.hi, self.lo_inclusive, self.hi_inclusive)
+
+    def match(self, engine, track_id):
+        value = engine.value(self.key, track_id)
+        if value is None:
+            return False
+        if self.lo is not None and not (self.lo <= value if self.lo_inclusive else self.lo < value):
+            return False
+        if self.hi is not None and not (value <= self.hi if self.hi_inclusive else value < self.hi):
+            return False
+        return True
+
+    def __repr__(self):
+        return (
+            f'Range({self.key[1]}, {"[" if self.lo_inclusive else "("}{repr(self.lo)}, '
+            f'{repr(self.hi)}{"]" if self.hi_inclusive else ")"})'
+        )
+
+
+def between(field, lo, hi):
+    return Range(field, lo, hi)
+
+
+def at_least(field, lo):
+    return Range(field, lo, None)
+
+
+def at_most(field, hi):
+    return Range(field, None, hi)
+
+
+class And(Predicate):
+    def __init__(self, *predicates):
+        # nested `And`s are flattened, so that all parts are planned together.
+        self.predicates = []
+        for predicate in predicates:
+            if type(predicate) is And:
+                self.predicates.extend(predicate.predicates)
+            else:
+                self.predicates.append(predicate)
+
+    def estimate(self, engine):
+        return min(x.estimate(engine) for x in self.predicates)
+
+    def plan(self, engine):
+        # (estimate, predicate), most selective first.
+        return sorted(((x.estimate(engine), x) for x in self.predicates), key=lambda x: x[0])
+
+    def ids(self, engine):
+        plan = self.plan(engine)
+        ret = plan[0][1].ids(engine)
+        for estimate, predicate in plan[1:]:
+            if len(ret) == 0:
+                break
+            if estimate > FILTER_RATIO * len(ret):
+                ret = [x for x in ret if predicate.match(engine, x)]
+            else:
+                ids_this = set(predicate.ids(engine))
+                ret = [x for x in ret if x in ids_this]
+        return ret
+
+    def match(self, engine, track_id):
+        return all(x.match(engine, track_id) for x in self.predicates)
+
+    def __repr__(self):
+        return ' & '.join(f'({repr(x)})' if type(x) is Or else repr(x) for x in self.predicates)
+
+
+class Or(Predicate):
+    def __init__(self, *predicates):
+        self.predicates = []
+        for predicate in predicates:
+            if type(predicate) is Or:
+                self.predicates.extend(predicate.predicates)
+            else:
+                self.predicates.append(predicate)
+
+    def estimate(self, engine):
+        return min(sum(x.estimate(engine) for x in self.predicates), len(engine.track_manager.store))
+
+    def ids(self, engine):
+        ret = set()
+        for predicate in self.predicates:
+            ret.update(predicate.ids(engine))
+        return sorted(ret)
+
+    def match(self, engine, track_id):
+        return any(x.match(engine, track_id) for x in self.predicates)
+
+    def __repr__(self):
+        return ' | '.join(repr(x) for x in self.predicates)
+
+
+class Not(Predicate):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def estimate(self, engine):
+        return max(len(engine.track_manager.store) - self.predicate.estimate(engine), 0)
+
+    def ids(self, engine):
+        excluded = set(self.predicate.ids(engine))
+        return [x for x in range(len(engine.track_manager.store)) if x not in excluded]
+
+    def match(self, engine, track_id):
+        return not self.predicate.match(engine, track_id)
+
+    def __repr__(self):
+        return f'~({repr(self.predicate)})'
+
+
+class QueryEngine:
+    """queries over the tracks of `track_manager`, with the indexes of the fields queried.
+
+    :param fields: `Tag` and `Extra` fields to index right away. others are indexed on first use.
+    """
+
+    def __init__(self, track_manager, fields=()):
+        self.track_manager = track_manager
+        # (group, name) -> `FieldIndex`
+        self.indexes = dict()
+        for field in fields:
+            self.index(field_key(field))
+        track_manager.on_add.append(self.add)
+        track_manager.store.on_set.append(self.set)
+
+    def column_values(self, key, ids):
+        # values of a field for some tracks. tracks without the field count as None.
+        column = self.track_manager.store.columns[key[0]].get(key[1], None)
+        if column is None:
+            return [None] * len(ids)
+        if len(ids) == len(column):
+            return column.to_list()
+        return [column[x] for x in ids]
+
+    def index(self, key):
+        index = self.indexes.get(key, None)
+        if index is None:
+            index = self.indexes[key] = FieldIndex()
+            ids = range(len(self.track_manager.store))
+            index.add(ids, self.column_values(key, ids))
+        return index
+
+    def add(self, ids):
+        # called by `TrackManager` with the ids of the tracks added.
+        for key, index in self.indexes.items():
+            index.add(ids, self.column_values(key, ids))
+
+    def set(self, track_id, group, name, old_value):
+        # called by `TrackStore` after a field of a track is set.
+        index = self.indexes.get((group, name), None)
+        if index is not None:
+            index.update(track_id, old_value, self.value((group, name), track_id))
+
+    def value(self, key, track_id):
+        column = self.track_manager.store.columns[key[0]].get(key[1], None)
+        return None if column is None else column[track_id]
+
+    def query(self, predicate: Predicate):
+        """ids of the tracks matching `predicate`, in increasing order."""
+        return list(predicate.ids(self))
+
+    def tracks(self, predicate: Predicate):
+        return [self.track_manager.track(x) for x in self.query(predicate)]
+
+    def explain(self, predicate: Predicate):
+        # the order in which the parts of `predicate` are evaluated, with their estimates.
+        if type(predicate) is And:
+            return [(repr(x), estimate) for estimate, x in predicate.plan(self)]
+        return [(repr(predicate), predicate.estimate(self))]
@@ -1,26 +1,50 @@
 """utilities to sanity check the library"""
 import os
 import stat
+import traceback
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from os import path
 from os.path import join
 from enum import Enum, auto
+from time import perf_counter
 from unicodedata import is_normalized
+from mutagen.dsf import DSF
 from mutagen.flac import FLAC
+from mutagen.mp4 import MP4
 from .metadata.core.alac import get_meta_data_alac
 from .metadata.core.flac import get_meta_data_flac
 from .metadata.core.dsf import get_meta_data_dsf
-from .metadata.core.sacdiso import get_meta_data_sacd_iso, get_total_tracks
-from .metadata.core import check_valid_metadata
+from .metadata.core.sacdiso import (
+    get_meta_data_sacd_iso,
+    get_total_tracks,
+    fetch_sacd_xml,
+    sacd_xml_from_text,
+    sacd_xml_to_text,
+)
+from .metadata.core import check_valid_metadata, Tag
+from .metadata.core.artwork import release_artwork_store
+from .metadata.core.bounded import load_tags_bounded
 from .metadata.checksum import (
     get_checksum_in_24bit,
     check_valid_checksum_output,
     get_checksum_in_raw_stream,
     get_checksum_in_raw_file,
+    get_partial_checksum,
+    hash_file_sha256,
+    verify_flac_md5,
+    ChecksumType,
 )
+from .metadata.checksum.engine import ChecksumEngine, FFMPEG_CHECKSUM_TYPE_BY_EXT
+from .metadata.checksum.payload import get_payload_fingerprint, PAYLOAD_EXTS
 from .metadata.extra import (
     create_empty_extra_metadata,
     check_valid_extra_metadata
 )
+from .instrument import StageTimer, SlowestFiles, DIRECTORY_EXT, activate, stage
+from .progress import ProgressTracker, print_progress
+from .walker import walk_directory, IgnoreRules
 
 # https://docs.microsoft.com/en-us/windows/win32/fileio/naming-a-file?redirectedfrom=MSDN#file_and_directory_names
 # having these characters in the filename is very bad for SMB network sharing and archiving.
@@ -34,10 +58,22 @@ class ScanType(Enum):
     EXTRA_METADATA = auto()
 
 
+class ExtractStatus(Enum):
+    DONE = auto()
+    # the file is recognized, but there is nothing to record for this task.
+    SKIPPED = auto()
+    # the file is not a supported audio file.
+    EXTRA_FILE = auto()
+    # extraction raised, and the row is its error record. only with `on_error='collect'`.
+    FAILED = auto()
+
+
 class WarningType(Enum):
     # file name is not in NFKD form.
     # not necessarily bad.
     NON_NFKD_NAME = auto()
+    # the decoded audio of a FLAC file does not match the MD5 in its STREAMINFO.
+    FLAC_MD5_MISMATCH = auto()
 
 
 class SanityCheckWarning:
@@ -69,32 +105,580 @@ def valid_smb_name(name):
     return True
 
 
-def fetch_cached_path_and_stat(result_cache, full_path):
+def is_valid_dirpath(dirpath, valid_dirpaths):
+    """check all components of `dirpath`, reusing the results memoized in `valid_dirpaths`,
+    so that each directory name is only checked once during a walk."""
+    ret = valid_dirpaths.get(dirpath, None)
+    if ret is None:
+        parent, name = path.split(dirpath)
+        ret = valid_name(name) and (parent == dirpath or is_valid_dirpath(parent, valid_dirpaths))
+        valid_dirpaths[dirpath] = ret
+    return ret
+
+
+def exception_chain(e):
+    """`e` and its causes, outermost first, each as a dict of `type` and `message`.
+
+    besides `__cause__` and `__context__`, an exception passed as the last argument
+    (as in `raise ValueError(message, e)`) is taken as the cause.
+    """
+    ret = []
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        args_cause = e.args[-1] if len(e.args) > 0 and isinstance(e.args[-1], BaseException) else None
+        ret.append(
+            {
+                'type': type(e).__qualname__ if type(e).__module__ == 'builtins' else (
+                    f'{type(e).__module__}.{type(e).__qualname__}'
+                ),
+                'message': str(e) if args_cause is None else ' '.join(str(x) for x in e.args[:-1]),
+            }
+        )
+        if e.__cause__ is not None:
+            e = e.__cause__
+        elif e.__context__ is not None and not e.__suppress_context__:
+            e = e.__context__
+        else:
+            e = args_cause
+    return ret
+
+
+def error_record(full_path, stage, e, seconds):
+    """a JSON serializable record of `e`, raised at `stage` of processing `full_path`, for `on_error='collect'`."""
+    return {
+        'path': full_path,
+        'stage': stage,
+        'exception': exception_chain(e),
+        'traceback': ''.join(traceback.format_exception(type(e), e, e.__traceback__)),
+        'seconds': seconds,
+    }
+
+
+def timed(timer, stage_name, ext):
+    # `timer.stage`, or nothing if `timer` is None.
+    if timer is None:
+        return nullcontext({'bytes': 0})
+    return timer.stage(stage_name, ext)
+
+
+def fetch_cached_row(result_cache, full_path):
     if result_cache is None:
         return
 
-    data = result_cache.get(full_path, None)
+    return result_cache.get(full_path, None)
+
+
+def fetch_cached_path_and_stat(result_cache, full_path):
+    data = fetch_cached_row(result_cache, full_path)
     if data is None:
         return
 
     return data['path_and_stat']
 
 
+def build_identity_index(result_cache):
+    """index cached rows by file identity, so that moved or renamed files can be recognized.
+
+    :return: a dict with two lookups to the cached path,
+        'inode': (dev, ino, size, mtime) -> path, and
+        'partial_sha256': (size, mtime, partial sha256) -> path, for rows having a partial checksum.
+    """
+    by_inode = dict()
+    by_partial_sha256 = dict()
+    if hasattr(result_cache, 'iter_identities'):
+        # avoid decoding every row of a lazily loaded cache.
+        identities = result_cache.iter_identities()
+    else:
+        identities = (
+            (path_this, data['path_and_stat'], data.get('file_id', None)) for path_this, data in result_cache.items()
+        )
+    for path_this, p_and_stat, file_id in identities:
+        if file_id is None:
+            # from older versions.
+            continue
+        by_inode[file_id['dev'], file_id['ino'], p_and_stat['size'], p_and_stat['mtime']] = path_this
+        if 'partial_sha256' in file_id:
+            by_partial_sha256[p_and_stat['size'], p_and_stat['mtime'], file_id['partial_sha256']] = path_this
+    return {
+        'inode': by_inode,
+        'partial_sha256': by_partial_sha256,
+    }
+
+
+def find_moved_file(identity_index, p_and_stat, file_id):
+    path_prev = identity_index['inode'].get(
+        (file_id['dev'], file_id['ino'], p_and_stat['size'], p_and_stat['mtime']), None
+    )
+    if path_prev is None and 'partial_sha256' in file_id:
+        path_prev = identity_index['partial_sha256'].get(
+            (p_and_stat['size'], p_and_stat['mtime'], file_id['partial_sha256']), None
+        )
+    return path_prev
+
+
+class ParsedFile:
+    """objects parsed from one file, shared by all the tasks extracting it.
+
+    each object is only parsed when first needed.
+    """
+
+    def __init__(
+            self, full_path, *, native_sacd_toc=False, sacd_xml_text=None, bounded_tag_reads=False,
+            defer_cover_art=False,
+    ):
+        self.full_path = full_path
+        self.native_sacd_toc = native_sacd_toc
+        self.bounded_tag_reads = bounded_tag_reads
+        # leave the picture out of the parsed tags, only locating it.
+        self.defer_cover_art = defer_cover_art
+        # bytes read by `load_tags_bounded`.
+        self.tag_bytes_read = 0
+        # where the picture left out is in the file, once the tags are parsed. None if there is none.
+        self.cover = None
+        self._flac_obj = None
+        self._mp4_obj = None
+        self._dsf_obj = None
+        # from a `SacdXmlCache`.
+        self._sacd_xml = None if sacd_xml_text is None else sacd_xml_from_text(sacd_xml_text)
+        # whether `sacd_xml` was fetched from the file, rather than given.
+        self.sacd_xml_fetched = False
+
+    def _load_tags(self, mutagen_class):
+        with stage('tags') as stage_record:
+            if not self.bounded_tag_reads and not self.defer_cover_art:
+                return mutagen_class(self.full_path)
+            obj, bytes_read, _, self.cover = load_tags_bounded(self.full_path, skip_cover=self.defer_cover_art)
+            self.tag_bytes_read += bytes_read
+            stage_record['bytes'] = bytes_read
+            return obj
+
+    @property
+    def flac_obj(self):
+        if self._flac_obj is None:
+            self._flac_obj = self._load_tags(FLAC)
+        return self._flac_obj
+
+    @property
+    def mp4_obj(self):
+        if self._mp4_obj is None:
+            self._mp4_obj = self._load_tags(MP4)
+        return self._mp4_obj
+
+    @property
+    def dsf_obj(self):
+        if self._dsf_obj is None:
+            self._dsf_obj = self._load_tags(DSF)
+        return self._dsf_obj
+
+    @property
+    def sacd_xml(self):
+        if self._sacd_xml is None:
+            self._sacd_xml = fetch_sacd_xml(self.full_path, native=self.native_sacd_toc)
+            self.sacd_xml_fetched = True
+        return self._sacd_xml
+
+
+def extract_one_task(
+        parsed: ParsedFile, task: ScanType, *, aux_output_dir=None, overwrite_result_dict=None,
+        update_multi_value_fields=False, native_dsf_checksum=False, dsf_trim_padding=True, verify_flac=False,
+):
+    """extract the output of one file for one task.
+
+    :return: a tuple of (ExtractStatus, row); row is None unless the status is DONE.
+    """
+    full_path = parsed.full_path
+    ext_this = path.splitext(full_path)[1]
+    if task == ScanType.CORE_METADATA:
+        # the tags are parsed first, to know where a deferred picture is.
+        if ext_this == '.m4a':
+            # the file may be saved then, which needs a real `MP4` object.
+            mp4_obj = None if update_multi_value_fields else parsed.mp4_obj
+            row_this = get_meta_data_alac(
+                full_path, aux_output_dir, update_multi_value_fields=update_multi_value_fields,
+                mp4_obj=mp4_obj, cover=None if mp4_obj is None else parsed.cover,
+            )
+        elif ext_this == '.flac':
+            flac_obj = parsed.flac_obj
+            row_this = get_meta_data_flac(
+                full_path, aux_output_dir, flac_obj=flac_obj, cover=parsed.cover
+            )
+        elif ext_this == '.dsf':
+            dsf_obj = parsed.dsf_obj
+            row_this = get_meta_data_dsf(full_path, aux_output_dir, dsf_obj=dsf_obj, cover=parsed.cover)
+        elif ext_this == '.iso':
+            row_this = get_meta_data_sacd_iso(
+                # sacd iso cannot embed image.
+                full_path, overwrite_result_dict, xml_obj=parsed.sacd_xml
+            )
+        else:
+            return ExtractStatus.EXTRA_FILE, None
+    elif task == ScanType.CHECKSUM:
+        if ext_this in {'.m4a'}:
+            row_this = get_checksum_in_24bit(full_path)
+        elif ext_this in {'.flac'}:
+            # no need to cover it as long as the signature is valid.
+            assert parsed.flac_obj.info.md5_signature > 0
+            if not verify_flac:
+                return ExtractStatus.SKIPPED, None
+            # unless we want to make sure the stream still matches its signature.
+            row_this = verify_flac_md5(
+                full_path,
+                bits_per_sample=parsed.flac_obj.info.bits_per_sample,
+                md5_signature=parsed.flac_obj.info.md5_signature,
+            )
+        elif ext_this in {'.dsf'}:
+            row_this = get_checksum_in_raw_stream(
+                full_path, native=native_dsf_checksum, trim_padding=dsf_trim_padding
+            )
+        elif ext_this in {'.iso'}:
+            row_this = get_checksum_in_raw_file(full_path)
+        else:
+            return ExtractStatus.EXTRA_FILE, None
+    elif task == ScanType.EXTRA_METADATA:
+        if ext_this == '.m4a':
+            row_this = overwrite_result_dict[full_path]
+        elif ext_this == '.dsf':
+            # just create empty rating.
+            row_this = create_empty_extra_metadata()
+        elif ext_this == '.iso':
+            # check how many tracks are there, and then create a list
+            row_this = [
+                create_empty_extra_metadata()
+            ] * get_total_tracks(full_path, xml_obj=parsed.sacd_xml)
+        else:
+            return ExtractStatus.EXTRA_FILE, None
+    else:
+        raise NotImplementedError
+
+    return ExtractStatus.DONE, row_this
+
+
+def extract_one_file(
+        *, full_path, tasks, update_multi_value_fields=False, native_dsf_checksum=False, dsf_trim_padding=True,
+        verify_flac=False, native_sacd_toc=False, sacd_xml_text=None, export_sacd_xml=False, defer_cover_art=False,
+        bounded_tag_reads=False, collect_errors=False, stage_timing=False,
+):
+    """extract the output of one file for several tasks, parsing the file only once.
+
+    this is a top-level function so that it can be sent to worker processes.
+
+    :param tasks: a dict mapping each `ScanType` to its keyword arguments of `extract_one_task`,
+        i.e., `aux_output_dir` and `overwrite_result_dict`.
+    :param sacd_xml_text: the cached SACD XML of this file, if any.
+    :param export_sacd_xml: return the SACD XML, if fetched from the file, for caching.
+    :param collect_errors: return (ExtractStatus.FAILED, error record) for a task that raises,
+        and go on with the other tasks.
+    :param stage_timing: time the stages of the extraction with a `StageTimer`.
+        each task is a stage named after it, excluding the stages inside it (tags, ffmpeg, cover art, etc.).
+    :return: a dict mapping each `ScanType` to its (ExtractStatus, row),
+        the text of the fetched SACD XML (None unless `export_sacd_xml`),
+        and the `totals` of the `StageTimer` (None unless `stage_timing`).
+    """
+    ext_this = path.splitext(full_path)[1]
+    timer = StageTimer() if stage_timing else None
+    parsed = ParsedFile(
+        full_path, native_sacd_toc=native_sacd_toc, sacd_xml_text=sacd_xml_text, bounded_tag_reads=bounded_tag_reads,
+        defer_cover_art=defer_cover_art,
+    )
+    results = dict()
+    with activate(timer, ext_this) if timer is not None else nullcontext():
+        for task, kwargs in tasks.items():
+            t_start = perf_counter()
+            try:
+                with timed(timer, task.name.lower(), ext_this):
+                    results[task] = extract_one_task(
+                        parsed, task, update_multi_value_fields=update_multi_value_fields,
+                        native_dsf_checksum=native_dsf_checksum, dsf_trim_padding=dsf_trim_padding,
+                        verify_flac=verify_flac, **kwargs
+                    )
+            except Exception as e:
+                if not collect_errors:
+                    raise
+                results[task] = ExtractStatus.FAILED, error_record(full_path, 'extract', e, perf_counter() - t_start)
+    stage_totals = None if timer is None else timer.totals
+    if export_sacd_xml and parsed.sacd_xml_fetched:
+        return results, sacd_xml_to_text(parsed.sacd_xml), stage_totals
+    return results, None, stage_totals
+
+
+class _TaskScan:
+    """options and results of one task in `scan_one_directory_multi`."""
+
+    def __init__(
+            self, task: ScanType, *, aux_output_dir=None, result_cache=None, overwrite_result_dict=None,
+            dir_manifest_cache=None, row_sink=None, skip_paths=None, detect_moves=False, on_error='raise',
+    ):
+        self.task = task
+        self.on_error = on_error
+        self.aux_output_dir = aux_output_dir
+        self.result_cache = result_cache
+        self.overwrite_result_dict = overwrite_result_dict
+        self.dir_manifest_cache = dir_manifest_cache
+        self.row_sink = row_sink
+        self.skip_paths = skip_paths
+
+        self.check_valid_result = {
+            ScanType.CORE_METADATA: check_valid_metadata,
+            ScanType.CHECKSUM: check_valid_checksum_output,
+            ScanType.EXTRA_METADATA: check_valid_extra_metadata,
+        }[task]
+
+        # outputs depending on anything other than the file content cannot follow a moved file.
+        if detect_moves and result_cache is not None and task in {ScanType.CORE_METADATA, ScanType.CHECKSUM}:
+            self.identity_index = build_identity_index(result_cache)
+        else:
+            self.identity_index = None
+
+        self.row_all = []
+        self.path_and_stat_all = []
+        self.file_id_all = []
+        self.extra_files_all = []
+        self.moved_all = []
+        self.payload_reused_all = []
+        # error records of files not committed, with `on_error='collect'`.
+        self.errors_all = []
+        # cover art referenced by the committed rows, for reporting deduplication.
+        self.cover_references = 0
+        self.covers = set()
+
+    def extract_kwargs(self, full_path, *, for_worker=False):
+        overwrite_result_dict = self.overwrite_result_dict
+        if for_worker and overwrite_result_dict is not None:
+            # only send the part relevant to this file to the worker.
+            overwrite_result_dict = {
+                k: overwrite_result_dict[k] for k in [full_path] if k in overwrite_result_dict
+            }
+        return {
+            'aux_output_dir': self.aux_output_dir,
+            'overwrite_result_dict': overwrite_result_dict,
+        }
+
+    def find_cached_result(self, full_path, cached_row, p_and_stat, file_id):
+        if cached_row is not None and cached_row['path_and_stat'] == p_and_stat:
+            return ExtractStatus.DONE, cached_row['output']
+
+        if self.task == ScanType.CHECKSUM and cached_row is not None and 'payload_sha256' in file_id and (
+                cached_row.get('file_id', {}).get('payload_sha256', None) == file_id['payload_sha256']
+        ):
+            # only the tags changed.
+            self.payload_reused_all.append(full_path)
+            return ExtractStatus.DONE, cached_row['output']
+
+        if self.identity_index is None or (
+                self.overwrite_result_dict is not None and full_path in self.overwrite_result_dict
+        ):
+            return
+
+        moved_from = find_moved_file(self.identity_index, p_and_stat, file_id)
+        if moved_from is not None:
+            self.moved_all.append(
+                {
+                    'from': moved_from,
+                    'to': full_path,
+                }
+            )
+            return ExtractStatus.DONE, self.result_cache[moved_from]['output']
+
+    def commit(self, full_path, ext_this, p_and_stat, file_id, result, *, timer=None):
+        status, row_this = result
+
+        if status is ExtractStatus.EXTRA_FILE:
+            self.extra_files_all.append(
+                full_path
+            )
+            return
+        if status is ExtractStatus.SKIPPED:
+            return
+        if status is ExtractStatus.FAILED:
+            self.errors_all.append(row_this)
+            return
+
+        t_start = perf_counter()
+        try:
+            with timed(timer, 'validate', ext_this):
+                self.check_valid_result(
+                    row_this, ext_this
+                )
+        except Exception as e:
+            error = ValueError(
+                f"invalid output from {repr(full_path)}",
+                e
+            )
+            if self.on_error != 'collect':
+                raise error
+            self.errors_all.append(error_record(full_path, 'validate', error, perf_counter() - t_start))
+            return
+
+        if self.task == ScanType.CORE_METADATA:
+            for track_this in (row_this if type(row_this) is list else [row_this]):
+                if track_this[Tag.COVER_ART] is not None:
+                    self.cover_references += 1
+                    self.covers.add(track_this[Tag.COVER_ART])
+
+        if self.row_sink is not None:
+            self.row_sink(row_this, p_and_stat, file_id)
+        else:
+            self.row_all.append(row_this)
+            self.path_and_stat_all.append(p_and_stat)
+            self.file_id_all.append(file_id)
+
+
 def scan_one_directory(
         *, input_dir, aux_output_dir=None, result_cache=None,
         task: ScanType, ignore_dirs=None, ignore_dirs_fn=None, overwrite_result_dict=None,
-        update_multi_value_fields = False,
+        update_multi_value_fields = False, workers=None, dir_manifest_cache=None,
+        detect_moves=False, partial_hash_moves=False, row_sink=None, skip_paths=None,
+        checksum_concurrency=None, checksum_timeout=None, iso_hash_threads=None,
+        native_dsf_checksum=False, dsf_trim_padding=True, payload_fingerprints=False, verify_flac=False,
+        native_sacd_toc=False, sacd_cache=None, defer_cover_art=False, bounded_tag_reads=False, on_error='raise',
+        stage_timing=False, slowest_files=None, progress=print_progress, progress_interval=10.0, precount=False,
+        record_dir_manifest=False,
 ):
     """
     :param input_dir: directory path.
+    :param ignore_dirs: an `IgnoreRules`, or a collection of directory paths.
+        ignored directories are pruned from the walk, together with everything below them.
+    :param ignore_dirs_fn: a function taking a directory path; the directory is pruned if it returns True.
+    :param dir_manifest_cache: the `dir_manifest` of a previous scan, if it can be trusted.
+        in a directory whose mtime and entry count are unchanged, files with a cached row
+        reuse it without being stat'ed. this misses files modified in place, which do not touch
+        the directory's mtime, so only use it for archives that are not edited in place.
+    :param record_dir_manifest: record the mtime and entry count of each directory into `dir_manifest`,
+        for the `dir_manifest_cache` of a later scan. this stats every directory, so it is only done
+        when asked for, or when `dir_manifest_cache` is given; otherwise `dir_manifest` is None.
+    :param detect_moves: reuse the cached output of a file whose path changed,
+        but whose (device, inode, size, mtime) matches a cached file.
+        moved files are reported in `moved`.
+    :param partial_hash_moves: also record a partial checksum of each file, and use
+        (size, mtime, partial checksum) to recognize moved files whose inode changed,
+        such as files copied to another volume with their mtime preserved.
+    :param row_sink: if not None, a function taking (row, path_and_stat, file_id),
+        called for each committed row in order, instead of collecting them into `output`, `path_and_stat`
+        and `file_id`.
+    :param skip_paths: files already committed earlier (e.g., by an interrupted run); they are not processed again.
+    :param workers: if not None, extract files in a pool of this many processes.
+        the output is committed in the same order as a serial run.
+    :param checksum_concurrency: if not None, compute the ffmpeg checksums of `ScanType.CHECKSUM`
+        with a `ChecksumEngine` running this many ffmpeg processes at once.
+    :param checksum_timeout: seconds allowed for each ffmpeg checksum run by the `ChecksumEngine`.
+    :param iso_hash_threads: if not None, hash SACD ISOs for `ScanType.CHECKSUM` in this many threads,
+        and report the hashing throughput.
+    :param native_dsf_checksum: compute the checksums of DSF files for `ScanType.CHECKSUM` by hashing
+        their `data` chunk directly, instead of running ffmpeg. files with an unusual layout still go to ffmpeg.
+    :param dsf_trim_padding: whether the native DSF checksum leaves out the padding of the last block,
+        as newer ffmpeg versions do. use `check_native_raw_stream_checksum` on a few files
+        to find the value consistent with previous results.
+    :param payload_fingerprints: for `ScanType.CHECKSUM`, also record a partial checksum of the audio payload
+        (the `mdat` box of MP4, the `data` chunk of DSF, the frames of FLAC) of each file checksummed;
+        for FLAC, only with `verify_flac`, as FLAC files are otherwise skipped.
+        when a file changed but its payload fingerprint did not, i.e., only its tags were edited,
+        the cached checksum is reused instead of decoding the file again. such files are reported in `payload_reused`.
+    :param verify_flac: for `ScanType.CHECKSUM`, decode each FLAC file and compare it against the MD5 in its STREAMINFO,
+        recording the result and the time taken as `ChecksumType.FLAC_MD5`, instead of skipping FLAC files.
+        files not matching it are also reported in `warnings`, as `WarningType.FLAC_MD5_MISMATCH`.
+        decoding is done in the worker processes when `workers` is set.
+    :param native_sacd_toc: read the metadata and track count of SACD ISOs from their TOC sectors directly,
+        instead of running sacd_extract. ISOs whose TOC cannot be read this way still go to sacd_extract.
+    :param sacd_cache: a `SacdXmlCache`. SACD ISOs found in it (by path, size and mtime) are not parsed again,
+        and newly parsed ones are added to it.
+    :param defer_cover_art: for `ScanType.CORE_METADATA`, do not write new cover art into `aux_output_dir`;
+        only record where each image is in its audio file, in `aux_output_dir/.deferred`.
+        `artwork.extract_deferred_images` extracts them later, and `artwork.open_image` reads them either way.
+        tags are then parsed as with `bounded_tag_reads`, leaving the image out, so it is neither read into memory
+        nor decoded. an image that cannot be left out that way (e.g., behind ID3 unsynchronisation)
+        is extracted right away.
+    :param bounded_tag_reads: parse tags of FLAC, MP4 and DSF files from only the regions holding them,
+        instead of letting mutagen read the whole file structure. see `bounded.load_tags_bounded`.
+    :param on_error: 'raise' to abort the scan on the first problem, or 'collect' to quarantine
+        the file (or directory) with the problem and go on. for each quarantined one, `errors` has
+        an error record, with the stage it failed at, its exception chain and traceback, and the seconds spent on
+        the failing step. a file failing only some of the tasks is still committed for the others.
+        quarantined files are not in the output, so they are retried in the next scan reusing it.
+    :param stage_timing: accumulate the wall time, call count and bytes of each stage of the scan
+        (listing, stat, fingerprints, tag parsing, each task's extraction, cover art, ffmpeg, sacd_extract,
+        validation, etc.) per file extension, into `timing`. stages inside others are not counted twice.
+        work in worker processes and in the ffmpeg and ISO hashing queues is timed where it runs.
+    :param slowest_files: if not None, also report the time of each stage for this many slowest files,
+        in `timing`. implies `stage_timing`.
+    :param progress: a function taking progress events (see `progress.ProgressTracker` for their content),
+        called at most once every `progress_interval` seconds, and whenever the stage of the scan changes.
+        the default prints them. None for no progress report.
+    :param precount: before scanning, walk `input_dir` once to count the files and their sizes,
+        so that progress events have totals and an ETA. cheap compared to a checksum run, but it stats every file.
     :return:
     """
+    return scan_one_directory_multi(
+        input_dir=input_dir,
+        tasks={
+            task: {
+                'aux_output_dir': aux_output_dir,
+                'result_cache': result_cache,
+                'overwrite_result_dict': overwrite_result_dict,
+                'dir_manifest_cache': dir_manifest_cache,
+                'row_sink': row_sink,
+                'skip_paths': skip_paths,
+            }
+        },
+        ignore_dirs=ignore_dirs,
+        ignore_dirs_fn=ignore_dirs_fn,
+        update_multi_value_fields=update_multi_value_fields,
+        workers=workers,
+        detect_moves=detect_moves,
+        partial_hash_moves=partial_hash_moves,
+        checksum_concurrency=checksum_concurrency,
+        checksum_timeout=checksum_timeout,
+        iso_hash_threads=iso_hash_threads,
+        native_dsf_checksum=native_dsf_checksum,
+        dsf_trim_padding=dsf_trim_padding,
+        payload_fingerprints=payload_fingerprints,
+        verify_flac=verify_flac,
+        native_sacd_toc=native_sacd_toc,
+        sacd_cache=sacd_cache,
+        defer_cover_art=defer_cover_art,
+        bounded_tag_reads=bounded_tag_reads,
+        on_error=on_error,
+        stage_timing=stage_timing,
+        slowest_files=slowest_files,
+        progress=progress,
+        progress_interval=progress_interval,
+        precount=precount,
+        record_dir_manifest=record_dir_manifest,
+    )[task]
 
-    check_valid_result = {
-        ScanType.CORE_METADATA: check_valid_metadata,
-        ScanType.CHECKSUM: check_valid_checksum_output,
-        ScanType.EXTRA_METADATA: check_valid_extra_metadata,
-    }[task]
+
+def scan_one_directory_multi(
+        *, input_dir, tasks, ignore_dirs=None, ignore_dirs_fn=None,
+        update_multi_value_fields=False, workers=None, detect_moves=False, partial_hash_moves=False,
+        checksum_concurrency=None, checksum_timeout=None, iso_hash_threads=None,
+        native_dsf_checksum=False, dsf_trim_padding=True, payload_fingerprints=False, verify_flac=False,
+        native_sacd_toc=False, sacd_cache=None, defer_cover_art=False, bounded_tag_reads=False, on_error='raise',
+        stage_timing=False, slowest_files=None, progress=print_progress, progress_interval=10.0, precount=False,
+        record_dir_manifest=False,
+):
+    """scan `input_dir` for several tasks at once, sharing one walk, one stat and one parsed file
+    (e.g., one sacd_extract run for a SACD ISO) per file across them.
+
+    :param tasks: a dict mapping each `ScanType` to a dict of its own options, all optional:
+        `aux_output_dir`, `result_cache`, `overwrite_result_dict`, `dir_manifest_cache`, `row_sink`
+        and `skip_paths`. see `scan_one_directory` for them and for the other parameters.
+        a directory is only considered unchanged if the `dir_manifest_cache` of every task says so.
+    :return: a dict mapping each `ScanType` to its result, as returned by `scan_one_directory`.
+    """
+    assert on_error in {'raise', 'collect'}
+    task_scans = [
+        _TaskScan(task, detect_moves=detect_moves, on_error=on_error, **options) for task, options in tasks.items()
+    ]
+
+    if ignore_dirs is not None and not isinstance(ignore_dirs, IgnoreRules):
+        ignore_dirs = IgnoreRules(paths=ignore_dirs)
+
+    def is_ignored(dirpath):
+        if (ignore_dirs is not None) and ignore_dirs.matches(dirpath):
+            return True
+        if (ignore_dirs_fn is not None) and ignore_dirs_fn(dirpath):
+            return True
+        return False
 
     # our root dir should be properly named.
     assert is_normalized('NFD', input_dir)
@@ -103,154 +687,437 @@ def scan_one_directory(
     file_ct = 0
     folder_ct = 0
     warnings_all = []
-    row_all = []
-    path_and_stat_all = []
-    extra_files_all = []
-
-    for dirpath, dirnames, filenames in os.walk(input_dir):
-        # check there is no invalid character
-        for dir_component in dirpath.split(path.sep):
-            assert valid_name(dir_component)
-
-        assert is_normalized('NFD', dirpath)
-
-        if not is_normalized('NFKD', dirpath):
-            warnings_all.append(
-                SanityCheckWarning(
-                    WarningType.NON_NFKD_NAME,
-                    dirpath
+    # directories are only stat'ed for the manifest if it is either kept or compared against.
+    if record_dir_manifest or any(task_scan.dir_manifest_cache is not None for task_scan in task_scans):
+        dir_manifest = dict()
+    else:
+        dir_manifest = None
+
+    if slowest_files is not None:
+        stage_timing = True
+    stage_timer = StageTimer() if stage_timing else None
+    slowest = SlowestFiles(slowest_files) if slowest_files is not None else None
+    # seconds of each ffmpeg run by `checksum_engine`, until its file is committed.
+    engine_seconds = dict()
+
+    tracker = ProgressTracker(progress, interval=progress_interval)
+    if precount:
+        with timed(stage_timer, 'precount', DIRECTORY_EXT):
+            tracker.precount(input_dir, is_ignored=is_ignored)
+
+    # files waiting to be committed, in walk order.
+    # for each file, results from the cache are ready, and the rest are
+    # either a dict of (ExtractStatus, row) tuples or a Future of it.
+    pending = deque()
+    # keep memory bounded, while giving the pool (and the ffmpeg processes) enough work to stay busy.
+    max_pending = 0
+    if workers is not None:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # with the fork start method, this starts all the workers now, before `checksum_engine` spawns any ffmpeg.
+        # a worker forked while ffmpeg is being spawned inherits the pipe the spawn waits on, which then never returns.
+        executor.submit(int).result()
+        max_pending = max(max_pending, workers * 8)
+    else:
+        executor = None
+    if checksum_concurrency is not None and ScanType.CHECKSUM in tasks:
+        checksum_engine = ChecksumEngine(
+            checksum_concurrency, timeout=checksum_timeout,
+            on_done=engine_seconds.__setitem__ if stage_timing else None,
+        )
+        max_pending = max(max_pending, checksum_concurrency * 4)
+    else:
+        checksum_engine = None
+    if iso_hash_threads is not None and ScanType.CHECKSUM in tasks:
+        iso_hash_executor = ThreadPoolExecutor(max_workers=iso_hash_threads)
+        max_pending = max(max_pending, iso_hash_threads * 4)
+    else:
+        iso_hash_executor = None
+    # path -> (bytes, seconds) of each ISO hashed by `iso_hash_executor`.
+    iso_hash_stats = dict()
+
+    def hash_iso_file(full_path):
+        hash_result = hash_file_sha256(full_path)
+        iso_hash_stats[full_path] = (hash_result['bytes'], hash_result['seconds'])
+        return {
+            ChecksumType.RAW_FILE: hash_result['sha256'],
+        }
+
+    def task_scans_for(full_path):
+        return [
+            task_scan for task_scan in task_scans
+            if task_scan.skip_paths is None or full_path not in task_scan.skip_paths
+        ]
+
+    def quarantine(task_scans_failed, full_path, stage_name, e, seconds):
+        record = error_record(full_path, stage_name, e, seconds)
+        for task_scan in task_scans_failed:
+            task_scan.errors_all.append(record)
+
+    def commit(full_path, ext_this, p_and_stat, file_id, results, extracted, t_start, file_timer):
+        if isinstance(extracted, Future):
+            try:
+                extracted = extracted.result()
+            except Exception as e:
+                # the worker itself failed; errors in extraction are already in its results.
+                if on_error != 'collect':
+                    raise
+                quarantine(
+                    [task_scan for task_scan in task_scans_for(full_path) if task_scan.task not in results],
+                    full_path, 'extract', e, perf_counter() - t_start,
                 )
-            )
+                extracted = None
+        if extracted is not None:
+            extracted, sacd_xml_text, stage_totals = extracted
+            results.update(extracted)
+            if sacd_xml_text is not None:
+                sacd_cache.put(full_path, p_and_stat['size'], p_and_stat['mtime'], sacd_xml_text)
+            if stage_totals is not None:
+                file_timer.merge(stage_totals)
+        for task, result in results.items():
+            # from the checksum engine, or the ISO hashing threads.
+            if isinstance(result, Future):
+                try:
+                    results[task] = (ExtractStatus.DONE, result.result())
+                except Exception as e:
+                    if on_error != 'collect':
+                        raise
+                    # including the time waiting to be run.
+                    results[task] = (
+                        ExtractStatus.FAILED, error_record(full_path, 'checksum', e, perf_counter() - t_start)
+                    )
+                if file_timer is not None and full_path in engine_seconds:
+                    file_timer.add('ffmpeg', ext_this, engine_seconds.pop(full_path))
+                if file_timer is not None and full_path in iso_hash_stats:
+                    bytes_hashed, seconds = iso_hash_stats[full_path]
+                    file_timer.add('iso_hash', ext_this, seconds, bytes_hashed)
 
-        # ignore this path if needed
-        if (ignore_dirs is not None) and (dirpath in ignore_dirs):
-            continue
+        status, row_this = results.get(ScanType.CHECKSUM, (None, None))
+        if status is ExtractStatus.DONE and not row_this.get(ChecksumType.FLAC_MD5, {'ok': True})['ok']:
+            warnings_all.append(SanityCheckWarning(WarningType.FLAC_MD5_MISMATCH, full_path))
 
-        if (ignore_dirs_fn is not None) and ignore_dirs_fn(dirpath):
-            continue
+        for task_scan in task_scans:
+            if task_scan.task in results:
+                task_scan.commit(full_path, ext_this, p_and_stat, file_id, results[task_scan.task], timer=file_timer)
 
-        for dirname in dirnames:
-            assert valid_name(dirname)
+        if file_timer is not None:
+            stage_timer.merge(file_timer.totals)
+            if slowest is not None:
+                slowest.add(full_path, file_timer)
 
-        for filename in filenames:
-            assert valid_name(filename)
+        tracker.done(full_path, p_and_stat['size'])
 
-        folder_ct += 1
+    def flush(max_left):
+        while len(pending) > max_left:
+            commit(*pending.popleft())
 
-        for filename in filenames:
-            assert valid_name(filename)
-            # ignore files starting with '.'
-            if filename.startswith('.'):
-                continue
+    try:
+        # dirpath -> whether all its components are valid names.
+        valid_dirpaths = dict()
+
+        if is_ignored(input_dir):
+            walk_iter = iter(())
+        else:
+            walk_iter = walk_directory(input_dir)
+        if stage_timer is not None:
+            walk_iter = stage_timer.iter(walk_iter, 'list', DIRECTORY_EXT)
+
+        for dirpath, dirnames, file_entries in walk_iter:
+            if dir_manifest is not None:
+                # record what the directory looks like before pruning anything.
+                with timed(stage_timer, 'stat', DIRECTORY_EXT):
+                    dir_mtime_ns = os.stat(dirpath).st_mtime_ns
+                dir_manifest_this = {
+                    'mtime_ns': dir_mtime_ns,
+                    'entry_count': len(dirnames) + len(file_entries),
+                }
+                dir_manifest[dirpath] = dir_manifest_this
+                # a directory whose entries have not been added, removed or renamed
+                # can reuse cached rows without stat'ing its files.
+                dir_unchanged = all(
+                    task_scan.dir_manifest_cache is not None and
+                    task_scan.dir_manifest_cache.get(dirpath, None) == dir_manifest_this
+                    for task_scan in task_scans
+                )
+            else:
+                dir_unchanged = False
 
-            file_ct += 1
+            try:
+                # check there is no invalid character
+                assert is_valid_dirpath(dirpath, valid_dirpaths), f'invalid directory name in {repr(dirpath)}'
 
-            # check that it's properly NFD
-            # this is probably guaranteed by Samba or Finder.
-            assert is_normalized('NFD', filename)
+                assert is_normalized('NFD', dirpath), f'directory name not in NFD: {repr(dirpath)}'
+            except AssertionError as e:
+                if on_error != 'collect':
+                    raise
+                # skip the directory, together with everything below it.
+                quarantine(task_scans, dirpath, 'directory', e, 0.0)
+                dirnames[:] = []
+                continue
 
-            # check more that there is not compatibility stuffs mixed in
-            full_path = join(dirpath, filename)
-            if not is_normalized('NFKD', filename):
+            if not is_normalized('NFKD', dirpath):
                 warnings_all.append(
                     SanityCheckWarning(
                         WarningType.NON_NFKD_NAME,
-                        full_path
+                        dirpath
                     )
                 )
 
-            p_and_stat = {
-                'path': full_path,
-                # this is guaranteed to be an integer.
-                'mtime': os.stat(full_path)[stat.ST_MTIME],
-                # this is guaranteed to be an integer.
-                'size': os.stat(full_path)[stat.ST_SIZE]
-            }
+            # prune ignored subdirectories, so that they are never listed or stat'ed.
+            dirnames[:] = [
+                dirname for dirname in dirnames if not is_ignored(join(dirpath, dirname))
+            ]
 
-            ext_this = path.splitext(filename)[1]
-            if fetch_cached_path_and_stat(result_cache, full_path) == p_and_stat:
-                row_this = result_cache[full_path]['output']
-            else:
-                if task == ScanType.CORE_METADATA:
-                    if ext_this == '.m4a':
-                        row_this = get_meta_data_alac(
-                            full_path, aux_output_dir, update_multi_value_fields=update_multi_value_fields
-                        )
-                    elif ext_this == '.flac':
-                        row_this = get_meta_data_flac(
-                            full_path, aux_output_dir
-                        )
-                    elif ext_this == '.dsf':
-                        row_this = get_meta_data_dsf(full_path, aux_output_dir)
-                    elif ext_this == '.iso':
-                        row_this = get_meta_data_sacd_iso(
-                            # sacd iso cannot embed image.
-                            full_path, overwrite_result_dict
-                        )
-                    else:
-                        extra_files_all.append(
-                            full_path
-                        )
+            if on_error != 'collect':
+                for dirname in dirnames:
+                    # this also memoizes the result for when the walk enters the subdirectory.
+                    assert is_valid_dirpath(join(dirpath, dirname), valid_dirpaths)
+
+                for file_entry in file_entries:
+                    assert valid_name(file_entry.name)
+
+            folder_ct += 1
+            tracker.walked(folders=1)
+
+            for file_entry in file_entries:
+                filename = file_entry.name
+                full_path = join(dirpath, filename)
+                t_start = perf_counter()
+                file_timer = StageTimer() if stage_timing else None
+                try:
+                    if on_error == 'collect':
+                        assert valid_name(filename), f'invalid file name {repr(filename)}'
+                    # ignore files starting with '.'
+                    if filename.startswith('.'):
                         continue
-                elif task == ScanType.CHECKSUM:
-                    if ext_this in {'.m4a'}:
-                        row_this = get_checksum_in_24bit(full_path)
-                    elif ext_this in {'.flac'}:
-                        # no need to cover it as long as the signature is valid.
-                        assert FLAC(full_path).info.md5_signature > 0
+
+                    file_ct += 1
+                    tracker.walked(files=1)
+
+                    # check that it's properly NFD
+                    # this is probably guaranteed by Samba or Finder.
+                    assert is_normalized('NFD', filename), f'file name not in NFD: {repr(filename)}'
+
+                    # check more that there is not compatibility stuffs mixed in
+                    if not is_normalized('NFKD', filename):
+                        warnings_all.append(
+                            SanityCheckWarning(
+                                WarningType.NON_NFKD_NAME,
+                                full_path
+                            )
+                        )
+
+                    task_scans_this = task_scans_for(full_path)
+                    if len(task_scans_this) == 0:
+                        tracker.done(full_path)
                         continue
-                    elif ext_this in {'.dsf'}:
-                        row_this = get_checksum_in_raw_stream(full_path)
-                    elif ext_this in {'.iso'}:
-                        row_this = get_checksum_in_raw_file(full_path)
+
+                    ext_this = path.splitext(filename)[1]
+                    cached_rows = [
+                        fetch_cached_row(task_scan.result_cache, full_path) for task_scan in task_scans_this
+                    ]
+                    if dir_unchanged and all(
+                            cached_row is not None and 'file_id' in cached_row and
+                            cached_row['path_and_stat'] == cached_rows[0]['path_and_stat']
+                            for cached_row in cached_rows
+                    ):
+                        p_and_stat = cached_rows[0]['path_and_stat']
+                        file_id = dict(cached_rows[0]['file_id'])
                     else:
-                        extra_files_all.append(
-                            full_path
+                        # stat only once; `DirEntry` caches it.
+                        with timed(file_timer, 'stat', ext_this):
+                            stat_this = file_entry.stat()
+                        p_and_stat = {
+                            'path': full_path,
+                            # this is guaranteed to be an integer.
+                            'mtime': stat_this[stat.ST_MTIME],
+                            # this is guaranteed to be an integer.
+                            'size': stat_this[stat.ST_SIZE]
+                        }
+                        # identity of the file, for recognizing it in later scans even if it is moved.
+                        file_id = {
+                            'dev': stat_this.st_dev,
+                            'ino': stat_this.st_ino,
+                        }
+
+                    if partial_hash_moves and 'partial_sha256' not in file_id:
+                        for cached_row in cached_rows:
+                            if cached_row is not None and cached_row['path_and_stat'] == p_and_stat and (
+                                    'partial_sha256' in cached_row.get('file_id', {})
+                            ):
+                                file_id['partial_sha256'] = cached_row['file_id']['partial_sha256']
+                                break
+                        else:
+                            with timed(file_timer, 'fingerprint', ext_this):
+                                file_id['partial_sha256'] = get_partial_checksum(full_path)
+
+                    # FLAC checksums are only computed (and worth reusing) when verifying.
+                    if payload_fingerprints and 'payload_sha256' not in file_id and (
+                            ext_this in PAYLOAD_EXTS and (ext_this != '.flac' or verify_flac)
+                    ) and any(task_scan.task == ScanType.CHECKSUM for task_scan in task_scans_this):
+                        for cached_row in cached_rows:
+                            if cached_row is not None and cached_row['path_and_stat'] == p_and_stat and (
+                                    'payload_sha256' in cached_row.get('file_id', {})
+                            ):
+                                file_id['payload_sha256'] = cached_row['file_id']['payload_sha256']
+                                break
+                        else:
+                            with timed(file_timer, 'fingerprint', ext_this):
+                                payload_sha256 = get_payload_fingerprint(full_path)
+                            if payload_sha256 is not None:
+                                file_id['payload_sha256'] = payload_sha256
+
+                    results = dict()
+                    tasks_to_extract = dict()
+                    for task_scan, cached_row in zip(task_scans_this, cached_rows):
+                        result = task_scan.find_cached_result(full_path, cached_row, p_and_stat, file_id)
+                        if result is not None:
+                            results[task_scan.task] = result
+                        elif checksum_engine is not None and task_scan.task == ScanType.CHECKSUM and (
+                                ext_this in FFMPEG_CHECKSUM_TYPE_BY_EXT
+                        ) and not (native_dsf_checksum and ext_this == '.dsf'):
+                            results[task_scan.task] = checksum_engine.submit(
+                                full_path, FFMPEG_CHECKSUM_TYPE_BY_EXT[ext_this]
+                            )
+                        elif iso_hash_executor is not None and task_scan.task == ScanType.CHECKSUM and (
+                                ext_this == '.iso'
+                        ):
+                            results[task_scan.task] = iso_hash_executor.submit(hash_iso_file, full_path)
+                        else:
+                            tasks_to_extract[task_scan.task] = task_scan
+
+                    # only SACD ISOs parsed for metadata go through the cache.
+                    use_sacd_cache = sacd_cache is not None and ext_this == '.iso' and (
+                            ScanType.CORE_METADATA in tasks_to_extract or ScanType.EXTRA_METADATA in tasks_to_extract
+                    )
+                    if use_sacd_cache:
+                        sacd_xml_text = sacd_cache.get(full_path, p_and_stat['size'], p_and_stat['mtime'])
+                    else:
+                        sacd_xml_text = None
+
+                    if len(tasks_to_extract) == 0:
+                        extracted = None
+                    elif executor is None:
+                        extracted = extract_one_file(
+                            full_path=full_path,
+                            tasks={
+                                task: task_scan.extract_kwargs(full_path) for task, task_scan in tasks_to_extract.items()
+                            },
+                            update_multi_value_fields=update_multi_value_fields,
+                            native_dsf_checksum=native_dsf_checksum,
+                            dsf_trim_padding=dsf_trim_padding,
+                            verify_flac=verify_flac,
+                            native_sacd_toc=native_sacd_toc,
+                            sacd_xml_text=sacd_xml_text,
+                            export_sacd_xml=use_sacd_cache,
+                            defer_cover_art=defer_cover_art,
+                            bounded_tag_reads=bounded_tag_reads,
+                            collect_errors=on_error == 'collect',
+                            stage_timing=stage_timing,
                         )
-                        continue
-                elif task == ScanType.EXTRA_METADATA:
-                    if ext_this == '.m4a':
-                        row_this = overwrite_result_dict[full_path]
-                    elif ext_this == '.dsf':
-                        # just create empty rating.
-                        row_this = create_empty_extra_metadata()
-                    elif ext_this == '.iso':
-                        # check how many tracks are there, and then create a list
-                        row_this = [
-                            create_empty_extra_metadata()
-                        ] * get_total_tracks(full_path)
                     else:
-                        extra_files_all.append(
-                            full_path
+                        extracted = executor.submit(
+                            extract_one_file,
+                            full_path=full_path,
+                            tasks={
+                                task: task_scan.extract_kwargs(
+                                    full_path, for_worker=True
+                                ) for task, task_scan in tasks_to_extract.items()
+                            },
+                            update_multi_value_fields=update_multi_value_fields,
+                            native_dsf_checksum=native_dsf_checksum,
+                            dsf_trim_padding=dsf_trim_padding,
+                            verify_flac=verify_flac,
+                            native_sacd_toc=native_sacd_toc,
+                            sacd_xml_text=sacd_xml_text,
+                            export_sacd_xml=use_sacd_cache,
+                            defer_cover_art=defer_cover_art,
+                            bounded_tag_reads=bounded_tag_reads,
+                            collect_errors=on_error == 'collect',
+                            stage_timing=stage_timing,
                         )
-                        continue
-                else:
-                    raise NotImplementedError
 
-            try:
-                check_valid_result(
-                    row_this, ext_this
-                )
-            except Exception as e:
-                raise ValueError(
-                    f"invalid output from {repr(full_path)}",
-                    e
+                    pending.append(
+                        (full_path, ext_this, p_and_stat, file_id, results, extracted, t_start, file_timer)
+                    )
+                except Exception as e:
+                    if on_error != 'collect':
+                        raise
+                    quarantine(task_scans_for(full_path), full_path, 'scan', e, perf_counter() - t_start)
+                    tracker.done(full_path)
+                    continue
+                flush(max_pending)
+
+        tracker.set_stage('drain')
+        flush(0)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if checksum_engine is not None:
+            checksum_engine.close()
+        if iso_hash_executor is not None:
+            iso_hash_executor.shutdown(wait=True, cancel_futures=True)
+        # always unregister the artwork stores, so that a later scan of the same aux dir starts afresh
+        # even if this one failed.
+        artwork_stores = dict()
+        for task_scan in task_scans:
+            if task_scan.aux_output_dir is not None and task_scan.aux_output_dir not in artwork_stores:
+                artwork_stores[task_scan.aux_output_dir] = release_artwork_store(task_scan.aux_output_dir)
+    tracker.set_stage('done')
+
+    for task_scan in task_scans:
+        if task_scan.cover_references > 0:
+            print(
+                f'{task_scan.cover_references} cover art references, {len(task_scan.covers)} unique images, '
+                f'dedup ratio {task_scan.cover_references / len(task_scan.covers):.1f}'
+            )
+        if task_scan.aux_output_dir is not None:
+            # only extractions in this process are counted here, not those in worker processes.
+            artwork_store = artwork_stores.pop(task_scan.aux_output_dir, None)
+            if artwork_store is not None:
+                artwork_stats = artwork_store.stats()
+                print(
+                    f'artwork store: {artwork_stats["references"]} images saved, {artwork_stats["unique"]} unique, '
+                    f'{artwork_stats["written"]} written, {artwork_stats["deferred"]} deferred, '
+                    f'{artwork_stats["hashes_skipped"]} hashes skipped'
                 )
 
-            row_all.append(row_this)
-            path_and_stat_all.append(p_and_stat)
+    if sacd_cache is not None:
+        print(f'SACD cache: {sacd_cache.hits} hits, {sacd_cache.misses} misses, {len(sacd_cache)} entries')
+
+    if len(iso_hash_stats) > 0:
+        bytes_all = sum(x[0] for x in iso_hash_stats.values())
+        seconds_all = sum(x[1] for x in iso_hash_stats.values())
+        print(
+            f'{len(iso_hash_stats)} ISO files hashed, {bytes_all / 2 ** 20:.0f} MiB, '
+            f'{bytes_all / 2 ** 20 / max(seconds_all, 1e-9):.1f} MiB/s per thread'
+        )
 
-        if (folder_ct % 10 == 0) or (file_ct % 10 == 0):
-            print(f'{folder_ct} folder scanned, {file_ct} files scanned')
+    if stage_timer is not None:
+        stage_timer.report()
+    if slowest is not None:
+        print('slowest files:')
+        for entry in slowest.to_json():
+            print(f'  {entry["seconds"]:.2f}s {entry["path"]}')
 
     return {
-        'folder_ct': folder_ct,
-        'file_ct': file_ct,
-        'warnings': warnings_all,
-        'output': row_all,
-        'path_and_stat': path_and_stat_all,
-        'extra_files': extra_files_all,
-        'input_dir': input_dir,
-        'aux_output_dir': aux_output_dir,
-        'task': task,
+        task_scan.task: {
+            'folder_ct': folder_ct,
+            'file_ct': file_ct,
+            'warnings': warnings_all,
+            'output': task_scan.row_all,
+            'path_and_stat': task_scan.path_and_stat_all,
+            'file_id': task_scan.file_id_all,
+            'extra_files': task_scan.extra_files_all,
+            'moved': task_scan.moved_all,
+            'payload_reused': task_scan.payload_reused_all,
+            'errors': task_scan.errors_all,
+            'timing': None if stage_timer is None else {
+                'stages': stage_timer.to_json(),
+                'slowest_files': None if slowest is None else slowest.to_json(),
+            },
+            'dir_manifest': dir_manifest,
+            'input_dir': input_dir,
+            'aux_output_dir': task_scan.aux_output_dir,
+            'task': task_scan.task,
+        } for task_scan in task_scans
     }
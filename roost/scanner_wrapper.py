@@ -3,11 +3,18 @@ import pickle
 from enum import Enum
 from os import makedirs
 from os import path
+from os import stat
+from os import fsync
+from os import remove
+from os import replace
 
 from . import scanner
-from .metadata.checksum import ChecksumType
-from .metadata.core import Tag
-from .metadata.extra import Extra
+from .columnar import write_columnar
+from .metadata.checksum import ChecksumType, ChecksumTypeMap
+from .metadata.core import Tag, TagTypeMap
+from .metadata.core.sacdiso import SacdXmlCache
+from .metadata.extra import Extra, TagTypeMap as ExtraTypeMap
+from .progress import print_progress
 
 task_to_enum_map = {
     scanner.ScanType.CORE_METADATA: Tag,
@@ -15,6 +22,12 @@ task_to_enum_map = {
     scanner.ScanType.EXTRA_METADATA: Extra,
 }
 
+task_to_type_map = {
+    scanner.ScanType.CORE_METADATA: TagTypeMap,
+    scanner.ScanType.CHECKSUM: ChecksumTypeMap,
+    scanner.ScanType.EXTRA_METADATA: ExtraTypeMap,
+}
+
 
 def decode_output(enum_to_use, output):
     if type(output) is dict:
@@ -34,47 +47,300 @@ def encode_output(output):
         raise TypeError
 
 
-def scan_one_dir(
-        *, input_dir, output_dir, previous_output_dir=None, task, ignore_dirs=None,
-        ignore_dirs_fn=None,
-        overwrite_result_dict=None, update_multi_value_fields=False,
+# values of `file_id` that are not integers.
+FILE_ID_STR_KEYS = {'partial_sha256', 'payload_sha256'}
+
+
+def decode_main_json_row(enum_to_use, json_this):
+    json_this['output'] = decode_output(enum_to_use, json_this['output'])
+    json_this['path_and_stat'] = {
+        k: (int(v) if k != 'path' else v) for k, v in json_this['path_and_stat'].items()
+    }
+    if 'file_id' in json_this:
+        json_this['file_id'] = {
+            k: (int(v) if k not in FILE_ID_STR_KEYS else v) for k, v in json_this['file_id'].items()
+        }
+    return json_this
+
+
+def main_json_index_path(main_json_path):
+    return path.splitext(main_json_path)[0] + '.index.json'
+
+
+def iter_main_json_index(main_json_path):
+    """yield the index row of each line of `main.json`: its path, the byte offset and length of the line,
+    and its `path_and_stat` and `file_id`, so that cache misses and identity lookups never need to read `main.json`.
+    """
+    offset = 0
+    with open(main_json_path, 'rb') as f_main:
+        for line_this in f_main:
+            json_this = json.loads(line_this)
+            path_and_stat_this = json_this['path_and_stat']
+            yield [
+                path_and_stat_this['path'], offset, len(line_this),
+                path_and_stat_this['mtime'], path_and_stat_this['size'],
+                json_this.get('file_id', None),
+            ]
+            offset += len(line_this)
+
+
+def build_main_json_index(main_json_path):
+    """map each path in `main.json` to the byte offset and length of its line. see `iter_main_json_index`."""
+    return list(iter_main_json_index(main_json_path))
+
+
+def write_main_json_index(main_json_path, rows):
+    # `rows` can be any iterable, and is written out one row at a time.
+    stat_main = stat(main_json_path)
+    with open(main_json_index_path(main_json_path), 'wt', encoding='utf-8') as f_index:
+        f_index.write('{"main_json": ')
+        # to detect an index that is out of date.
+        json.dump({'size': stat_main.st_size, 'mtime_ns': stat_main.st_mtime_ns}, f_index)
+        f_index.write(', "rows": [')
+        for idx, row in enumerate(rows):
+            if idx > 0:
+                f_index.write(', ')
+            json.dump(row, f_index, allow_nan=False)
+        f_index.write(']}')
+
+
+def load_main_json_index(main_json_path):
+    index_path = main_json_index_path(main_json_path)
+    stat_main = stat(main_json_path)
+    if path.exists(index_path):
+        with open(index_path, 'rt', encoding='utf-8') as f_index:
+            index = json.load(f_index)
+        if index['main_json'] == {'size': stat_main.st_size, 'mtime_ns': stat_main.st_mtime_ns}:
+            return index['rows']
+
+    rows = build_main_json_index(main_json_path)
+    try:
+        write_main_json_index(main_json_path, rows)
+    except OSError:
+        # the previous output may be read-only; the index is only an optimization.
+        pass
+    return rows
+
+
+class MainJsonCache:
+    """result cache backed by the `main.json` of a previous scan.
+
+    only a path -> byte offset index is kept in memory (persisted as `main.index.json`),
+    and a row is read and decoded when it is looked up.
+    """
+
+    def __init__(self, main_json_path, enum_to_use: Enum):
+        self.main_json_path = main_json_path
+        self.enum_to_use = enum_to_use
+        # for duplicate paths, the last row wins, as when loading everything into a dict.
+        self._index = {
+            row[0]: row[1:] for row in load_main_json_index(main_json_path)
+        }
+        self._f_main = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, full_path):
+        return full_path in self._index
+
+    def __getitem__(self, full_path):
+        offset, length = self._index[full_path][:2]
+        if self._f_main is None:
+            self._f_main = open(self.main_json_path, 'rb')
+        self._f_main.seek(offset)
+        return decode_main_json_row(self.enum_to_use, json.loads(self._f_main.read(length)))
+
+    def get(self, full_path, default=None):
+        if full_path not in self._index:
+            return default
+        return self[full_path]
+
+    def iter_identities(self):
+        """yield (path, path_and_stat, file_id) of every row, without reading `main.json`."""
+        for full_path, (_, _, mtime, size, file_id) in self._index.items():
+            if file_id is not None:
+                file_id = {
+                    k: (int(v) if k not in FILE_ID_STR_KEYS else v) for k, v in file_id.items()
+                }
+            yield full_path, {'path': full_path, 'mtime': int(mtime), 'size': int(size)}, file_id
+
+    def close(self):
+        if self._f_main is not None:
+            self._f_main.close()
+            self._f_main = None
+
+
+def encode_main_json_row(row_this, path_and_stat_this, file_id_this):
+    return (
+        json.dumps(
+            {
+                'path_and_stat': {
+                    # it has many large integers... good to save them as str.
+                    k: str(v) for k, v in path_and_stat_this.items()
+                },
+                'output': encode_output(row_this),
+                'file_id': {
+                    k: str(v) for k, v in file_id_this.items()
+                },
+            },
+            allow_nan=False,
+        ) + '\n'
+    ).encode('utf-8')
+
+
+class MainJsonWriter:
+    """write `main.json` one row at a time, optionally recording checkpoints to resume from.
+
+    a checkpoint (`checkpoint.json`) records how many bytes of `main.json` are known to be complete;
+    when resuming, anything after that is truncated and the committed paths are reported in `committed_paths`.
+
+    rows of `main.index.json` are also written out as they come, into `main.index.json.rows`,
+    and only assembled into `main.index.json` by `close`, so that memory does not grow with the library.
+    the exception is `committed_paths`, which holds the paths committed before resuming.
+    """
+
+    def __init__(self, output_dir, *, checkpoint_every=None, resume=False):
+        self.main_json_path = path.join(output_dir, 'main.json')
+        self.checkpoint_path = path.join(output_dir, 'checkpoint.json')
+        self.index_rows_path = main_json_index_path(self.main_json_path) + '.rows'
+        self.checkpoint_every = checkpoint_every
+
+        main_json_bytes = 0
+        if resume and path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'rt', encoding='utf-8') as f_checkpoint:
+                main_json_bytes = json.load(f_checkpoint)['main_json_bytes']
+
+        self._f_main = open(self.main_json_path, 'ab' if resume else 'wb')
+        # drop rows written after the last checkpoint; they may be incomplete.
+        self._f_main.truncate(main_json_bytes)
+        self._f_main.seek(main_json_bytes)
+
+        # one JSON index row per line, rebuilt from what is kept of `main.json` when resuming.
+        self._f_index_rows = open(self.index_rows_path, 'wt', encoding='utf-8')
+        self.committed_paths = set()
+        self.row_ct = 0
+        if main_json_bytes > 0:
+            for index_row in iter_main_json_index(self.main_json_path):
+                self.write_index_row(index_row)
+                self.committed_paths.add(index_row[0])
+        self._offset = main_json_bytes
+        self._rows_since_checkpoint = 0
+
+    def write_index_row(self, index_row):
+        self._f_index_rows.write(json.dumps(index_row, allow_nan=False) + '\n')
+        self.row_ct += 1
+
+    def write(self, row_this, path_and_stat_this, file_id_this):
+        line_this = encode_main_json_row(row_this, path_and_stat_this, file_id_this)
+        self._f_main.write(line_this)
+        self.write_index_row(
+            [
+                path_and_stat_this['path'], self._offset, len(line_this),
+                str(path_and_stat_this['mtime']), str(path_and_stat_this['size']),
+                {k: str(v) for k, v in file_id_this.items()},
+            ]
+        )
+        self._offset += len(line_this)
+
+        self._rows_since_checkpoint += 1
+        if self.checkpoint_every is not None and self._rows_since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self, complete=False):
+        self._f_main.flush()
+        fsync(self._f_main.fileno())
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'wt', encoding='utf-8') as f_checkpoint:
+            json.dump(
+                {
+                    'main_json_bytes': self._offset,
+                    'rows': self.row_ct,
+                    'complete': complete,
+                },
+                f_checkpoint,
+            )
+            f_checkpoint.flush()
+            fsync(f_checkpoint.fileno())
+        replace(tmp_path, self.checkpoint_path)
+        self._rows_since_checkpoint = 0
+
+    def close(self):
+        if self.checkpoint_every is not None:
+            self.checkpoint(complete=True)
+        self._f_main.close()
+        self._f_index_rows.close()
+        with open(self.index_rows_path, 'rt', encoding='utf-8') as f_index_rows:
+            write_main_json_index(self.main_json_path, (json.loads(line) for line in f_index_rows))
+        remove(self.index_rows_path)
+
+
+def prepare_task_output(
+        *, task, output_dir, previous_output_dir, overwrite_result_dict, trust_dir_manifest,
+        stream, resume, checkpoint_every,
 ):
-    makedirs(output_dir, exist_ok=False)
+    """create `output_dir` for one task, and load what can be reused from `previous_output_dir`.
+
+    :return: the options of this task for `scanner.scan_one_directory_multi`, and the `MainJsonWriter` if streaming.
+    """
+    makedirs(output_dir, exist_ok=resume)
     if task == scanner.ScanType.CORE_METADATA:
         aux_output_dir = path.join(output_dir, 'images')
-        makedirs(aux_output_dir, exist_ok=False)
+        makedirs(aux_output_dir, exist_ok=resume)
     else:
         aux_output_dir = None
 
+    if stream:
+        main_json_writer = MainJsonWriter(output_dir, checkpoint_every=checkpoint_every, resume=resume)
+        if resume:
+            print(f'{task.name}: resuming after {len(main_json_writer.committed_paths)} committed files')
+    else:
+        main_json_writer = None
+
     # previous_output_dir is used to build a cache for metadata
     if previous_output_dir is not None:
-        result_cache = dict()
-        enum_to_use: Enum = task_to_enum_map[task]
-        with open(path.join(previous_output_dir, 'main.json'), 'rt') as f_prev:
-            for line_this in f_prev:
-                json_this = json.loads(line_this)
-                json_this['output'] = decode_output(enum_to_use, json_this['output'])
-                json_this['path_and_stat'] = {
-                    k: (int(v) if k != 'path' else v) for k, v in json_this['path_and_stat'].items()
-                }
-                result_cache[json_this['path_and_stat']['path']] = json_this
+        result_cache = MainJsonCache(
+            path.join(previous_output_dir, 'main.json'), task_to_enum_map[task]
+        )
     else:
         result_cache = None
 
-    print(input_dir)
-    stats_this_lib = scanner.scan_one_directory(
-        input_dir=input_dir,
-        result_cache=result_cache,
-        task=task,
-        aux_output_dir=aux_output_dir,
-        ignore_dirs=ignore_dirs,
-        overwrite_result_dict=overwrite_result_dict,
-        update_multi_value_fields=update_multi_value_fields,
-        ignore_dirs_fn=ignore_dirs_fn,
-    )
+    # see `scanner.scan_one_directory` for when the directory manifest can be trusted.
+    # outputs from older versions do not have a manifest.
+    if previous_output_dir is not None and trust_dir_manifest and path.exists(
+            path.join(previous_output_dir, 'manifest.json')
+    ):
+        with open(path.join(previous_output_dir, 'manifest.json'), 'rt', encoding='utf-8') as f_manifest:
+            dir_manifest_cache = json.load(f_manifest)
+    else:
+        dir_manifest_cache = None
+
+    options = {
+        'aux_output_dir': aux_output_dir,
+        'result_cache': result_cache,
+        'overwrite_result_dict': overwrite_result_dict,
+        'dir_manifest_cache': dir_manifest_cache,
+        'row_sink': None if main_json_writer is None else main_json_writer.write,
+        'skip_paths': None if main_json_writer is None else main_json_writer.committed_paths,
+    }
+    return options, main_json_writer
 
-    print(f'{stats_this_lib["folder_ct"]} folders, {stats_this_lib["file_ct"]} files')
+
+def iter_main_json(main_json_path, enum_to_use):
+    # (row, path_and_stat, file_id) of each line of `main.json`.
+    with open(main_json_path, 'rb') as f_main:
+        for line in f_main:
+            json_this = decode_main_json_row(enum_to_use, json.loads(line))
+            yield json_this['output'], json_this['path_and_stat'], json_this.get('file_id', None)
+
+
+def write_task_output(*, output_dir, stats_this_lib, main_json_writer, stream, columnar=False):
+    print(f'{stats_this_lib["task"].name}: {stats_this_lib["folder_ct"]} folders, {stats_this_lib["file_ct"]} files')
     print(f'{len(stats_this_lib["warnings"])} warnings')
+    print(f'{len(stats_this_lib["moved"])} moved files recognized')
+    print(f'{len(stats_this_lib["payload_reused"])} files with only tags changed')
+    if len(stats_this_lib['errors']) > 0:
+        print(f'{len(stats_this_lib["errors"])} files quarantined, see `errors` in aux.json')
 
     assert stats_this_lib.keys() == {
         'folder_ct',
@@ -82,7 +348,13 @@ def scan_one_dir(
         'warnings',
         'output',
         'path_and_stat',
+        'file_id',
         'extra_files',
+        'moved',
+        'payload_reused',
+        'errors',
+        'timing',
+        'dir_manifest',
         'input_dir',
         'aux_output_dir',
         'task',
@@ -93,17 +365,22 @@ def scan_one_dir(
     assert len(stats_this_lib['extra_files']) == 0, 'no extra file'
 
     # pickle version
-    with open(path.join(output_dir, 'full.pkl'), 'wb') as f_pkl:
-        pickle.dump(
-            stats_this_lib,
-            f_pkl
-        )
+    if not stream:
+        with open(path.join(output_dir, 'full.pkl'), 'wb') as f_pkl:
+            pickle.dump(
+                stats_this_lib,
+                f_pkl
+            )
     # json version, aux
     with open(path.join(output_dir, 'aux.json'), 'wt', encoding='utf-8') as f_aux:
         json.dump(
             {
                 'warnings': [repr(x) for x in stats_this_lib["warnings"]],
                 'extra_files': stats_this_lib["extra_files"],
+                'moved': stats_this_lib["moved"],
+                'payload_reused': stats_this_lib["payload_reused"],
+                'errors': stats_this_lib["errors"],
+                'timing': stats_this_lib["timing"],
                 'folder_ct': stats_this_lib["folder_ct"],
                 'file_ct': stats_this_lib["file_ct"],
                 'input_dir': stats_this_lib["input_dir"],
@@ -116,20 +393,167 @@ def scan_one_dir(
         )
 
     # json version, path_stat_meta. one line at a time, to support scalable loading (if ever needed)
-    output_all = stats_this_lib['output']
-    path_and_stat_all = stats_this_lib['path_and_stat']
-    assert len(output_all) == len(path_and_stat_all)
-    with open(path.join(output_dir, 'main.json'), 'wt', encoding='utf-8') as f_path_stat_meta:
-        for row_this, path_and_stat_this in zip(output_all, path_and_stat_all):
-            f_path_stat_meta.write(
-                json.dumps(
-                    {
-                        'path_and_stat': {
-                            # it has many large integers... good to save them as str.
-                            k: str(v) for k, v in path_and_stat_this.items()
-                        },
-                        'output': encode_output(row_this)
-                    },
-                    allow_nan=False,
-                ) + '\n'
+    if main_json_writer is None:
+        output_all = stats_this_lib['output']
+        path_and_stat_all = stats_this_lib['path_and_stat']
+        file_id_all = stats_this_lib['file_id']
+        assert len(output_all) == len(path_and_stat_all) == len(file_id_all)
+        main_json_writer = MainJsonWriter(output_dir)
+        for row_this, path_and_stat_this, file_id_this in zip(output_all, path_and_stat_all, file_id_all):
+            main_json_writer.write(row_this, path_and_stat_this, file_id_this)
+    main_json_writer.close()
+
+    # columnar version, for fast loading. see `columnar`.
+    if columnar:
+        task = stats_this_lib['task']
+        if stream:
+            rows = iter_main_json(main_json_writer.main_json_path, task_to_enum_map[task])
+        else:
+            rows = zip(stats_this_lib['output'], stats_this_lib['path_and_stat'], stats_this_lib['file_id'])
+        write_columnar(
+            path.join(output_dir, 'columns.bin'), rows,
+            task_name=task.name,
+            enum_to_use=task_to_enum_map[task],
+            type_map=task_to_type_map[task],
+            # checksum rows only have the checksums computed for the file type.
+            sparse=task == scanner.ScanType.CHECKSUM,
+        )
+
+    # per-directory mtime and entry count, for skipping unchanged directories in the next scan.
+    if stats_this_lib['dir_manifest'] is not None:
+        with open(path.join(output_dir, 'manifest.json'), 'wt', encoding='utf-8') as f_manifest:
+            json.dump(
+                stats_this_lib['dir_manifest'],
+                f_manifest,
+                allow_nan=False,
             )
+
+
+def scan_one_dir(
+        *, input_dir, output_dir, previous_output_dir=None, task, ignore_dirs=None,
+        ignore_dirs_fn=None,
+        overwrite_result_dict=None, update_multi_value_fields=False, workers=None,
+        trust_dir_manifest=False, detect_moves=False, partial_hash_moves=False,
+        stream=False, resume=False, checkpoint_every=100, checksum_concurrency=None, checksum_timeout=None,
+        iso_hash_threads=None, native_dsf_checksum=False, dsf_trim_padding=True, payload_fingerprints=False,
+        verify_flac=False, native_sacd_toc=False, sacd_cache_size=None, defer_cover_art=False,
+        bounded_tag_reads=False, on_error='raise', stage_timing=False, slowest_files=None,
+        progress=print_progress, progress_interval=10.0, precount=False, columnar=False,
+):
+    """
+    :param task: a `ScanType`, or a collection of them to compute in a single pass over the files.
+        for a collection, `output_dir` (and `previous_output_dir`) contain one subdirectory per task,
+        named `task.name.lower()`, and `overwrite_result_dict` maps each task to its own overwrite dict.
+    :param trust_dir_manifest: write the mtime and entry count of each directory into `manifest.json`,
+        and reuse the cached rows of directories unchanged since the `manifest.json` of `previous_output_dir`
+        without stat'ing their files. see `dir_manifest_cache` of `scanner.scan_one_directory` for the caveat.
+        a previous output scanned without it has no manifest, so everything is stat'ed as usual.
+    :param stream: append each row to `main.json` as soon as it is produced, with a checkpoint
+        every `checkpoint_every` rows, instead of keeping everything in memory until the end.
+        `full.pkl` is not written in this mode, as the rows are never all in memory.
+    :param resume: continue a streaming scan into an existing `output_dir`,
+        skipping the files committed before its last checkpoint.
+    :param sacd_cache_size: if not None, keep up to this many parsed SACD ISOs in `sacd_cache.json` under
+        `output_dir`, starting from the one under `previous_output_dir` (or `output_dir` when resuming),
+        so that unchanged ISOs are not parsed again.
+    :param on_error: 'raise', or 'collect' to quarantine failing files into `errors` of `aux.json`
+        and go on with the rest. see `scanner.scan_one_directory`.
+    :param stage_timing: record the time spent in each stage of the scan into `timing` of `aux.json`,
+        with the stages of the `slowest_files` slowest files if not None. see `scanner.scan_one_directory`.
+    :param progress: a function taking progress events, every `progress_interval` seconds;
+        `precount` gives them totals and an ETA. see `scanner.scan_one_directory`.
+    :param columnar: also write the results into `columns.bin`, a column-oriented file that
+        `manager.load_columnar` memory-maps. see `columnar`.
+    """
+    assert stream or not resume, 'only streaming scans can be resumed'
+
+    if isinstance(task, scanner.ScanType):
+        tasks = [task]
+        output_dirs = {task: output_dir}
+        previous_output_dirs = {task: previous_output_dir}
+        overwrite_result_dicts = {task: overwrite_result_dict}
+    else:
+        tasks = sorted(task, key=lambda x: x.value)
+        output_dirs = {
+            task_this: path.join(output_dir, task_this.name.lower()) for task_this in tasks
+        }
+        previous_output_dirs = {
+            task_this: None if previous_output_dir is None else path.join(
+                previous_output_dir, task_this.name.lower()
+            ) for task_this in tasks
+        }
+        overwrite_result_dicts = {
+            task_this: None if overwrite_result_dict is None else overwrite_result_dict.get(
+                task_this, None
+            ) for task_this in tasks
+        }
+
+    task_options = dict()
+    main_json_writers = dict()
+    for task_this in tasks:
+        task_options[task_this], main_json_writers[task_this] = prepare_task_output(
+            task=task_this,
+            output_dir=output_dirs[task_this],
+            previous_output_dir=previous_output_dirs[task_this],
+            overwrite_result_dict=overwrite_result_dicts[task_this],
+            trust_dir_manifest=trust_dir_manifest,
+            stream=stream,
+            resume=resume,
+            checkpoint_every=checkpoint_every,
+        )
+
+    if sacd_cache_size is not None:
+        if resume:
+            sacd_cache_dir = output_dir
+        else:
+            sacd_cache_dir = previous_output_dir
+        sacd_cache = SacdXmlCache.load(
+            path.join(sacd_cache_dir, 'sacd_cache.json'), sacd_cache_size
+        ) if sacd_cache_dir is not None else SacdXmlCache(sacd_cache_size)
+    else:
+        sacd_cache = None
+
+    print(input_dir)
+    stats_all = scanner.scan_one_directory_multi(
+        input_dir=input_dir,
+        tasks=task_options,
+        ignore_dirs=ignore_dirs,
+        update_multi_value_fields=update_multi_value_fields,
+        ignore_dirs_fn=ignore_dirs_fn,
+        workers=workers,
+        detect_moves=detect_moves,
+        partial_hash_moves=partial_hash_moves,
+        checksum_concurrency=checksum_concurrency,
+        checksum_timeout=checksum_timeout,
+        iso_hash_threads=iso_hash_threads,
+        native_dsf_checksum=native_dsf_checksum,
+        dsf_trim_padding=dsf_trim_padding,
+        payload_fingerprints=payload_fingerprints,
+        verify_flac=verify_flac,
+        native_sacd_toc=native_sacd_toc,
+        sacd_cache=sacd_cache,
+        defer_cover_art=defer_cover_art,
+        bounded_tag_reads=bounded_tag_reads,
+        on_error=on_error,
+        stage_timing=stage_timing,
+        slowest_files=slowest_files,
+        progress=progress,
+        progress_interval=progress_interval,
+        precount=precount,
+        record_dir_manifest=trust_dir_manifest,
+    )
+    for task_this in tasks:
+        if task_options[task_this]['result_cache'] is not None:
+            task_options[task_this]['result_cache'].close()
+
+    for task_this in tasks:
+        write_task_output(
+            output_dir=output_dirs[task_this],
+            stats_this_lib=stats_all[task_this],
+            main_json_writer=main_json_writers[task_this],
+            stream=stream,
+            columnar=columnar,
+        )
+
+    if sacd_cache is not None:
+        sacd_cache.save(path.join(output_dir, 'sacd_cache.json'))
@@ -0,0 +1,417 @@
+"""column store of track metadata behind `manager.TrackManager`.
+
+instead of two dicts per track, each field is kept in one `Column` for all tracks:
+ints, floats and bools in typed arrays, and strings as codes into a `StringTable`,
+so that an album, artist or genre repeated over thousands of tracks is stored once.
+`TrackView` is a row of the store with the API of `manager.Track`.
+"""
+from array import array
+from collections.abc import Mapping
+from math import isnan
+
+from .columnar import INT64_NULL
+from .metadata.core import TagTypeMap
+from .metadata.extra import TagTypeMap as ExtraTypeMap
+
+# groups of fields of a track, as in `Track.core_metadata` and `Track.extra_metadata`.
+CORE = 'core'
+EXTRA = 'extra'
+
+# expected type of each field, by name.
+FIELD_TYPES = {
+    CORE: {k.name: v for k, v in TagTypeMap.items()},
+    EXTRA: {k.name: v for k, v in ExtraTypeMap.items()},
+}
+
+KIND_OF_TYPE = {
+    int: 'int',
+    float: 'float',
+    bool: 'bool',
+    str: 'str',
+}
+
+# how None is stored in each kind of `Column`.
+NULL_OF_KIND = {
+    'int': INT64_NULL,
+    'float': float('nan'),
+    'bool': -1,
+    'str': -1,
+    'object': None,
+}
+
+NoneType = type(None)
+
+
+class Encoded:
+    """values of a field already encoded as in a `Column` of `kind`, e.g., read from a `columnar.ColumnarTable`.
+
+    `values` is a buffer of ints, floats or bools with the nulls of `NULL_OF_KIND`, or for 'str', of codes
+    into the list `strings` (-1 for None). a `Column` of the same kind takes them without touching each value.
+    """
+    __slots__ = ('kind', 'values', 'strings')
+
+    def __init__(self, kind, values, strings=None):
+        self.kind = kind
+        self.values = values
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.values)
+
+    def to_list(self):
+        if self.kind == 'str':
+            strings = self.strings + [None]
+            # -1 picks the None appended above.
+            return [strings[x] for x in self.values.tolist()]
+        null = NULL_OF_KIND[self.kind]
+        values = self.values.tolist()
+        if self.kind == 'float':
+            return [None if v != v else v for v in values]
+        if self.kind == 'bool':
+            return [None if v == null else bool(v) for v in values]
+        return [None if v == null else v for v in values]
+
+
+class StringTable:
+    """distinct strings, each with an integer code."""
+    __slots__ = ('values', 'codes')
+
+    def __init__(self):
+        self.values = []
+        self.codes = dict()
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self.codes.get(value, None)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __getstate__(self):
+        # codes are rebuilt on loading.
+        return self.values
+
+    def __setstate__(self, state):
+        self.values = state
+        self.codes = {v: code for code, v in enumerate(state)}
+
+
+class Column:
+    """values of one field for all tracks.
+
+    `kind` is 'int', 'float' and 'bool' (typed arrays, None stored as `INT64_NULL`, NaN and -1),
+    'str' (codes into `strings`, None stored as -1), or 'object' (a list).
+    a column becomes 'object' if it gets a value not fitting its kind, e.g., a float in an int field.
+    """
+    __slots__ = ('kind', 'values', 'strings')
+
+    def __init__(self, python_type):
+        self.kind = KIND_OF_TYPE.get(python_type, 'object')
+        self.strings = StringTable() if self.kind == 'str' else None
+        self.values = {
+            'int': lambda: array('q'),
+            'float': lambda: array('d'),
+            'bool': lambda: array('b'),
+            'str': lambda: array('i'),
+            'object': list,
+        }[self.kind]()
+
+    def __len__(self):
+        return len(self.values)
+
+    def fits(self, values):
+        kind = self.kind
+        if kind == 'object':
+            return True
+        types = set(map(type, values))
+        types.discard(NoneType)
+        if len(types) == 0:
+            return True
+        if kind == 'int':
+            # bool is a subclass of int, so types are compared exactly.
+            if not types <= {int}:
+                return False
+            non_null = [v for v in values if v is not None]
+            return INT64_NULL < min(non_null) and max(non_null) < 2 ** 63
+        if kind == 'float':
+            # NaN stands for None.
+            return types <= {float} and not any(map(isnan, [v for v in values if v is not None]))
+        if kind == 'bool':
+            return types <= {bool}
+        return types <= {str}
+
+    def encode(self, values):
+        kind = self.kind
+        if kind == 'int':
+            return [INT64_NULL if v is None else v for v in values]
+        if kind == 'float':
+            return [float('nan') if v is None else v for v in values]
+        if kind == 'bool':
+            return [-1 if v is None else int(v) for v in values]
+        if kind == 'str':
+            code = self.strings.code
+            return [-1 if v is None else code(v) for v in values]
+        return values
+
+    def decode(self, x):
+        kind = self.kind
+        if kind == 'str':
+            return None if x < 0 else self.strings.values[x]
+        if kind == 'int':
+            return None if x == INT64_NULL else x
+        if kind == 'float':
+            return None if x != x else x
+        if kind == 'bool':
+            return None if x < 0 else bool(x)
+        return x
+
+    def to_object(self):
+        self.values = self.to_list()
+        self.kind = 'object'
+        self.strings = None
+
+    def to_list(self):
+        if self.kind == 'object':
+            return list(self.values)
+        if self.kind == 'str':
+            strings = self.strings.values + [None]
+            # -1 picks the None appended above.
+            return [strings[x] for x in self.values]
+        decode = self.decode
+        return [decode(x) for x in self.values.tolist()]
+
+    def extend(self, values):
+        if type(values) is Encoded:
+            if values.kind == self.kind:
+                self.extend_encoded(values)
+                return
+            values = values.to_list()
+        if not self.fits(values):
+            self.to_object()
+        self.values.extend(self.encode(values))
+
+    def extend_encoded(self, encoded: Encoded):
+        values = encoded.values
+        if encoded.kind == 'str':
+            code = self.strings.code
+            # codes of `encoded` -> codes of this column. the same as long as this column has no other strings.
+            remap = [code(v) for v in encoded.strings]
+            if remap != list(range(len(remap))):
+                remap.append(-1)
+                values = [remap[x] for x in values.tolist()]
+        if type(values) is memoryview and values.itemsize == self.values.itemsize:
+            self.values.frombytes(values.cast('B'))
+        else:
+            self.values.extend(values)
+
+    def fits_one(self, value):
+        kind = self.kind
+        if value is None or kind == 'object':
+            return True
+        if kind == 'int':
+            return type(value) is int and INT64_NULL < value < 2 ** 63
+        if kind == 'float':
+            return type(value) is float and value == value
+        if kind == 'bool':
+            return type(value) is bool
+        return type(value) is str
+
+    def encode_one(self, value):
+        kind = self.kind
+        if kind == 'str':
+            return -1 if value is None else self.strings.code(value)
+        if kind == 'int':
+            return INT64_NULL if value is None else value
+        if kind == 'float':
+            return float('nan') if value is None else value
+        if kind == 'bool':
+            return -1 if value is None else int(value)
+        return value
+
+    def append(self, value):
+        # the common cases first, as this is called for every field of every track.
+        if value is None:
+            self.values.append(NULL_OF_KIND[self.kind])
+        elif self.kind == 'str' and type(value) is str:
+            code = self.strings.codes.get(value, None)
+            self.values.append(self.strings.code(value) if code is None else code)
+        else:
+            if not self.fits_one(value):
+                self.to_object()
+            self.values.append(self.encode_one(value))
+
+    def __getitem__(self, idx):
+        return self.decode(self.values[idx])
+
+    def __setitem__(self, idx, value):
+        if not self.fits_one(value):
+            self.to_object()
+        self.values[idx] = self.encode_one(value)
+
+
+class TrackStore:
+    """metadata of all tracks, with one `Column` per field of each group (`CORE` and `EXTRA`).
+
+    tracks are identified by their index, the id of `TrackManager`.
+    """
+
+    def __init__(self):
+        self.file_path = []
+        self.subindex = array('q')
+        self.columns = {CORE: dict(), EXTRA: dict()}
+        # (track id, group, name) of fields a track does not have at all, as opposed to being None.
+        # normally empty, as all tracks have the same fields.
+        self.missing = set()
+        # functions called with (track id, group, name, old value) after a field is set,
+        # e.g., to keep the indexes of a `query.QueryEngine` up to date.
+        self.on_set = []
+
+    def __getstate__(self):
+        # `on_set` is not kept.
+        state = self.__dict__.copy()
+        del state['on_set']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.on_set = []
+
+    def __len__(self):
+        return len(self.file_path)
+
+    def column(self, group, name):
+        column = self.columns[group].get(name, None)
+        if column is None:
+            column = self.columns[group][name] = Column(FIELD_TYPES[group].get(name, None))
+            # fill in earlier tracks.
+            column.extend([None] * len(self))
+            self.missing.update((track_id, group, name) for track_id in range(len(self)))
+        return column
+
+    def extend(self, file_paths, subindices, core_columns: dict, extra_columns: dict):
+        """add tracks, given as the values of each field.
+
+        :param core_columns: name -> values of the field, one per track, as a list or `Encoded`.
+            same for `extra_columns`.
+        :return: the ids of the tracks added.
+        """
+        start = len(self)
+        assert len(file_paths) == len(subindices)
+        for group, columns_this in ((CORE, core_columns), (EXTRA, extra_columns)):
+            for name, values in columns_this.items():
+                assert len(values) == len(file_paths)
+                self.column(group, name).extend(values)
+            for name, column in self.columns[group].items():
+                if name not in columns_this:
+                    column.extend([None] * len(file_paths))
+                    self.missing.update((track_id, group, name) for track_id in range(start, start + len(file_paths)))
+        self.file_path.extend(file_paths)
+        self.subindex.extend(subindices)
+        return range(start, len(self))
+
+    def append(self, file_path, subindex, core_metadata: dict, extra_metadata: dict):
+        """add a track, and return its id."""
+        track_id = len(self)
+        for group, metadata in ((CORE, core_metadata), (EXTRA, extra_metadata)):
+            columns = self.columns[group]
+            for name, value in metadata.items():
+                column = columns.get(name, None)
+                if column is None:
+                    column = self.column(group, name)
+                column.append(value)
+            if len(metadata) != len(columns):
+                for name, column in columns.items():
+                    if name not in metadata:
+                        column.append(None)
+                        self.missing.add((track_id, group, name))
+        self.file_path.append(file_path)
+        self.subindex.append(subindex)
+        return track_id
+
+    def names(self, track_id, group):
+        if len(self.missing) == 0:
+            return list(self.columns[group].keys())
+        return [name for name in self.columns[group] if (track_id, group, name) not in self.missing]
+
+    def get(self, track_id, group, name):
+        if (track_id, group, name) in self.missing:
+            raise KeyError(name)
+        column = self.columns[group].get(name, None)
+        if column is None:
+            raise KeyError(name)
+        return column[track_id]
+
+    def set(self, track_id, group, name, value):
+        column = self.column(group, name)
+        old_value = column[track_id]
+        column[track_id] = value
+        self.missing.discard((track_id, group, name))
+        for fn in self.on_set:
+            fn(track_id, group, name, old_value)
+
+
+class MetadataView(Mapping):
+    """`core_metadata` or `extra_metadata` of a `TrackView`, read from (and written to) the store."""
+    __slots__ = ('store', 'track_id', 'group')
+
+    def __init__(self, store: TrackStore, track_id, group):
+        self.store = store
+        self.track_id = track_id
+        self.group = group
+
+    def __getitem__(self, name):
+        return self.store.get(self.track_id, self.group, name)
+
+    def __setitem__(self, name, value):
+        self.store.set(self.track_id, self.group, name, value)
+
+    def __iter__(self):
+        return iter(self.store.names(self.track_id, self.group))
+
+    def __len__(self):
+        return len(self.store.names(self.track_id, self.group))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class TrackView:
+    """a track in a `TrackStore`, with the attributes of `manager.Track`."""
+    __slots__ = ('store', 'track_id')
+
+    def __init__(self, store: TrackStore, track_id):
+        self.store = store
+        self.track_id = track_id
+
+    @property
+    def file_path(self):
+        return self.store.file_path[self.track_id]
+
+    @property
+    def subindex(self):
+        return self.store.subindex[self.track_id]
+
+    @property
+    def core_metadata(self):
+        return MetadataView(self.store, self.track_id, CORE)
+
+    @property
+    def extra_metadata(self):
+        return MetadataView(self.store, self.track_id, EXTRA)
+
+    @property
+    def album_key(self):
+        return self.store.get(self.track_id, CORE, 'ALBUM_ARTIST'), self.store.get(self.track_id, CORE, 'ALBUM')
+
+    @property
+    def track_key(self):
+        return self.file_path, self.subindex
+
+    def __eq__(self, other):
+        return type(other) is TrackView and other.store is self.store and other.track_id == self.track_id
+
+    def __hash__(self):
+        return hash(self.track_id)
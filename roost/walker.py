@@ -0,0 +1,139 @@
+"""directory walking built on `os.scandir`, so that each entry is listed and stat'ed at most once"""
+import os
+from fnmatch import fnmatchcase
+from os.path import join, sep
+
+# characters that make a path component a glob pattern, as understood by `fnmatch`.
+GLOB_CHARACTERS = '*?['
+
+
+def walk_directory(top):
+    """walk `top` like `os.walk(top)` (top-down, not following symlinks to directories),
+    but yield the `os.DirEntry` of every file instead of its name.
+
+    `DirEntry.stat()` caches its result, and on some platforms it comes for free with the listing,
+    so callers should stat files through the entries instead of calling `os.stat` again.
+
+    as with `os.walk`, `dirnames` can be modified in place to prune the walk.
+
+    :return: an iterator of (dirpath, dirnames, file_entries)
+    """
+    stack = [top]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            scandir_it = os.scandir(dirpath)
+        except OSError:
+            # same as `os.walk` without `onerror`.
+            continue
+
+        dirnames = []
+        # do not follow symlinks to directories, as in `os.walk`.
+        symlinked_dirnames = set()
+        file_entries = []
+        with scandir_it:
+            for entry in scandir_it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if is_dir:
+                    dirnames.append(entry.name)
+                    try:
+                        if entry.is_symlink():
+                            symlinked_dirnames.add(entry.name)
+                    except OSError:
+                        symlinked_dirnames.add(entry.name)
+                else:
+                    file_entries.append(entry)
+
+        yield dirpath, dirnames, file_entries
+
+        # reversed, so that subdirectories are visited in listing order, as in `os.walk`.
+        for dirname in reversed(dirnames):
+            if dirname not in symlinked_dirnames:
+                stack.append(join(dirpath, dirname))
+
+
+def split_components(dirpath):
+    # '/a/b/' -> ['', 'a', 'b'], so that absolute and relative paths never share a trie path.
+    if dirpath != sep:
+        dirpath = dirpath.rstrip(sep)
+    return dirpath.split(sep)
+
+
+class _IgnoreTrieNode:
+    __slots__ = ('children', 'exact', 'name_prefixes', 'patterns')
+
+    def __init__(self):
+        self.children = dict()
+        # this directory (and therefore everything below it) is ignored.
+        self.exact = False
+        # child directories whose names start with any of these are ignored.
+        self.name_prefixes = []
+        # glob patterns (matched against the full path) whose literal leading components lead here.
+        self.patterns = []
+
+
+class IgnoreRules:
+    """directories to be skipped in a walk, together with everything below them.
+
+    rules are held in a trie of path components, so checking a directory only looks at
+    the rules sharing its leading components.
+
+    :param paths: exact directory paths.
+    :param prefixes: path prefixes; the last component is matched as a string prefix,
+        so '/a/DSD_Test/2019' ignores both '/a/DSD_Test/2019' and '/a/DSD_Test/2019 5 Tracks'.
+    :param patterns: `fnmatch` patterns matched against the full path (case-sensitive).
+        as in `fnmatch`, '*' also matches path separators.
+    """
+
+    def __init__(self, *, paths=(), prefixes=(), patterns=()):
+        self._root = _IgnoreTrieNode()
+        for path_this in paths:
+            self._node(split_components(path_this)).exact = True
+        for prefix_this in prefixes:
+            if prefix_this.endswith(sep):
+                self._node(split_components(prefix_this)).exact = True
+            else:
+                *parent, name_prefix = split_components(prefix_this)
+                self._node(parent).name_prefixes.append(name_prefix)
+        for pattern_this in patterns:
+            literal = []
+            for component in split_components(pattern_this)[:-1]:
+                if any(c in component for c in GLOB_CHARACTERS):
+                    break
+                literal.append(component)
+            self._node(literal).patterns.append(pattern_this)
+
+    def _node(self, components):
+        node = self._root
+        for component in components:
+            node = node.children.setdefault(component, _IgnoreTrieNode())
+        return node
+
+    def matches(self, dirpath):
+        """whether `dirpath` should be ignored, either by itself or through one of its ancestors."""
+        components = split_components(dirpath)
+        node = self._root
+        # (number of leading components, pattern) of the patterns met along the way.
+        patterns = []
+        for depth, component in enumerate(components):
+            patterns.extend((depth, x) for x in node.patterns)
+            # a prefix rule also covers everything below the directories it matches.
+            if any(component.startswith(x) for x in node.name_prefixes):
+                return True
+            node = node.children.get(component, None)
+            if node is None:
+                break
+            if node.exact:
+                return True
+        else:
+            patterns.extend((len(components), x) for x in node.patterns)
+        # a pattern matching an ancestor also covers `dirpath`.
+        for depth, pattern in patterns:
+            for end in range(max(depth, 1), len(components) + 1):
+                if fnmatchcase(sep.join(components[:end]), pattern):
+                    return True
+        return False
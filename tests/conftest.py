@@ -0,0 +1,5 @@
+import sys
+from os import path
+
+# the repo is not installed as a package.
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
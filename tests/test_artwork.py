@@ -0,0 +1,201 @@
+"""deferred cover art against cover art extracted right away. the ALAC case is skipped without ffmpeg.
+
+ffmpeg is `roost.BIN_FFMPEG` if it exists, otherwise `$FFMPEG`, otherwise the one on `PATH`.
+"""
+import os
+import random
+import shutil
+import struct
+import subprocess
+
+import pytest
+from mutagen.dsf import DSF
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import APIC, TIT2
+from mutagen.mp4 import MP4, MP4Cover
+
+import roost
+from roost.metadata.core import Tag
+from roost.metadata.core.artwork import (
+    DEFERRED_DIR, extract_deferred_images, open_image, release_artwork_store,
+)
+from roost.metadata.core.bounded import load_tags_bounded
+from roost.scanner import ExtractStatus, ScanType, extract_one_file
+
+if os.path.exists(roost.BIN_FFMPEG):
+    FFMPEG = roost.BIN_FFMPEG
+else:
+    FFMPEG = os.environ.get('FFMPEG', None) or shutil.which('ffmpeg')
+
+
+def make_image(seed, size=50000):
+    # only the JPEG markers; nothing decodes it.
+    rng = random.Random(seed)
+    return b'\xff\xd8\xff\xe0' + rng.randbytes(size) + b'\xff\xd9'
+
+
+def write_flac(file_path, image):
+    # STREAMINFO of one second of 16-bit stereo at 44.1 kHz, with no audio frames; mutagen only needs the metadata.
+    streaminfo = struct.pack('>HH', 4096, 4096) + bytes(6) + (
+        (44100 << 44) | (1 << 41) | (15 << 36) | 44100
+    ).to_bytes(8, 'big') + bytes(16)
+    with open(file_path, 'wb') as f:
+        f.write(b'fLaC' + bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+    flac_obj = FLAC(file_path)
+    flac_obj['TITLE'] = 'title'
+    picture = Picture()
+    picture.type = 3
+    picture.mime = 'image/jpeg'
+    picture.desc = 'front'
+    picture.data = image
+    flac_obj.add_picture(picture)
+    flac_obj.save()
+
+
+def write_dsf(file_path, image):
+    # one block of 2.8 MHz stereo, with the ID3 chunk after it.
+    data_size = 4096 * 2
+    with open(file_path, 'wb') as f:
+        f.write(struct.pack('<4sQQQ', b'DSD ', 28, 28 + 52 + 12 + data_size, 0))
+        f.write(struct.pack('<4sQIIIIIIQII', b'fmt ', 52, 1, 0, 2, 2, 2822400, 1, 4096 * 8, 4096, 0))
+        f.write(struct.pack('<4sQ', b'data', 12 + data_size))
+        f.write(bytes(data_size))
+    dsf_obj = DSF(file_path)
+    dsf_obj.add_tags()
+    dsf_obj.tags.add(TIT2(encoding=3, text=['title']))
+    # a UTF-16 description.
+    dsf_obj.tags.add(APIC(encoding=1, mime='image/jpeg', type=3, desc='front', data=image))
+    dsf_obj.save()
+
+
+def write_m4a(file_path, image):
+    subprocess.run(
+        [
+            FFMPEG, '-loglevel', 'error', '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=stereo', '-t', '0.5',
+            '-c:a', 'alac', '-sample_fmt', 's16p', file_path,
+        ],
+        check=True,
+    )
+    mp4_obj = MP4(file_path)
+    mp4_obj['\xa9nam'] = ['title']
+    mp4_obj['covr'] = [MP4Cover(image, imageformat=MP4Cover.FORMAT_JPEG)]
+    mp4_obj.save()
+
+
+WRITERS = {
+    '.flac': write_flac,
+    '.dsf': write_dsf,
+    '.m4a': write_m4a,
+}
+
+
+@pytest.fixture(params=sorted(WRITERS))
+def ext(request):
+    if request.param == '.m4a' and FFMPEG is None:
+        pytest.skip('ffmpeg not available')
+    return request.param
+
+
+def extract(file_paths, images_dir, defer_cover_art):
+    os.makedirs(images_dir)
+    rows = []
+    for file_path in file_paths:
+        results, _, _ = extract_one_file(
+            full_path=file_path, tasks={ScanType.CORE_METADATA: {'aux_output_dir': images_dir}},
+            defer_cover_art=defer_cover_art,
+        )
+        status, row = results[ScanType.CORE_METADATA]
+        assert status is ExtractStatus.DONE
+        rows.append(row)
+    return rows, release_artwork_store(images_dir).stats()
+
+
+def test_deferred_matches_extracted(tmp_path, ext):
+    album_cover = make_image(0)
+    booklet = make_image(1)
+    file_paths = []
+    for idx, image in enumerate([album_cover, album_cover, booklet, album_cover]):
+        file_path = str(tmp_path / f'{idx:02d}{ext}')
+        WRITERS[ext](file_path, image)
+        file_paths.append(file_path)
+
+    rows, stats = extract(file_paths, str(tmp_path / 'images'), defer_cover_art=False)
+    assert stats['written'] == 2 and stats['deferred'] == 0
+    rows_deferred, stats = extract(file_paths, str(tmp_path / 'images_deferred'), defer_cover_art=True)
+    assert stats['written'] == 0 and stats['deferred'] == 2 and stats['references'] == 4
+    assert rows_deferred == rows
+
+    # only the pointers are written, and each serves the image straight from its audio file.
+    images = sorted({x[Tag.COVER_ART] for x in rows})
+    assert sorted(os.listdir(tmp_path / 'images_deferred' / DEFERRED_DIR)) == [x + '.json' for x in images]
+    for filename in images:
+        assert not os.path.exists(tmp_path / 'images_deferred' / filename)
+        with open(tmp_path / 'images' / filename, 'rb') as f:
+            expected = f.read()
+        with open_image(str(tmp_path / 'images_deferred'), filename) as image_view:
+            assert image_view == expected
+
+    assert extract_deferred_images(str(tmp_path / 'images_deferred')) == {'extracted': 2, 'stale': []}
+    for filename in images:
+        with open(tmp_path / 'images' / filename, 'rb') as f, open(tmp_path / 'images_deferred' / filename, 'rb') as g:
+            assert f.read() == g.read()
+
+
+def test_cover_not_read(tmp_path, ext):
+    image = make_image(2, size=200000)
+    file_path = str(tmp_path / f'track{ext}')
+    WRITERS[ext](file_path, image)
+
+    obj, bytes_read, bounded, cover = load_tags_bounded(file_path, skip_cover=True)
+    assert bounded
+    assert bytes_read < len(image)
+    assert cover['length'] == len(image) and cover['mime'] == 'image/jpeg'
+    with open(file_path, 'rb') as f:
+        f.seek(cover['offset'])
+        assert f.read(cover['length']) == image
+    # the other tags are still there, and mutagen saw no picture.
+    if ext == '.flac':
+        assert obj['TITLE'] == ['title'] and obj.pictures == []
+    elif ext == '.dsf':
+        assert obj.tags.getall('TIT2')[0].text == ['title'] and obj.tags.getall('APIC') == []
+    else:
+        assert obj.tags['\xa9nam'] == ['title'] and 'covr' not in obj.tags
+
+    # the same file, parsed with the picture.
+    assert load_tags_bounded(file_path)[3] is None
+
+
+def test_unlocatable_cover_extracted(tmp_path):
+    # an ID3v2 tag in front of `fLaC` is left to mutagen, so the picture cannot be located, and is written at once.
+    image = make_image(3)
+    file_path = str(tmp_path / 'track.flac')
+    write_flac(file_path, image)
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    with open(file_path, 'wb') as f:
+        f.write(b'ID3\x03\x00\x00\x00\x00\x00\x00' + data)
+
+    rows, stats = extract([file_path], str(tmp_path / 'images'), defer_cover_art=True)
+    assert stats['written'] == 1 and stats['deferred'] == 0
+    assert not os.path.exists(tmp_path / 'images' / DEFERRED_DIR)
+    with open(tmp_path / 'images' / rows[0][Tag.COVER_ART], 'rb') as f:
+        assert f.read() == image
+
+
+def test_stale_pointer_kept(tmp_path):
+    image = make_image(4)
+    file_path = str(tmp_path / 'track.flac')
+    write_flac(file_path, image)
+    rows, _ = extract([file_path], str(tmp_path / 'images'), defer_cover_art=True)
+
+    # the picture is replaced after the scan.
+    flac_obj = FLAC(file_path)
+    flac_obj.clear_pictures()
+    picture = Picture()
+    picture.mime = 'image/jpeg'
+    picture.data = make_image(5)
+    flac_obj.add_picture(picture)
+    flac_obj.save()
+    assert extract_deferred_images(str(tmp_path / 'images')) == {'extracted': 0, 'stale': [rows[0][Tag.COVER_ART]]}
+    assert os.path.exists(tmp_path / 'images' / DEFERRED_DIR / (rows[0][Tag.COVER_ART] + '.json'))
+
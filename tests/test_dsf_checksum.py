@@ -0,0 +1,89 @@
+"""the native DSF checksum against `ffmpeg -c:a copy -f hash`. skipped without ffmpeg.
+
+ffmpeg is `roost.BIN_FFMPEG` if it exists, otherwise `$FFMPEG`, otherwise the one on `PATH`.
+"""
+import os
+import shutil
+import struct
+
+import pytest
+
+import roost
+import roost.metadata.checksum as checksum
+from roost.metadata.checksum import (
+    ChecksumType, check_native_raw_stream_checksum, get_checksum_in_raw_stream,
+)
+from roost.metadata.checksum.dsf import get_raw_stream_sha256
+
+if os.path.exists(roost.BIN_FFMPEG):
+    FFMPEG = roost.BIN_FFMPEG
+else:
+    FFMPEG = os.environ.get('FFMPEG', None) or shutil.which('ffmpeg')
+
+pytestmark = pytest.mark.skipif(FFMPEG is None, reason='ffmpeg not available')
+
+BLOCK_SIZE_PER_CHANNEL = 4096
+
+
+def write_dsf(file_path, *, channels, sample_count, data_size, seed=0):
+    """a DSF file with `data_size` bytes in its `data` chunk, of which `sample_count` samples per channel are audio.
+
+    the rest of the last block is padding, as in real files.
+    """
+    data = bytes((seed + i * 7 + (i >> 8) * 13) & 0xff for i in range(data_size))
+    file_size = 28 + 52 + 12 + data_size
+    with open(file_path, 'wb') as f:
+        f.write(struct.pack('<4sQQQ', b'DSD ', 28, file_size, 0))
+        f.write(struct.pack(
+            '<4sQIIIIIIQII', b'fmt ', 52, 1, 0, 2 if channels == 2 else 1, channels,
+            2822400, 1, sample_count, BLOCK_SIZE_PER_CHANNEL, 0,
+        ))
+        f.write(struct.pack('<4sQ', b'data', 12 + data_size))
+        f.write(data)
+
+
+def layouts():
+    block_align = BLOCK_SIZE_PER_CHANNEL * 2
+    full_blocks = 5
+    return {
+        # data size a multiple of the packet size (one block of all channels), no padding.
+        'whole_blocks': (2, full_blocks * BLOCK_SIZE_PER_CHANNEL * 8, full_blocks * block_align),
+        # the last block only partly audio, the rest padding.
+        'padded_last_block': (2, (full_blocks - 1) * BLOCK_SIZE_PER_CHANNEL * 8 + 1000 * 8, full_blocks * block_align),
+        # a single, padded block.
+        'one_padded_block': (2, 100 * 8, block_align),
+        # data size not a multiple of the packet size.
+        'partial_last_block': (2, 3 * BLOCK_SIZE_PER_CHANNEL * 8, 3 * block_align + 2000),
+        'mono_padded': (1, 2 * BLOCK_SIZE_PER_CHANNEL * 8 + 123 * 8, 3 * BLOCK_SIZE_PER_CHANNEL),
+    }
+
+
+@pytest.fixture(autouse=True)
+def use_ffmpeg(monkeypatch):
+    monkeypatch.setattr(checksum, 'BIN_FFMPEG', FFMPEG)
+
+
+@pytest.mark.parametrize('name', sorted(layouts().keys()))
+def test_native_matches_ffmpeg(tmp_path, name):
+    channels, sample_count, data_size = layouts()[name]
+    file_path = str(tmp_path / f'{name}.dsf')
+    write_dsf(file_path, channels=channels, sample_count=sample_count, data_size=data_size)
+
+    trim_padding = check_native_raw_stream_checksum(file_path)
+    assert trim_padding is not None, 'neither variant of the native checksum matches ffmpeg'
+
+    expected = get_checksum_in_raw_stream(file_path)
+    assert get_checksum_in_raw_stream(file_path, native=True, trim_padding=trim_padding) == expected
+    assert expected[ChecksumType.RAW_STREAM] == get_raw_stream_sha256(file_path, trim_padding=trim_padding)
+
+
+def test_trim_padding_consistent(tmp_path):
+    # all files with padding need the same `trim_padding` for a given ffmpeg,
+    # so that `dsf_trim_padding` can be set once for a library.
+    results = set()
+    for name, (channels, sample_count, data_size) in layouts().items():
+        file_path = str(tmp_path / f'{name}.dsf')
+        write_dsf(file_path, channels=channels, sample_count=sample_count, data_size=data_size)
+        if get_raw_stream_sha256(file_path, trim_padding=True) != get_raw_stream_sha256(file_path, trim_padding=False):
+            results.add(check_native_raw_stream_checksum(file_path))
+    assert len(results) == 1 and None not in results
@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+
+import pytest
+
+# `scanner_wrapper` imports `manager`, which needs it for the spreadsheet output.
+pytest.importorskip('openpyxl')
+
+from roost import scanner
+from roost.scanner import ScanType
+from roost.scanner_wrapper import scan_one_dir
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    # paths whose checksum was computed, rather than reused.
+    paths = []
+    get_checksum_in_raw_file = scanner.get_checksum_in_raw_file
+
+    def fn(file_name_full):
+        paths.append(file_name_full)
+        return get_checksum_in_raw_file(file_name_full)
+    monkeypatch.setattr(scanner, 'get_checksum_in_raw_file', fn)
+    return paths
+
+
+def write(file_path, content):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as f:
+        f.write(content)
+
+
+def scan(input_dir, output_dir, previous_output_dir=None):
+    scan_one_dir(
+        input_dir=input_dir, output_dir=output_dir, previous_output_dir=previous_output_dir,
+        task=ScanType.CHECKSUM, detect_moves=True, partial_hash_moves=True, progress=None,
+    )
+    rows = dict()
+    with open(os.path.join(output_dir, 'main.json'), 'rt', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            rows[row['path_and_stat']['path']] = row['output']
+    with open(os.path.join(output_dir, 'aux.json'), 'rt', encoding='utf-8') as f:
+        aux = json.load(f)
+    return rows, aux
+
+
+def test_moved_files_reused(tmp_path, extracted):
+    lib = str(tmp_path / 'lib')
+    write(f'{lib}/Album A/01.iso', b'a' * 5000)
+    write(f'{lib}/Album A/02.iso', b'b' * 6000)
+    write(f'{lib}/Old/copied.iso', b'c' * 7000)
+    write(f'{lib}/Old/replaced.iso', b'd' * 8000)
+
+    rows_before, _ = scan(lib, str(tmp_path / 'out1'))
+    assert len(extracted) == 4
+
+    # a renamed directory keeps the inodes of its files.
+    os.rename(f'{lib}/Album A', f'{lib}/Album B')
+    # a copy with its mtime kept only matches by partial checksum.
+    os.makedirs(f'{lib}/New')
+    shutil.copy2(f'{lib}/Old/copied.iso', f'{lib}/New/copied.iso')
+    # same size and mtime, different content.
+    write(f'{lib}/New/replaced.iso', b'e' * 8000)
+    shutil.copystat(f'{lib}/Old/replaced.iso', f'{lib}/New/replaced.iso')
+    # removed only now, so that the new files cannot get their inodes.
+    shutil.rmtree(f'{lib}/Old')
+
+    extracted.clear()
+    rows_after, aux = scan(lib, str(tmp_path / 'out2'), str(tmp_path / 'out1'))
+
+    assert extracted == [f'{lib}/New/replaced.iso']
+    assert sorted((x['from'], x['to']) for x in aux['moved']) == [
+        (f'{lib}/Album A/01.iso', f'{lib}/Album B/01.iso'),
+        (f'{lib}/Album A/02.iso', f'{lib}/Album B/02.iso'),
+        (f'{lib}/Old/copied.iso', f'{lib}/New/copied.iso'),
+    ]
+    assert rows_after[f'{lib}/Album B/01.iso'] == rows_before[f'{lib}/Album A/01.iso']
+    assert rows_after[f'{lib}/New/copied.iso'] == rows_before[f'{lib}/Old/copied.iso']
+    assert rows_after[f'{lib}/New/replaced.iso'] != rows_before[f'{lib}/Old/replaced.iso']
@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+# `scanner_wrapper` imports `manager`, which needs it for the spreadsheet output.
+pytest.importorskip('openpyxl')
+
+from roost import scanner
+from roost.scanner import ScanType
+from roost.scanner_wrapper import scan_one_dir
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    # paths whose checksum was computed, rather than reused.
+    paths = []
+    get_checksum_in_raw_file = scanner.get_checksum_in_raw_file
+
+    def fn(file_name_full):
+        paths.append(file_name_full)
+        return get_checksum_in_raw_file(file_name_full)
+    monkeypatch.setattr(scanner, 'get_checksum_in_raw_file', fn)
+    return paths
+
+
+def scan(input_dir, output_dir, previous_output_dir=None, workers=None):
+    scan_one_dir(
+        input_dir=input_dir, output_dir=output_dir, previous_output_dir=previous_output_dir,
+        task=ScanType.CHECKSUM, on_error='collect', workers=workers, progress=None,
+    )
+    with open(os.path.join(output_dir, 'main.json'), 'rt', encoding='utf-8') as f:
+        paths = [json.loads(line)['path_and_stat']['path'] for line in f]
+    with open(os.path.join(output_dir, 'aux.json'), 'rt', encoding='utf-8') as f:
+        errors = json.load(f)['errors']
+    return paths, {x['path']: x for x in errors}
+
+
+def test_collect_and_retry(tmp_path, hashed):
+    lib = str(tmp_path / 'lib')
+    os.makedirs(f'{lib}/album')
+    good = [f'{lib}/album/{x:02d}.iso' for x in range(3)]
+    for idx, file_path in enumerate(good):
+        with open(file_path, 'wb') as f:
+            f.write(bytes([idx]) * 1000)
+    # not a FLAC file at all.
+    corrupt = f'{lib}/album/corrupt.flac'
+    with open(corrupt, 'wb') as f:
+        f.write(b'not a flac file' * 10)
+    # a leading space.
+    bad_name = f'{lib}/album/ bad name.iso'
+    with open(bad_name, 'wb') as f:
+        f.write(b'x' * 1000)
+
+    paths, errors = scan(lib, str(tmp_path / 'out1'))
+    assert sorted(paths) == good
+    assert errors.keys() == {corrupt, bad_name}
+    assert sorted(hashed) == good
+
+    record = errors[corrupt]
+    assert record['stage'] == 'extract'
+    assert len(record['exception']) >= 1
+    assert all(x.keys() == {'type', 'message'} for x in record['exception'])
+    assert any(x['type'].startswith('mutagen.') for x in record['exception'])
+    assert 'Traceback' in record['traceback']
+    assert record['seconds'] >= 0
+
+    record = errors[bad_name]
+    assert record['exception'][0]['type'] == 'AssertionError'
+    assert 'invalid file name' in record['exception'][0]['message']
+    assert record['seconds'] >= 0
+
+    # the next scan reuses the committed rows, and tries the quarantined files again.
+    hashed.clear()
+    paths_again, errors_again = scan(lib, str(tmp_path / 'out2'), str(tmp_path / 'out1'))
+    assert hashed == []
+    assert sorted(paths_again) == good
+    assert errors_again.keys() == {corrupt, bad_name}
+
+    # once fixed, they are committed.
+    os.remove(corrupt)
+    os.rename(bad_name, f'{lib}/album/bad name.iso')
+    paths_fixed, errors_fixed = scan(lib, str(tmp_path / 'out3'), str(tmp_path / 'out2'))
+    assert hashed == [f'{lib}/album/bad name.iso']
+    assert sorted(paths_fixed) == sorted(good + [f'{lib}/album/bad name.iso'])
+    assert errors_fixed == dict()
+
+
+def test_collect_in_workers(tmp_path):
+    lib = str(tmp_path / 'lib')
+    os.makedirs(lib)
+    with open(f'{lib}/good.iso', 'wb') as f:
+        f.write(b'x' * 1000)
+    with open(f'{lib}/corrupt.flac', 'wb') as f:
+        f.write(b'not a flac file' * 10)
+    paths, errors = scan(lib, str(tmp_path / 'out'), workers=2)
+    assert paths == [f'{lib}/good.iso']
+    assert list(errors) == [f'{lib}/corrupt.flac']
+    assert len(errors[f'{lib}/corrupt.flac']['exception']) >= 1
@@ -0,0 +1,128 @@
+import pickle
+import random
+
+import pytest
+
+# `manager` needs it for the spreadsheet output.
+pytest.importorskip('openpyxl')
+
+from roost.manager import Track, TrackManager
+from roost.metadata.core import Tag
+from roost.metadata.extra import Extra
+from roost.query import And, Eq, In, QueryEngine, Range, at_least, at_most, between
+
+GENRES = ['Jazz', 'Rock', 'Classical', None]
+
+
+def core_row(rng):
+    return {
+        'TITLE': f'title {rng.randrange(1000)}',
+        'ALBUM': f'album {rng.randrange(20)}',
+        'ALBUM_ARTIST': f'artist {rng.randrange(5)}',
+        'GENRE': rng.choice(GENRES),
+        'YEAR': rng.choice([None, *range(1980, 2000)]),
+        'DURATION': rng.choice([None, 100.0, 200.5, 300.25]),
+    }
+
+
+def extra_row(rng):
+    return {
+        'RATING': rng.choice([None, 0, 20, 40, 60, 80, 100]),
+        'LOVE': rng.choice([None, True]),
+        'HATE': rng.choice([None, True]),
+    }
+
+
+def add_tracks(track_manager, rng, start, count):
+    cores = [core_row(rng) for _ in range(count)]
+    extras = [extra_row(rng) for _ in range(count)]
+    track_manager.add_tracks(
+        [f'/music/{x}.flac' for x in range(start, start + count)],
+        [-1] * count,
+        {name: [x[name] for x in cores] for name in cores[0]},
+        {name: [x[name] for x in extras] for name in extras[0]},
+    )
+
+
+def predicates():
+    return [
+        Eq(Tag.GENRE, 'Jazz'),
+        Eq(Tag.GENRE, None),
+        Eq(Extra.LOVE, True),
+        In(Tag.YEAR, [1985, 1990, None]),
+        between(Tag.YEAR, 1985, 1989),
+        at_least(Extra.RATING, 60),
+        at_most(Tag.DURATION, 200.5),
+        Range(Tag.YEAR, 1990, 1995, lo_inclusive=False, hi_inclusive=False),
+        ~Eq(Extra.HATE, True),
+        Eq(Tag.GENRE, 'Rock') | Eq(Tag.GENRE, 'Classical'),
+        Eq(Tag.GENRE, 'Jazz') & between(Tag.YEAR, 1990, 1999) & ~Eq(Extra.HATE, True),
+        And(Eq(Tag.ALBUM_ARTIST, 'artist 1'), Eq(Extra.LOVE, True) | at_least(Extra.RATING, 80)),
+        # an unknown value, and a field no track has.
+        Eq(Tag.GENRE, 'Polka'),
+        Eq(Tag.COMPOSER, None),
+    ]
+
+
+def check_all(engine):
+    ids = range(len(engine.track_manager.store))
+    for predicate in predicates():
+        expected = [x for x in ids if predicate.match(engine, x)]
+        assert engine.query(predicate) == expected, predicate
+
+
+def test_query_matches_brute_force():
+    rng = random.Random(0)
+    track_manager = TrackManager()
+    add_tracks(track_manager, rng, 0, 500)
+    # some fields indexed right away, the others on first use.
+    engine = QueryEngine(track_manager, fields=[Tag.GENRE, Extra.RATING])
+    check_all(engine)
+
+    # indexes are updated as tracks are added, in bulk and one by one.
+    add_tracks(track_manager, rng, 500, 300)
+    check_all(engine)
+    for x in range(800, 850):
+        track_manager.add_track(
+            Track(file_path=f'/music/{x}.flac', core_metadata=core_row(rng), extra_metadata=extra_row(rng))
+        )
+    check_all(engine)
+
+
+def test_query_after_set():
+    rng = random.Random(1)
+    track_manager = TrackManager()
+    add_tracks(track_manager, rng, 0, 200)
+    engine = QueryEngine(track_manager)
+    check_all(engine)
+
+    for track_id in rng.sample(range(200), 50):
+        track = track_manager.track(track_id)
+        track.core_metadata['GENRE'] = rng.choice(GENRES)
+        track.core_metadata['YEAR'] = rng.choice([None, 1970, 1990, 2001])
+        track.extra_metadata['LOVE'] = rng.choice([None, True])
+    check_all(engine)
+    assert engine.query(Eq(Tag.YEAR, 1970)) == [
+        x for x in range(200) if track_manager.track(x).core_metadata['YEAR'] == 1970
+    ]
+
+
+def test_plan_most_selective_first():
+    rng = random.Random(2)
+    track_manager = TrackManager()
+    add_tracks(track_manager, rng, 0, 400)
+    engine = QueryEngine(track_manager)
+    predicate = ~Eq(Extra.HATE, True) & Eq(Tag.ALBUM, 'album 3') & Eq(Tag.GENRE, 'Jazz')
+    estimates = [estimate for _, estimate in engine.explain(predicate)]
+    assert estimates == sorted(estimates)
+    assert engine.explain(predicate)[0][0] == "Eq(ALBUM, 'album 3')"
+
+
+def test_pickled_store_keeps_no_engine():
+    rng = random.Random(3)
+    track_manager = TrackManager()
+    add_tracks(track_manager, rng, 0, 10)
+    QueryEngine(track_manager, fields=[Tag.GENRE])
+    loaded = pickle.loads(pickle.dumps(track_manager))
+    assert loaded.store.on_set == []
+    assert loaded.store.columns['core']['GENRE'].to_list() == track_manager.store.columns['core']['GENRE'].to_list()
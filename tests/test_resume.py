@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import sys
+from os import path
+
+import pytest
+
+# `scanner_wrapper` imports `manager`, which needs it for the spreadsheet output.
+pytest.importorskip('openpyxl')
+
+from roost import scanner
+from roost.scanner import ScanType
+from roost.scanner_wrapper import scan_one_dir
+
+REPO_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+
+# a scan that dies without any cleanup while hashing its `crash_after`-th file,
+# after appending half a row to `main.json`, as if the process was killed in the middle of a write.
+CRASHING_SCAN = '''
+import os, sys
+sys.path.insert(0, {repo_dir!r})
+from roost import scanner
+from roost.scanner_wrapper import scan_one_dir
+
+calls = [0]
+get_checksum_in_raw_file = scanner.get_checksum_in_raw_file
+
+def crash(file_name_full):
+    calls[0] += 1
+    if calls[0] == {crash_after}:
+        with open(os.path.join({output_dir!r}, 'main.json'), 'ab') as f:
+            f.write(b'{{"path_and_stat": {{"path": "/half')
+        os._exit(1)
+    return get_checksum_in_raw_file(file_name_full)
+
+scanner.get_checksum_in_raw_file = crash
+scan_one_dir(
+    input_dir={input_dir!r}, output_dir={output_dir!r}, task=scanner.ScanType.CHECKSUM,
+    stream=True, checkpoint_every=3, progress=None,
+)
+'''
+
+
+def make_lib(lib):
+    paths = []
+    for album in range(3):
+        os.makedirs(f'{lib}/album {album}')
+        for track in range(5):
+            file_path = f'{lib}/album {album}/{track:02d}.iso'
+            with open(file_path, 'wb') as f:
+                f.write(bytes([album, track]) * (100 + track))
+            paths.append(file_path)
+    return paths
+
+
+def read(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def test_resume_after_crash(tmp_path, monkeypatch):
+    lib = str(tmp_path / 'lib')
+    paths = make_lib(lib)
+
+    full_dir = str(tmp_path / 'full')
+    scan_one_dir(input_dir=lib, output_dir=full_dir, task=ScanType.CHECKSUM, stream=True, progress=None)
+
+    output_dir = str(tmp_path / 'resumed')
+    ret = subprocess.run(
+        [sys.executable, '-c', CRASHING_SCAN.format(
+            repo_dir=REPO_DIR, input_dir=lib, output_dir=output_dir, crash_after=9,
+        )],
+    )
+    assert ret.returncode == 1
+    with open(path.join(output_dir, 'checkpoint.json'), 'rt', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    assert not checkpoint['complete']
+    assert checkpoint['rows'] == 6
+    # the half row, and whatever was not flushed, is after the checkpoint.
+    assert read(path.join(output_dir, 'main.json')).endswith(b'"/half')
+    assert checkpoint['main_json_bytes'] < path.getsize(path.join(output_dir, 'main.json'))
+
+    hashed = []
+    get_checksum_in_raw_file = scanner.get_checksum_in_raw_file
+
+    def fn(file_name_full):
+        hashed.append(file_name_full)
+        return get_checksum_in_raw_file(file_name_full)
+    monkeypatch.setattr(scanner, 'get_checksum_in_raw_file', fn)
+    scan_one_dir(
+        input_dir=lib, output_dir=output_dir, task=ScanType.CHECKSUM,
+        stream=True, resume=True, checkpoint_every=3, progress=None,
+    )
+
+    # the files committed before the checkpoint are skipped.
+    with open(path.join(full_dir, 'main.json'), 'rt', encoding='utf-8') as f:
+        walk_order = [json.loads(line)['path_and_stat']['path'] for line in f]
+    assert sorted(walk_order) == paths
+    assert hashed == walk_order[6:]
+    assert read(path.join(output_dir, 'main.json')) == read(path.join(full_dir, 'main.json'))
+    with open(path.join(output_dir, 'checkpoint.json'), 'rt', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    assert checkpoint['complete'] and checkpoint['rows'] == len(paths)
+    with open(path.join(output_dir, 'main.index.json'), 'rt', encoding='utf-8') as f:
+        index_rows = json.load(f)['rows']
+    with open(path.join(full_dir, 'main.index.json'), 'rt', encoding='utf-8') as f:
+        assert index_rows == json.load(f)['rows']
+    assert not path.exists(path.join(output_dir, 'main.index.json.rows'))
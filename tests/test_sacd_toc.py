@@ -0,0 +1,238 @@
+import os
+from struct import pack_into
+
+import pytest
+
+from roost import BIN_SACDEXTRACT
+from roost.metadata import ExtractionError
+from roost.metadata.core import Tag
+from roost.metadata.core.sacdiso import (
+    fetch_album_and_area, fetch_sacd_xml, get_meta_data_sacd_iso, get_total_tracks, sacd_xml_from_text,
+)
+from roost.metadata.core.sacdtoc import (
+    GENRES, MASTER_TEXT_SECTOR, MASTER_TOC_SECTOR, SACD_SECTOR_SIZE,
+    TRACK_TEXT_COMPOSER, TRACK_TEXT_PERFORMER, TRACK_TEXT_TITLE, read_sacd_toc,
+)
+
+AREA_2CH_START = 544
+# the area TOC itself, then the track list, ISRC and genre, and track text sectors.
+AREA_2CH_SIZE = 4
+
+# character sets of the locale tables, as in Scarletbook.
+LATIN_1 = 2
+SHIFT_JIS = 3
+
+
+def genre_table(genre):
+    # category (1), reserved (2), genre (1).
+    return bytes([1, 0, 0, GENRES.index(genre) if genre is not None else 0])
+
+
+def track_text(items, encoding):
+    # item count (1), reserved (3), then for each item: text type (1), padding (1), the string and its zero,
+    # and zero padding to 4 bytes.
+    ret = bytearray([len(items), 0, 0, 0])
+    for text_type, text in items:
+        ret += bytes([text_type, 0x20]) + text.encode(encoding) + b'\x00'
+        ret += b'\x00' * (-len(ret) % 4)
+    return bytes(ret)
+
+
+def write_sacd_iso(file_path, disc):
+    """an ISO with only the Master TOC, the master text and the 2-channel Area TOC sectors filled in,
+    with the layout of `master_toc_t`, `master_text_t`, `area_toc_t`, `area_tracklist_time_t`,
+    `area_isrc_genre_t` and `area_text_t` of Scarletbook."""
+    encoding = disc['encoding']
+    tracks = disc['tracks']
+    data = bytearray(SACD_SECTOR_SIZE * (AREA_2CH_START + AREA_2CH_SIZE))
+
+    master = MASTER_TOC_SECTOR * SACD_SECTOR_SIZE
+    data[master:master + 8] = b'SACDMTOC'
+    pack_into('>HH', data, master + 16, disc['set_size'], disc['sequence_number'])
+    data[master + 40:master + 44] = genre_table(disc['album_genre'])
+    pack_into('>I', data, master + 64, AREA_2CH_START)
+    pack_into('>H', data, master + 84, AREA_2CH_SIZE)
+    pack_into('>HBB', data, master + 120, disc['year'], 1, 1)
+    # the first locale: language code (2), character set (1), reserved (1).
+    data[master + 136:master + 140] = b'en' + bytes([disc['charset'], 0])
+
+    text = MASTER_TEXT_SECTOR * SACD_SECTOR_SIZE
+    data[text:text + 8] = b'SACDText'
+    title = disc['album_title'].encode(encoding) + b'\x00'
+    artist = disc['album_artist'].encode(encoding) + b'\x00'
+    pack_into('>HH', data, text + 16, 64, 64 + len(title))
+    data[text + 64:text + 64 + len(title) + len(artist)] = title + artist
+
+    area = AREA_2CH_START * SACD_SECTOR_SIZE
+    data[area:area + 8] = b'TWOCHTOC'
+    data[area + 69] = len(tracks)
+    data[area + 88:area + 92] = b'en' + bytes([disc['charset'], 0])
+
+    track_list = area + SACD_SECTOR_SIZE
+    data[track_list:track_list + 8] = b'SACDTRL2'
+    start = 0
+    for idx, track in enumerate(tracks):
+        minutes, seconds, frames = track['duration']
+        # start, then duration, each as minutes, seconds, frames and flags.
+        pack_into('>BBBB', data, track_list + 8 + idx * 4, start // 4500, start // 75 % 60, start % 75, 0)
+        pack_into('>BBBB', data, track_list + 8 + 255 * 4 + idx * 4, minutes, seconds, frames, 0)
+        start += (minutes * 60 + seconds) * 75 + frames
+
+    isrc_genre = area + 2 * SACD_SECTOR_SIZE
+    data[isrc_genre:isrc_genre + 8] = b'SACD_IGL'
+    for idx, track in enumerate(tracks):
+        offset = isrc_genre + 8 + 255 * 12 + idx * 4
+        data[offset:offset + 4] = genre_table(track['genre'])
+
+    texts = area + 3 * SACD_SECTOR_SIZE
+    data[texts:texts + 8] = b'SACDTTxt'
+    # positions of the track texts, relative to the sector.
+    position = 8 + 255 * 2
+    for idx, track in enumerate(tracks):
+        items = [
+            (text_type, track[name]) for text_type, name in [
+                (TRACK_TEXT_TITLE, 'title'), (TRACK_TEXT_PERFORMER, 'performer'), (TRACK_TEXT_COMPOSER, 'composer'),
+            ] if track[name] is not None
+        ]
+        if len(items) == 0:
+            continue
+        item_data = track_text(items, encoding)
+        pack_into('>H', data, texts + 8 + idx * 2, position)
+        data[texts + position:texts + position + len(item_data)] = item_data
+        position += len(item_data)
+    assert position <= SACD_SECTOR_SIZE
+
+    with open(file_path, 'wb') as f:
+        f.write(data)
+
+
+def sacd_extract_xml(disc):
+    """what sacd_extract exports for `disc`: an `Album` element, and an `Area` element of tracks for each area,
+    each track with a `Meta` element per field."""
+    def meta(name, value):
+        if value is None:
+            return ''
+        value = value.replace('&', '&amp;').replace('"', '&quot;').replace('<', '&lt;')
+        return f'<Meta name="{name}" value="{value}"/>'
+
+    tracks = []
+    for idx, track in enumerate(disc['tracks']):
+        tracks.append(
+            '<Track>' + ''.join([
+                meta('TITLE', track['title']),
+                meta('PERFORMER', track['performer']),
+                meta('ALBUM', disc['album_title']),
+                meta('ALBUM ARTIST', disc['album_artist']),
+                meta('DATE', str(disc['year']) if disc['year'] else None),
+                meta('TRACKNUMBER', str(idx + 1)),
+                meta('TOTALTRACKS', str(len(disc['tracks']))),
+                meta('GENRE', track['genre'] or disc['album_genre']),
+                meta('COMPOSER', track['composer']),
+                meta('Duration', '{:02d}:{:02d}:{:02d}'.format(*track['duration'])),
+            ]) + '</Track>'
+        )
+    return sacd_xml_from_text(
+        '<SACD>'
+        f'<Album set_size="{disc["set_size"]}" sequence_number="{disc["sequence_number"]}"/>'
+        f'<Area speaker_configuration="2 Channel" totaltracks="{len(tracks)}">{"".join(tracks)}</Area>'
+        '</SACD>'
+    )
+
+
+DISCS = {
+    'latin-1': {
+        'charset': LATIN_1,
+        'encoding': 'latin-1',
+        'set_size': 2,
+        'sequence_number': 1,
+        'album_genre': 'Classical',
+        'year': 2004,
+        'album_title': 'Dvorák: Symphonies Nos. 7 & 8',
+        'album_artist': 'Orchestre de la Suisse Romande',
+        'tracks': [
+            {
+                'title': 'Allegro ma non tanto', 'performer': 'Orchestre de la Suisse Romande',
+                'composer': 'Antonín Dvorák', 'genre': None, 'duration': (12, 3, 40),
+            },
+            {
+                'title': 'Adagio - Poco più mosso', 'performer': 'Orchestre de la Suisse Romande',
+                'composer': None, 'genre': 'Opera', 'duration': (9, 59, 74),
+            },
+            {
+                # no text at all.
+                'title': None, 'performer': None, 'composer': None, 'genre': None, 'duration': (0, 45, 0),
+            },
+        ],
+    },
+    'shift_jis': {
+        'charset': SHIFT_JIS,
+        'encoding': 'shift_jis',
+        'set_size': 1,
+        'sequence_number': 1,
+        'album_genre': 'Jazz',
+        # no year.
+        'year': 0,
+        'album_title': 'ジャズ・スタンダード集',
+        'album_artist': '山田太郎トリオ',
+        'tracks': [
+            {
+                'title': '枯葉', 'performer': '山田太郎トリオ', 'composer': 'ジョセフ・コズマ',
+                'genre': None, 'duration': (6, 12, 5),
+            },
+            {
+                'title': '朝日のごとくさわやかに', 'performer': '山田太郎', 'composer': None,
+                'genre': 'Blues', 'duration': (7, 0, 1),
+            },
+        ],
+    },
+}
+
+
+@pytest.fixture(params=sorted(DISCS))
+def disc(request):
+    return DISCS[request.param]
+
+
+def test_native_matches_sacd_extract_xml(tmp_path, disc):
+    file_path = str(tmp_path / 'disc.iso')
+    write_sacd_iso(file_path, disc)
+    native = fetch_sacd_xml(file_path, native=True)
+    expected = sacd_extract_xml(disc)
+
+    album, area = fetch_album_and_area(native)
+    album_expected, area_expected = fetch_album_and_area(expected)
+    assert album.attrib == album_expected.attrib
+    assert area.attrib == area_expected.attrib
+    assert [
+        [(x.attrib['name'], x.attrib['value']) for x in track] for track in area
+    ] == [
+        [(x.attrib['name'], x.attrib['value']) for x in track] for track in area_expected
+    ]
+
+    assert get_total_tracks(file_path, xml_obj=native) == len(disc['tracks'])
+    rows = get_meta_data_sacd_iso(file_path, xml_obj=native)
+    assert rows == get_meta_data_sacd_iso(file_path, xml_obj=expected)
+    assert rows[0][Tag.ALBUM] == disc['album_title']
+    assert rows[0][Tag.DISC_TOTAL] == disc['set_size']
+    assert rows[0][Tag.YEAR] == (disc['year'] or None)
+    assert [x[Tag.TITLE] for x in rows] == [x['title'] for x in disc['tracks']]
+    assert [x[Tag.COMPOSER] for x in rows] == [x['composer'] for x in disc['tracks']]
+    assert [x[Tag.GENRE] for x in rows] == [x['genre'] or disc['album_genre'] for x in disc['tracks']]
+
+
+@pytest.mark.skipif(not os.path.exists(BIN_SACDEXTRACT), reason='sacd_extract not available')
+def test_native_matches_sacd_extract(tmp_path, disc):
+    file_path = str(tmp_path / 'disc.iso')
+    write_sacd_iso(file_path, disc)
+    assert get_meta_data_sacd_iso(file_path, xml_obj=fetch_sacd_xml(file_path, native=True)) == (
+        get_meta_data_sacd_iso(file_path, xml_obj=fetch_sacd_xml(file_path))
+    )
+
+
+def test_unusual_layout_not_native(tmp_path):
+    # no Master TOC: left to sacd_extract.
+    file_path = str(tmp_path / 'disc.iso')
+    with open(file_path, 'wb') as f:
+        f.write(b'\x00' * SACD_SECTOR_SIZE * (MASTER_TEXT_SECTOR + 1))
+    with pytest.raises(ExtractionError):
+        read_sacd_toc(file_path)
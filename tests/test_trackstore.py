@@ -0,0 +1,39 @@
+from array import array
+
+from roost.columnar import INT64_NULL
+from roost.trackstore import Column, Encoded
+
+
+def test_encoded_str_into_empty_column():
+    column = Column(str)
+    column.extend(Encoded('str', memoryview(array('i', [0, 1, -1, 0])), ['a', 'b']))
+    assert column.to_list() == ['a', 'b', None, 'a']
+
+
+def test_encoded_str_remapped():
+    column = Column(str)
+    column.extend(['b', None])
+    # 'a' and 'a' again, e.g., two spellings normalized to the same string.
+    column.extend(Encoded('str', memoryview(array('i', [2, 0, -1, 1])), ['a', 'b', 'a']))
+    assert column.to_list() == ['b', None, 'a', 'a', None, 'b']
+    assert column.strings.values == ['b', 'a']
+
+
+def test_encoded_numbers():
+    column = Column(int)
+    column.extend([1, None])
+    column.extend(Encoded('int', memoryview(array('q', [INT64_NULL, 3]))))
+    assert column.to_list() == [1, None, None, 3]
+
+    column = Column(bool)
+    column.extend(Encoded('bool', memoryview(array('b', [1, -1, 0]))))
+    assert column.to_list() == [True, None, False]
+
+
+def test_encoded_other_kind():
+    # ints in a float field do not fit, as with a list.
+    column = Column(float)
+    column.extend([0.5])
+    column.extend(Encoded('int', memoryview(array('q', [2, INT64_NULL]))))
+    assert column.kind == 'object'
+    assert column.to_list() == [0.5, 2, None]
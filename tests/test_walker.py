@@ -0,0 +1,20 @@
+from roost.walker import IgnoreRules
+
+
+def test_prefix_rule_matches_descendants():
+    rules = IgnoreRules(prefixes=['/a/DSD'])
+    assert rules.matches('/a/DSD')
+    assert rules.matches('/a/DSD_Test')
+    assert rules.matches('/a/DSD_Test/sub')
+    assert rules.matches('/a/DSD_Test/sub/deeper')
+    assert not rules.matches('/a')
+    assert not rules.matches('/a/Music/DSD_Test')
+    assert not rules.matches('/b/DSD_Test/sub')
+
+
+def test_exact_and_pattern_rules_match_descendants():
+    rules = IgnoreRules(paths=['/a/skip'], patterns=['/a/*/tmp'])
+    assert rules.matches('/a/skip/sub')
+    assert rules.matches('/a/x/tmp')
+    assert rules.matches('/a/x/tmp/sub')
+    assert not rules.matches('/a/skipped')